@@ -1,16 +1,68 @@
 import os
+import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ['DFD_EDIT_SECRET_KEY']
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DFD_EDIT_DATABASE_URI', 'sqlite:///site.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connection pool, unset options keep the driver defaults (no pool for a SQLite file)
+engine_options = {}
+for option, variable, parse in [('pool_size', 'DFD_EDIT_DB_POOL_SIZE', int),
+                                ('max_overflow', 'DFD_EDIT_DB_MAX_OVERFLOW', int),
+                                ('pool_timeout', 'DFD_EDIT_DB_POOL_TIMEOUT', float),
+                                ('pool_recycle', 'DFD_EDIT_DB_POOL_RECYCLE', int)]:
+    if variable in os.environ:
+        engine_options[option] = parse(os.environ[variable])
+
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Pooled connections are shared between request threads
+    if engine_options.get('pool_size'):
+        engine_options['poolclass'] = QueuePool
+        engine_options['connect_args'] = {'check_same_thread': False}
+else:
+    # Server databases drop idle connections
+    engine_options['pool_pre_ping'] = True
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+# SQLite journal mode, WAL lets readers run alongside the single writer
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get(
+    'DFD_EDIT_SQLITE_JOURNAL_MODE', 'WAL')
+
+# Milliseconds a SQLite connection waits for the writer lock before failing
+app.config['SQLITE_BUSY_TIMEOUT'] = int(
+    os.environ.get('DFD_EDIT_SQLITE_BUSY_TIMEOUT', '5000'))
+
+# Store graph xml compressed and de-duplicated by content hash
+app.config['XML_BLOB_STORE'] = os.environ.get(
+    'DFD_EDIT_XML_BLOB_STORE', '0') == '1'
+
+# Seconds a diagram permission check is cached process wide, 0 disables
+app.config['PERMISSION_CACHE_TTL'] = float(
+    os.environ.get('DFD_EDIT_PERMISSION_CACHE_TTL', '0'))
+
+# Gzip (or Brotli, when installed) text responses and static files
+app.config['COMPRESSION'] = os.environ.get(
+    'DFD_EDIT_COMPRESSION', '1') == '1'
+
+# Record request, SQL and span timings, reported in Server-Timing headers and at /metrics
+app.config['INSTRUMENTATION'] = os.environ.get(
+    'DFD_EDIT_INSTRUMENTATION', '0') == '1'
+
+# Check saved diagrams against the DFD rules: off, report (listed in the save response) or reject
+app.config['VALIDATE_ON_SAVE'] = os.environ.get(
+    'DFD_EDIT_VALIDATE_ON_SAVE', 'report')
+
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
@@ -18,4 +70,24 @@ login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode={}'.format(
+        app.config['SQLITE_JOURNAL_MODE']))
+    journal_mode, = cursor.fetchone()
+    if journal_mode.lower() == 'wal':
+        # Only the last commits are at risk on power loss in WAL mode
+        cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout={:d}'.format(
+        app.config['SQLITE_BUSY_TIMEOUT']))
+    cursor.execute('PRAGMA cache_size=-20000')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
+from App import compression
+from App import instrumentation
 from App import routes
@@ -0,0 +1,466 @@
+#=== Back up, migrate, seed and export whole diagram libraries ===#
+# Usage: python -m App.cli export <archive> [diagram id ...]
+#        python -m App.cli import <archive>
+#        python -m App.cli rdf [--format turtle|nt] [--merged] [--workers N] <directory or dataset> [diagram id ...]
+# Archives hold one JSON record per line, gzip compressed when the name ends in .gz.
+import argparse
+import base64
+import gzip
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from sqlalchemy import func, text
+from App import app, db
+from App.models import (User, DataFlowDiagram, XmlBlob, Graph, GraphChildren, SearchTerm, Invitation, Edit,
+                        Revision)
+from App.utils import CHUNK_SIZE, get_graph_tree, load_hierarchies, xml_model_hash
+from App.search import graph_term_rows
+from App.exporter import (EXPORT_WORKERS, MalformedGraph, diagram_graph_iri, export_diagram_rdf,
+                          iter_turtle_prefixes, start_process_pool)
+
+ARCHIVE_FORMAT = 1
+
+# Diagrams read per query on export
+EXPORT_BATCH_SIZE = 100
+
+# Rows buffered before a batched insert on import
+INSERT_BATCH_SIZE = 2000
+
+# Formats datetime.isoformat writes, with and without microseconds
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+DATETIME_FORMAT_SECONDS = '%Y-%m-%dT%H:%M:%S'
+
+# Gzip level of compressed archives, higher levels barely shrink them further but export slower
+ARCHIVE_GZIP_LEVEL = 6
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 5
+
+# Archive record types, other than the header and end records
+RECORD_TYPES = ['user', 'graph', 'diagram', 'invitation', 'revision', 'edit']
+
+# Tables in insert order, so rows are only inserted after the rows they reference
+TABLES = [User, XmlBlob, Graph, GraphChildren, SearchTerm, DataFlowDiagram, Invitation, Revision, Edit]
+
+
+def open_archive(path, mode):
+    if path == '-':
+        return sys.stdout if mode == 'w' else sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', compresslevel=ARCHIVE_GZIP_LEVEL, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def encode_datetime(value):
+    return value.isoformat() if value is not None else None
+
+
+def decode_datetime(value):
+    if value is None:
+        return None
+    return datetime.strptime(value, DATETIME_FORMAT if '.' in value else DATETIME_FORMAT_SECONDS)
+
+
+class Progress:
+    # Reports counts to stderr every few seconds
+    def __init__(self, action, names=RECORD_TYPES):
+        self.action = action    # Export or Import
+        self.counts = dict.fromkeys(names, 0)
+        self.start = self.reported = time.perf_counter()
+
+    def add(self, name, count=1):
+        self.counts[name] += count
+        if time.perf_counter() - self.reported > PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self, done=False):
+        self.reported = time.perf_counter()
+        elapsed = self.reported - self.start
+        print('{}{} {:.1f} s ({:.0f} graphs/s): {}'.format(
+            self.action, 'ed in' if done else 'ing,', elapsed, self.counts['graph'] / elapsed if elapsed else 0,
+            ', '.join('{} {}s'.format(count, name) for name, count in self.counts.items())), file=sys.stderr)
+
+
+#=== Export ===#
+
+def iter_batches(query, column):
+    # Keyset pages of a query ordered by an integer id column
+    last_id = 0
+    while True:
+        batch = query.filter(column > last_id).order_by(column).limit(EXPORT_BATCH_SIZE).all()
+        if not batch:
+            return
+        yield batch
+        last_id = getattr(batch[-1], column.key)
+
+
+def iter_user_records():
+    for batch in iter_batches(User.query, User.id):
+        for user in batch:
+            yield {'type': 'user', 'id': user.id, 'username': user.username, 'email': user.email,
+                   'password': user.password}
+        db.session.expunge_all()
+
+
+def iter_diagram_records(diagram_ids):
+    # Each diagram's graphs come before it, its invitations, revisions and edits after it
+    query = DataFlowDiagram.query
+    if diagram_ids:
+        query = query.filter(DataFlowDiagram.id.in_(diagram_ids))
+
+    for batch in iter_batches(query, DataFlowDiagram.id):
+        for diagram in batch:
+            # Parents before their children, so imports insert them first
+            children = {}
+            for graph, parent in get_graph_tree(diagram.graph):
+                children.setdefault(parent, []).append(graph)
+            pending = deque((graph, None, 0) for graph in children[None])
+            while pending:
+                graph, parent, position = pending.popleft()
+                yield {'type': 'graph', 'id': graph.id, 'parent': parent, 'position': position,
+                       'title': graph.title, 'level': graph.level, 'version': graph.version,
+                       'xml_model': graph.xml_model}
+                pending.extend((child, graph.id, child_position)
+                               for child_position, child in enumerate(children.get(graph.id, ())))
+            db.session.expunge_all()
+            yield {'type': 'diagram', 'id': diagram.id, 'title': diagram.title, 'graph': diagram.graph,
+                   'author': diagram.author, 'created_on': encode_datetime(diagram.created_on)}
+
+        ids = [diagram.id for diagram in batch]
+        for invitation in Invitation.query.filter(Invitation.invited_to.in_(ids)):
+            yield {'type': 'invitation', 'invited_user': invitation.invited_user,
+                   'invited_to': invitation.invited_to, 'invited_on': encode_datetime(invitation.invited_on)}
+        for revision in Revision.query.filter(Revision.diagram.in_(ids)).order_by(Revision.id).yield_per(
+                EXPORT_BATCH_SIZE):
+            yield {'type': 'revision', 'id': revision.id, 'diagram': revision.diagram, 'number': revision.number,
+                   'snapshot': revision.snapshot, 'data': base64.b64encode(revision.data).decode('ascii')}
+            # Revisions hold a compressed hierarchy each, so are released as they are written
+            db.session.expunge(revision)
+        for edit in Edit.query.filter(Edit.edited_diagram.in_(ids)).order_by(Edit.id).yield_per(
+                EXPORT_BATCH_SIZE):
+            yield {'type': 'edit', 'id': edit.id, 'editor': edit.editor, 'edited_diagram': edit.edited_diagram,
+                   'message': edit.message, 'edited_on': encode_datetime(edit.edited_on),
+                   'revision': edit.revision}
+        db.session.expunge_all()
+
+
+def export_archive(path, diagram_ids):
+    progress = Progress('Export')
+    archive = open_archive(path, 'w')
+    try:
+        archive.write(json.dumps({'type': 'header', 'format': ARCHIVE_FORMAT,
+                                  'exported_on': encode_datetime(datetime.utcnow())}) + '\n')
+        for records in [iter_user_records(), iter_diagram_records(diagram_ids)]:
+            for record in records:
+                archive.write(json.dumps(record, separators=(',', ':')) + '\n')
+                progress.add(record['type'])
+        # Marks a complete archive, imports of truncated archives are reported
+        archive.write(json.dumps({'type': 'end', 'counts': progress.counts}) + '\n')
+    finally:
+        if archive is not sys.stdout:
+            archive.close()
+    progress.report(done=True)
+
+
+#=== Import ===#
+
+class Importer:
+    # Inserts archive records in batches, shifting ids past the ids already in use.
+    # Nothing is committed until finish, so a failed import leaves the database as it was.
+    def __init__(self):
+        self.offsets = {model: db.session.query(func.coalesce(func.max(model.id), 0)).scalar()
+                        for model in [User, Graph, DataFlowDiagram, Revision, Edit]}
+        # Archive user ids to the ids of their accounts, existing accounts are matched by email
+        self.user_ids = {}
+        self.pending_users = []
+        # Usernames of the imported users, and (old, new username, email) of those renamed
+        self.usernames = set()
+        self.renamed = []
+        self.rows = {model: [] for model in TABLES}
+        self.buffered = 0
+
+    def new_id(self, model, id):
+        return id + self.offsets[model] if id is not None else None
+
+    def add(self, model, row):
+        self.rows[model].append(row)
+        self.buffered += 1
+        if self.buffered >= INSERT_BATCH_SIZE:
+            self.flush()
+
+    def add_user(self, record):
+        self.pending_users.append(record)
+        if len(self.pending_users) >= CHUNK_SIZE:
+            self.flush_users()
+
+    def flush_users(self):
+        records, self.pending_users = self.pending_users, []
+        existing = dict(db.session.query(User.email, User.id).filter(
+            User.email.in_([record['email'] for record in records])))
+        taken = {username for username, in db.session.query(User.username).filter(
+            User.username.in_([record['username'] for record in records if record['email'] not in existing]))}
+        for record in records:
+            if record['email'] in existing:
+                self.user_ids[record['id']] = existing[record['email']]
+                continue
+
+            # Usernames are unique too, an account with another email may have it
+            username = record['username']
+            if username in taken or username in self.usernames:
+                username = self.free_username(username)
+                self.renamed.append((record['username'], username, record['email']))
+            self.usernames.add(username)
+            self.user_ids[record['id']] = self.new_id(User, record['id'])
+            self.add(User, {'id': self.user_ids[record['id']], 'username': username,
+                            'email': record['email'], 'password': record['password']})
+
+    def free_username(self, username):
+        # Username with the first -n suffix no account or imported user has, cut to fit the column
+        for n in itertools.count(2):
+            suffix = '-{}'.format(n)
+            candidate = username[:User.username.type.length - len(suffix)] + suffix
+            if candidate not in self.usernames and db.session.query(User.id).filter(
+                    User.username == candidate).first() is None:
+                return candidate
+
+    def add_graph(self, record):
+        graph_id = self.new_id(Graph, record['id'])
+        self.add(Graph, {'id': graph_id, 'title': record['title'], 'level': record['level'],
+                         'version': record['version'], 'xml_model': record['xml_model'], 'xml_hash': None})
+        if record['parent'] is not None:
+            # Older archives have no positions, their children keep their id order
+            self.add(GraphChildren, {'parent': self.new_id(Graph, record['parent']), 'child': graph_id,
+                                     'position': record.get('position', 0)})
+        # Archives hold no search index, it is built from the xml as graphs are imported
+        for row in graph_term_rows(graph_id, record['xml_model']):
+            self.add(SearchTerm, row)
+
+    def store_xml_blobs(self, graphs):
+        # Move the xml of the graphs into the blob store, only adding blobs not stored yet
+        xml_models = {}
+        for graph in graphs:
+            graph['xml_hash'] = xml_model_hash(graph['xml_model'])
+            xml_models[graph['xml_hash']] = graph['xml_model']
+            graph['xml_model'] = ''
+        hashes = list(xml_models)
+        for i in range(0, len(hashes), CHUNK_SIZE):
+            for xml_hash, in db.session.query(XmlBlob.hash).filter(XmlBlob.hash.in_(hashes[i:i + CHUNK_SIZE])):
+                del xml_models[xml_hash]
+        self.rows[XmlBlob].extend({'hash': blob.hash, 'data': blob.data} for blob in (
+            XmlBlob.from_xml_model(xml_hash, xml_model) for xml_hash, xml_model in xml_models.items()))
+
+    def flush(self):
+        if self.pending_users:
+            self.flush_users()
+        if app.config['XML_BLOB_STORE'] and self.rows[Graph]:
+            self.store_xml_blobs(self.rows[Graph])
+
+        for model in TABLES:
+            if self.rows[model]:
+                db.session.execute(model.__table__.insert(), self.rows[model])
+                self.rows[model] = []
+        self.buffered = 0
+
+    def finish(self):
+        self.flush()
+        if db.engine.dialect.name == 'postgresql':
+            # Explicit ids don't advance the sequences
+            for model in [User, Graph, DataFlowDiagram, Revision, Edit]:
+                table = model.__table__.name
+                db.session.execute(text("SELECT setval(pg_get_serial_sequence('\"{0}\"', 'id'), "
+                                        "COALESCE((SELECT MAX(id) FROM \"{0}\"), 1))".format(table)))
+        db.session.commit()
+
+    def add_record(self, record):
+        record_type = record['type']
+        if record_type == 'user':
+            self.add_user(record)
+        elif record_type == 'graph':
+            self.add_graph(record)
+        else:
+            if self.pending_users:
+                # Diagram records reference users by their new ids
+                self.flush_users()
+            if record_type == 'diagram':
+                self.add(DataFlowDiagram, {
+                    'id': self.new_id(DataFlowDiagram, record['id']), 'title': record['title'],
+                    'graph': self.new_id(Graph, record['graph']), 'author': self.user_ids[record['author']],
+                    'created_on': decode_datetime(record['created_on'])})
+            elif record_type == 'invitation':
+                self.add(Invitation, {
+                    'invited_user': self.user_ids[record['invited_user']],
+                    'invited_to': self.new_id(DataFlowDiagram, record['invited_to']),
+                    'invited_on': decode_datetime(record['invited_on'])})
+            elif record_type == 'revision':
+                self.add(Revision, {
+                    'id': self.new_id(Revision, record['id']),
+                    'diagram': self.new_id(DataFlowDiagram, record['diagram']), 'number': record['number'],
+                    'snapshot': record['snapshot'], 'data': base64.b64decode(record['data'])})
+            elif record_type == 'edit':
+                self.add(Edit, {
+                    'id': self.new_id(Edit, record['id']), 'editor': self.user_ids[record['editor']],
+                    'edited_diagram': self.new_id(DataFlowDiagram, record['edited_diagram']),
+                    'message': record['message'], 'edited_on': decode_datetime(record['edited_on']),
+                    'revision': self.new_id(Revision, record['revision'])})
+            else:
+                raise ValueError('Unknown record type {}'.format(record_type))
+
+
+def import_archive(path):
+    progress = Progress('Import')
+    importer = Importer()
+    complete = False
+    archive = open_archive(path, 'r')
+    try:
+        header = json.loads(archive.readline() or '{}')
+        if header.get('type') != 'header' or header.get('format') != ARCHIVE_FORMAT:
+            raise ValueError('{} is not a diagram archive of format {}'.format(path, ARCHIVE_FORMAT))
+        for line in archive:
+            record = json.loads(line)
+            if record['type'] == 'end':
+                complete = True
+                break
+            importer.add_record(record)
+            progress.add(record['type'])
+        importer.finish()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if archive is not sys.stdin:
+            archive.close()
+
+    progress.report(done=True)
+    for username, new_username, email in importer.renamed:
+        print('Imported user {} ({}) as {}, the username was taken'.format(username, email, new_username),
+              file=sys.stderr)
+    if not complete:
+        print('Warning: archive has no end record, it may be truncated', file=sys.stderr)
+    return 0 if complete else 1
+
+
+#=== RDF export ===#
+
+# File extensions of the per diagram formats
+RDF_EXTENSIONS = {'turtle': 'ttl', 'nt': 'nt'}
+
+# Format of a dataset with a named graph per diagram, by the per diagram format
+DATASET_FORMATS = {'turtle': 'trig', 'nt': 'nq'}
+
+# Diagrams queued per worker process, bounding the hierarchies held at once
+QUEUED_PER_WORKER = 4
+
+
+def count_graphs(hierarchy):
+    return 1 + sum(count_graphs(child) for child in hierarchy['children'])
+
+
+def iter_diagram_hierarchies(diagram_ids):
+    # (id, hierarchy) of the diagrams in id order, loading the hierarchies of a page together
+    query = db.session.query(DataFlowDiagram.id, DataFlowDiagram.graph)
+    if diagram_ids:
+        query = query.filter(DataFlowDiagram.id.in_(diagram_ids))
+
+    for batch in iter_batches(query, DataFlowDiagram.id):
+        hierarchies = load_hierarchies([graph for _, graph in batch])
+        db.session.expunge_all()
+        for diagram_id, graph in batch:
+            yield diagram_id, hierarchies[graph]
+
+
+def iter_rdf_exports(diagram_ids, rdf_format, merged, workers):
+    # (diagram id, graphs, rdf text) in id order, converted across worker processes
+    pool = start_process_pool(workers) if workers > 1 else None
+    queued = deque()
+    try:
+        for diagram_id, hierarchy in iter_diagram_hierarchies(diagram_ids):
+            args = (hierarchy, DATASET_FORMATS[rdf_format] if merged else rdf_format,
+                    diagram_graph_iri(diagram_id) if merged else None)
+            if pool is None:
+                yield diagram_id, count_graphs(hierarchy), export_diagram_rdf(*args)
+                continue
+            queued.append((diagram_id, count_graphs(hierarchy), pool.submit(export_diagram_rdf, *args)))
+            if len(queued) >= workers * QUEUED_PER_WORKER:
+                diagram_id, graphs, future = queued.popleft()
+                yield diagram_id, graphs, future.result()
+
+        while queued:
+            diagram_id, graphs, future = queued.popleft()
+            yield diagram_id, graphs, future.result()
+    finally:
+        if pool is not None:
+            # Queued diagrams are dropped when the export stops early
+            for _, _, future in queued:
+                future.cancel()
+            pool.shutdown()
+
+
+def export_rdf(output, diagram_ids, rdf_format, merged, workers):
+    progress = Progress('RDF export', ['diagram', 'graph'])
+    if merged:
+        dataset = open_archive(output, 'w')
+        if rdf_format == 'turtle':
+            dataset.write(''.join(iter_turtle_prefixes()))
+    else:
+        os.makedirs(output, exist_ok=True)
+
+    try:
+        for diagram_id, graphs, rdf in iter_rdf_exports(diagram_ids, rdf_format, merged, workers):
+            if merged:
+                dataset.write(rdf)
+            else:
+                path = os.path.join(output, '{}.{}'.format(diagram_id, RDF_EXTENSIONS[rdf_format]))
+                with open(path, 'w', encoding='utf-8') as rdf_file:
+                    rdf_file.write(rdf)
+            progress.add('diagram')
+            progress.add('graph', graphs)
+    finally:
+        if merged and dataset is not sys.stdout:
+            dataset.close()
+    progress.report(done=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m App.cli',
+                                     description='Back up, migrate, seed and export whole diagram libraries')
+    commands = parser.add_subparsers(dest='command')
+    export_parser = commands.add_parser('export', help='Write users and diagrams to an archive')
+    export_parser.add_argument('archive', help='Archive path, .gz to compress, - for stdout')
+    export_parser.add_argument('diagram_ids', nargs='*', type=int,
+                               help='Only export these diagrams (all users are still exported)')
+    import_parser = commands.add_parser('import', help='Add the users and diagrams of an archive')
+    import_parser.add_argument('archive', help='Archive path, - for stdin')
+    rdf_parser = commands.add_parser('rdf', help='Write the RDF export of diagrams')
+    rdf_parser.add_argument('output', help='Directory for a file per diagram, or the dataset path with --merged')
+    rdf_parser.add_argument('diagram_ids', nargs='*', type=int, help='Only export these diagrams')
+    rdf_parser.add_argument('--format', choices=list(RDF_EXTENSIONS), default='turtle', dest='rdf_format',
+                            help='Turtle or N-Triples, TriG or N-Quads with --merged')
+    rdf_parser.add_argument('--merged', action='store_true',
+                            help='Write one dataset with a named graph per diagram')
+    rdf_parser.add_argument('--workers', type=int, default=EXPORT_WORKERS,
+                            help='Worker processes converting diagrams (default: CPU count)')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required')
+
+    with app.app_context():
+        if args.command == 'export':
+            export_archive(args.archive, args.diagram_ids)
+            return 0
+        if args.command == 'rdf':
+            try:
+                export_rdf(args.output, args.diagram_ids, args.rdf_format, args.merged, args.workers)
+            except MalformedGraph as error:
+                print('Error: {}'.format(error), file=sys.stderr)
+                return 1
+            return 0
+        db.create_all()
+        return import_archive(args.archive)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import gzip
+import os
+from functools import lru_cache
+from flask import request
+from App import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text responses worth compressing, smaller bodies are sent as is
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+                          'application/javascript', 'application/json', 'application/xml',
+                          'image/svg+xml', 'text/turtle', 'application/n-triples'}
+COMPRESS_MIN_SIZE = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Compressed static files by (path, modified time, encoding)
+STATIC_CACHE_SIZE = 256
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+@lru_cache(maxsize=STATIC_CACHE_SIZE)
+def compress_static(path, modified, encoding):
+    with open(path, 'rb') as static_file:
+        return compress(static_file.read(), encoding)
+
+
+def accepted_encoding():
+    # Preferred content coding the client accepts, or None
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def matching_etag(etag):
+    # Variant of a strong etag the client already has, or None
+    for variant in [etag] + ['{}-{}'.format(etag, encoding) for encoding in ('gzip', 'br')]:
+        if request.if_none_match.contains(variant):
+            return variant
+    return None
+
+
+@app.after_request
+def compress_response(response):
+    if not app.config['COMPRESSION'] or response.status_code != 200 or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+
+    if request.endpoint == 'static':
+        # Static files are sent straight from disk, compress each version once
+        path = os.path.join(app.static_folder, request.view_args['filename'])
+        if not os.path.isfile(path) or os.path.getsize(path) < COMPRESS_MIN_SIZE:
+            return response
+    elif response.is_streamed or response.calculate_content_length() < COMPRESS_MIN_SIZE:
+        # Exports are streamed to bound memory, compressing would buffer them
+        return response
+
+    # Strong etags are suffixed per content coding so caches keep the representations apart
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag('{}-{}'.format(etag, encoding))
+        if request.if_none_match.contains(response.get_etag()[0]):
+            # Views compare the uncompressed etag, the client has this variant
+            response.status_code = 304
+            response.direct_passthrough = False
+            response.set_data(b'')
+            return response
+
+    if request.endpoint == 'static':
+        data = compress_static(path, os.path.getmtime(path), encoding)
+        response.direct_passthrough = False
+    else:
+        data = compress(response.get_data(), encoding)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
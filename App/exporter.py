@@ -1,26 +1,125 @@
+import atexit
+import hashlib
+import json
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from threading import Lock
 from urllib.parse import quote
 from flask import url_for
 from rdflib import Graph, Namespace, Literal
 from rdflib.namespace import RDF, RDFS
-from bs4 import BeautifulSoup
+from lxml import etree
+from App.utils import xml_model_hash
+from App.instrumentation import span, timed
 
 # Define name spaces
 BASE = Namespace('http://www.example.org/test#')
 DFD = Namespace('https://w3id.org/dfd/')
 
+# Prefixes written by the streaming turtle writer
+TURTLE_PREFIXES = [('dfd', str(DFD)), ('rdfs', str(RDFS))]
+
+# Response mimetypes of the streamed export formats
+EXPORT_MIMETYPES = {'turtle': 'text/turtle', 'nt': 'application/n-triples'}
+
+# Escapes for quoted literals in turtle and n-triples
+LITERAL_ESCAPES = str.maketrans(
+    {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+# Max cached exports and parsed graphs
+EXPORT_CACHE_SIZE = 64
+PARSED_GRAPH_CACHE_SIZE = 4096
+
+# Worker processes for parallel parsing and the fewest uncached graphs worth sending to them
+EXPORT_WORKERS = os.cpu_count() or 1
+PARALLEL_PARSE_MIN_GRAPHS = 8
+
+
+# Labels of the items a graph defines and its flows as (label, source label, target label), for the export.
+# items holds every item as (id, type, label, from parent, required inflows json, required outflows json)
+# and item_flows every flow as (label, source id, target id), for the validator.
+ParsedXmlModel = namedtuple('ParsedXmlModel', ['entities', 'processes', 'datastores', 'dataflows',
+                                               'items', 'item_flows'])
+
+
+class MalformedGraph(Exception):
+    # A graph whose xml can't be parsed, by its title path from the starting diagram
+    def __init__(self, path):
+        super().__init__(path)
+        self.path = path
+
+    def __str__(self):
+        return 'Graph xml could not be parsed: {}'.format(' / '.join(self.path))
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+export_cache = LRUCache(EXPORT_CACHE_SIZE)
+parsed_graph_cache = LRUCache(PARSED_GRAPH_CACHE_SIZE)
+
+# Process pool for parsing graphs of stored diagrams, started with the server, graphs are parsed
+# in the request's thread without it
+parse_pool = None
+
+
+def hierarchy_hash(hierarchy):
+    # Hash of the titles, structure and xml of the whole hierarchy
+    content = hashlib.sha256()
+    content.update(json.dumps(hierarchy['title']).encode('utf-8'))
+    content.update(xml_model_hash(hierarchy['xml_model']).encode('utf-8'))
+    for child in hierarchy['children']:
+        content.update(hierarchy_hash(child).encode('utf-8'))
+    return content.hexdigest()
+
+
+@timed('export_dfd')
+def export_dfd(dfd, parallel=False):
+    # Reuse the export of an identical hierarchy
+    key = hierarchy_hash(dfd)
+    turtle = export_cache.get(key)
+    if turtle is not None:
+        return turtle
 
-def export_dfd(dfd):
     # Collect all items in DFD
-    entities, processes, datastores, dataflows = collect_items(dfd)
+    entities, processes, datastores, dataflows = collect_items_parallel(
+        dfd) if parallel else collect_items(dfd)
 
     # Create turtle RDF
     rdf_graph = create_rdf_graph(entities, processes, datastores, dataflows)
-    turtle = rdf_graph.serialize(format='turtle').decode()
+    with span('serialize_rdf'):
+        turtle = rdf_graph.serialize(format='turtle').decode()
+    export_cache.set(key, turtle)
     return turtle
 
 
-def collect_items(hierarchy):
-    # Set items records
+@timed('collect_items')
+def collect_items(hierarchy, parent_path=()):
+    # Set items records, parent_path holds the titles above the hierarchy for errors
     entities = set()    # Entity names
     processes = {}      # Process name (key) and parent name or None (value)
     datastores = set()  # Datastore names
@@ -30,29 +129,19 @@ def collect_items(hierarchy):
     parent = None if hierarchy['title'] == 'Context diagram' else hierarchy['title']
 
     # Collect items in graph
-    graph = BeautifulSoup(hierarchy['xml_model'], 'lxml')
-
-    for entity in graph.find_all('entity'):
-        if not entity.get('from_parent'):
-            entities.add(entity.get('label'))
-
-    for process in graph.find_all('process'):
-        if not process.get('from_parent'):
-            processes[process.get('label')] = parent
-
-    for datastore in graph.find_all('datastore'):
-        if not datastore.get('from_parent'):
-            datastores.add(datastore.get('label'))
-
-    for flow in graph.find_all('mxcell', {"item_type": "flow"}):
-        label = flow.get('value')
-        source = graph.find(attrs={'id': flow.get('source')}).get('label')
-        target = graph.find(attrs={'id': flow.get('target')}).get('label')
-        dataflows.add((label, source, target))
+    path = parent_path + (hierarchy['title'],)
+    try:
+        graph = parse_cached_xml_model(hierarchy['xml_model'])
+    except etree.XMLSyntaxError:
+        raise MalformedGraph(list(path))
+    entities.update(graph.entities)
+    processes.update((process, parent) for process in graph.processes)
+    datastores.update(graph.datastores)
+    dataflows.update(graph.dataflows)
 
     # Collect items in sub processes and merge them
     for child in hierarchy['children']:
-        _, sub_processes, sub_datastores, sub_dataflows = collect_items(child)
+        _, sub_processes, sub_datastores, sub_dataflows = collect_items(child, path)
         processes.update(sub_processes)
         datastores.update(sub_datastores)
         dataflows.update(sub_dataflows)
@@ -60,6 +149,222 @@ def collect_items(hierarchy):
     return entities, processes, datastores, dataflows
 
 
+def start_process_pool(workers):
+    # Fork all workers now, from the calling thread, rather than on a later submit from whichever thread
+    # makes it, as a fork copies locks other threads hold
+    pool = ProcessPoolExecutor(workers)
+    for future in [pool.submit(int) for _ in range(workers)]:
+        future.result()
+    return pool
+
+
+def start_parse_pool():
+    # Call before the server starts its threads
+    global parse_pool
+    if parse_pool is None and EXPORT_WORKERS > 1:
+        parse_pool = start_process_pool(EXPORT_WORKERS)
+        atexit.register(parse_pool.shutdown)
+
+
+@timed('collect_items_parallel')
+def collect_items_parallel(hierarchy):
+    # Same result as collect_items, with uncached graphs parsed across worker processes
+    graphs = []
+    paths = {}  # Title path of the first graph with each xml, for errors
+    pending = [(hierarchy, (hierarchy['title'],))]
+    while pending:
+        data, path = pending.pop()
+        parent = None if data['title'] == 'Context diagram' else data['title']
+        key = xml_model_hash(data['xml_model'])
+        graphs.append((key, data['xml_model'], parent, len(path) == 1))
+        paths.setdefault(key, list(path))
+        # Pre order like collect_items, so later sub processes win process parents
+        pending.extend((child, path + (child['title'],)) for child in reversed(data['children']))
+
+    # Parse graphs not in the cache, in order so merging is deterministic
+    parsed = {key: parsed_graph_cache.get(key) for key, _, _, _ in graphs}
+    missing = {key: xml_model for key, xml_model, _,
+               _ in graphs if parsed[key] is None}
+    if parse_pool is not None and len(missing) >= PARALLEL_PARSE_MIN_GRAPHS:
+        results = parse_pool.map(try_parse_xml_model, missing.values(),
+                                 chunksize=max(1, len(missing) // (EXPORT_WORKERS * 4)))
+    else:
+        results = map(try_parse_xml_model, missing.values())
+    for key, graph in zip(missing, results):
+        if graph is None:
+            raise MalformedGraph(paths[key])
+        parsed[key] = graph
+        parsed_graph_cache.set(key, graph)
+
+    # Merge graph items, only the root graph defines entities
+    entities = set()
+    processes = {}
+    datastores = set()
+    dataflows = set()
+    for key, _, parent, is_root in graphs:
+        graph = parsed[key]
+        if is_root:
+            entities.update(graph.entities)
+        processes.update((process, parent) for process in graph.processes)
+        datastores.update(graph.datastores)
+        dataflows.update(graph.dataflows)
+
+    return entities, processes, datastores, dataflows
+
+
+def parse_cached_xml_model(xml_model):
+    # Only parse graphs whose xml hasn't been parsed recently
+    key = xml_model_hash(xml_model)
+    graph = parsed_graph_cache.get(key)
+    if graph is None:
+        graph = parse_xml_model(xml_model)
+        parsed_graph_cache.set(key, graph)
+    return graph
+
+
+def parse_xml_model(xml_model):
+    # Single pass over the graph xml, indexing cell labels by id to resolve flows
+    labels = {}
+    defined = {'entity': [], 'process': [], 'datastore': []}
+    items = []
+    flows = []
+
+    xml = BytesIO(xml_model.encode('utf-8'))
+    for event, element in etree.iterparse(xml, events=('start', 'end'), resolve_entities=False):
+        if event == 'end':
+            # Free parsed elements
+            element.clear()
+            continue
+
+        attributes = element.attrib
+        if 'id' in attributes:
+            labels.setdefault(attributes['id'], attributes.get('label'))
+
+        if element.tag in defined:
+            from_parent = bool(attributes.get('from_parent'))
+            items.append((attributes.get('id'), element.tag, attributes.get('label'), from_parent,
+                          attributes.get('required_inflows'), attributes.get('required_outflows')))
+            if not from_parent:
+                defined[element.tag].append(attributes.get('label'))
+        elif element.tag == 'mxCell' and attributes.get('item_type') == 'flow':
+            flows.append((attributes.get('value'), attributes.get(
+                'source'), attributes.get('target')))
+
+    dataflows = frozenset((label, labels.get(source), labels.get(target))
+                          for label, source, target in flows)
+    return ParsedXmlModel(tuple(defined['entity']), tuple(defined['process']), tuple(defined['datastore']),
+                          dataflows, tuple(items), tuple(flows))
+
+
+def try_parse_xml_model(xml_model):
+    # None for xml that can't be parsed, so worker processes report the graph without raising
+    try:
+        return parse_xml_model(xml_model)
+    except etree.XMLSyntaxError:
+        return None
+
+
+def turtle_term(iri):
+    # Prefixed name for dfd and rdfs terms, else a full IRI
+    if iri == RDF.type:
+        return 'a'
+    for prefix, namespace in TURTLE_PREFIXES:
+        if iri.startswith(namespace):
+            return '{}:{}'.format(prefix, iri[len(namespace):])
+    return '<{}>'.format(iri)
+
+
+def literal_term(value):
+    return '"{}"'.format(value.translate(LITERAL_ESCAPES))
+
+
+def flow_iri(label, source, target):
+    # Stable across exports, so identical flows keep their IRI
+    key = json.dumps([label, source, target]).encode('utf-8')
+    return BASE['f' + hashlib.sha256(key).hexdigest()[:16]]
+
+
+def iter_subjects(entities, processes, datastores, dataflows):
+    # Each subject IRI with its (predicate IRI, object, object is literal) pairs, in a canonical order
+    for entity in sorted(entities):
+        yield BASE[quote(entity)], [(RDF.type, DFD.Interface, False), (RDFS.label, entity, True)]
+
+    for datastore in sorted(datastores):
+        yield BASE[quote(datastore)], [(RDF.type, DFD.DataStore, False), (RDFS.label, datastore, True)]
+
+    for process, parent in sorted(processes.items()):
+        predicates = [(RDF.type, DFD.Process, False),
+                      (RDFS.label, process, True)]
+        if parent:
+            predicates.append(
+                (DFD.subProcessOf, BASE[quote(parent)], False))
+        yield BASE[quote(process)], predicates
+
+    flows = sorted((flow_iri(label, source, target), label, source, target)
+                   for label, source, target in dataflows)
+    for flow, label, source, target in flows:
+        yield flow, [(RDF.type, DFD.DataFlow, False), (RDFS.label, label, True),
+                     (DFD['from'], BASE[quote(source)], False), (DFD.to, BASE[quote(target)], False)]
+
+
+def iter_turtle_prefixes():
+    for prefix, namespace in TURTLE_PREFIXES:
+        yield '@prefix {}: <{}> .\n'.format(prefix, namespace)
+    yield '\n'
+
+
+def iter_turtle_statements(entities, processes, datastores, dataflows):
+    for subject, predicates in iter_subjects(entities, processes, datastores, dataflows):
+        objects = ' ;\n    '.join('{} {}'.format(turtle_term(predicate), literal_term(
+            value) if is_literal else turtle_term(value)) for predicate, value, is_literal in predicates)
+        yield '<{}> {} .\n\n'.format(subject, objects)
+
+
+def iter_turtle(entities, processes, datastores, dataflows):
+    yield from iter_turtle_prefixes()
+    yield from iter_turtle_statements(entities, processes, datastores, dataflows)
+
+
+def iter_ntriples(entities, processes, datastores, dataflows, graph_iri=None):
+    # N-Quads of the named graph when graph_iri is given
+    end = ' .\n' if graph_iri is None else ' <{}> .\n'.format(graph_iri)
+    for subject, predicates in iter_subjects(entities, processes, datastores, dataflows):
+        yield ''.join('<{}> <{}> {}{}'.format(subject, predicate, literal_term(value) if is_literal else '<{}>'.format(value), end)
+                      for predicate, value, is_literal in predicates)
+
+
+def iter_trig_graph(graph_iri, entities, processes, datastores, dataflows):
+    # A named graph of a TriG dataset, whose prefixes are written once at its start
+    yield '<{}> {{\n\n'.format(graph_iri)
+    yield from iter_turtle_statements(entities, processes, datastores, dataflows)
+    yield '}\n\n'
+
+
+def diagram_graph_iri(diagram_id):
+    return BASE['diagram/{}'.format(diagram_id)]
+
+
+def export_diagram_rdf(hierarchy, rdf_format, graph_iri=None):
+    # Whole export of one diagram as text, run in batch export worker processes.
+    # Formats are turtle and nt, or trig and nq for a named graph of a merged dataset
+    items = collect_items(hierarchy)
+    if rdf_format == 'trig':
+        return ''.join(iter_trig_graph(graph_iri, *items))
+    if rdf_format == 'nq':
+        return ''.join(iter_ntriples(*items, graph_iri=graph_iri))
+    writer = iter_ntriples if rdf_format == 'nt' else iter_turtle
+    return ''.join(writer(*items))
+
+
+def stream_dfd(dfd, rdf_format='turtle', parallel=False):
+    # Generate the export in chunks without building an rdflib graph
+    items = collect_items_parallel(
+        dfd) if parallel else collect_items(dfd)
+    writer = iter_ntriples if rdf_format == 'nt' else iter_turtle
+    return writer(*items)
+
+
+@timed('create_rdf_graph')
 def create_rdf_graph(entities, processes, datastores, dataflows):
     # Create graph
     graph = Graph()
@@ -86,10 +391,11 @@ def create_rdf_graph(entities, processes, datastores, dataflows):
                 (BASE[quote(process)], DFD.subProcessOf, BASE[quote(parent)]))
 
     # Define DataFlows
-    for i, (label, source, target) in enumerate(dataflows):
-        graph.add((BASE[f'f{i}'], RDF.type, DFD.DataFlow))
-        graph.add((BASE[f'f{i}'], RDFS.label, Literal(label)))
-        graph.add((BASE[f'f{i}'], DFD['from'], BASE[quote(source)]))
-        graph.add((BASE[f'f{i}'], DFD.to, BASE[quote(target)]))
+    for label, source, target in dataflows:
+        flow = flow_iri(label, source, target)
+        graph.add((flow, RDF.type, DFD.DataFlow))
+        graph.add((flow, RDFS.label, Literal(label)))
+        graph.add((flow, DFD['from'], BASE[quote(source)]))
+        graph.add((flow, DFD.to, BASE[quote(target)]))
 
     return graph
@@ -0,0 +1,122 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from flask import g, has_request_context, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from App import app
+
+# Process wide totals by request endpoint and by span name
+request_metrics = {}
+span_metrics = {}
+metrics_lock = Lock()
+
+
+@contextmanager
+def span(name):
+    # Time a block of the current request, nested uses of the same name count once
+    if not app.config['INSTRUMENTATION'] or not has_request_context() or 'request_start' not in g \
+            or name in g.get('active_spans', ()):
+        yield
+        return
+
+    g.setdefault('active_spans', set()).add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        g.active_spans.discard(name)
+        count, seconds = g.spans.get(name, (0, 0.0))
+        g.spans[name] = (count + 1, seconds + elapsed)
+
+
+def timed(name):
+    # Decorator recording each call as a span
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(connection, cursor, statement, parameters, context, executemany):
+    if app.config['INSTRUMENTATION'] and context is not None:
+        context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(connection, cursor, statement, parameters, context, executemany):
+    if not hasattr(context, 'query_start') or not has_request_context() or 'request_start' not in g:
+        return
+    g.sql_count += 1
+    g.sql_seconds += time.perf_counter() - context.query_start
+
+
+@app.before_request
+def start_request():
+    if app.config['INSTRUMENTATION']:
+        g.request_start = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.spans = {}
+
+
+@app.after_request
+def end_request(response):
+    if not app.config['INSTRUMENTATION'] or 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+
+    # Server-Timing durations are in milliseconds
+    timings = ['total;dur={:.2f}'.format(elapsed * 1000),
+               'sql;desc="{} queries";dur={:.2f}'.format(g.sql_count, g.sql_seconds * 1000)]
+    timings.extend('{};dur={:.2f}'.format(name, seconds * 1000)
+                   for name, (count, seconds) in sorted(g.spans.items()))
+    response.headers['Server-Timing'] = ', '.join(timings)
+
+    key = (request.endpoint or 'none', response.status_code)
+    with metrics_lock:
+        requests, seconds, queries, sql_seconds = request_metrics.get(key, (0, 0.0, 0, 0.0))
+        request_metrics[key] = (requests + 1, seconds + elapsed,
+                                queries + g.sql_count, sql_seconds + g.sql_seconds)
+        for name, (count, seconds) in g.spans.items():
+            calls, total = span_metrics.get(name, (0, 0.0))
+            span_metrics[name] = (calls + count, total + seconds)
+    return response
+
+
+def prometheus_text():
+    with metrics_lock:
+        requests = sorted(request_metrics.items())
+        spans = sorted(span_metrics.items())
+
+    lines = []
+    for metric, description, index in [('dfd_edit_requests_total', 'Requests handled', 0),
+                                       ('dfd_edit_request_seconds_total', 'Wall time spent in requests', 1),
+                                       ('dfd_edit_sql_queries_total', 'SQL queries run by requests', 2),
+                                       ('dfd_edit_sql_seconds_total', 'Time spent in SQL queries by requests', 3)]:
+        lines.append('# HELP {} {}'.format(metric, description))
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.extend('{}{{endpoint="{}",status="{}"}} {}'.format(metric, endpoint, status, values[index])
+                     for (endpoint, status), values in requests)
+
+    for metric, description, index in [('dfd_edit_span_calls_total', 'Calls of instrumented functions', 0),
+                                       ('dfd_edit_span_seconds_total', 'Time spent in instrumented functions', 1)]:
+        lines.append('# HELP {} {}'.format(metric, description))
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.extend('{}{{span="{}"}} {}'.format(metric, name, values[index])
+                     for name, values in spans)
+    return '\n'.join(lines) + '\n'
+
+
+def metrics():
+    return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+if app.config['INSTRUMENTATION']:
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -1,3 +1,4 @@
+import zlib
 from datetime import datetime
 from flask_login import UserMixin
 from sqlalchemy import CheckConstraint
@@ -15,6 +16,10 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(60), nullable=False)
 
+    created_diagrams = db.relationship(
+        'DataFlowDiagram', back_populates='creator')
+    invitations = db.relationship('Invitation', back_populates='user')
+
     def __repr__(self):
         return 'id: {}, username: {}, email {}'.format(self.id, self.username, self.email)
 
@@ -22,23 +27,70 @@ class User(db.Model, UserMixin):
 class DataFlowDiagram(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
-    graph = db.Column(db.Integer, db.ForeignKey('graph.id'), nullable=False)
+    # Indexed for search, which walks up from matching graphs to the diagram of their root graph
+    graph = db.Column(db.Integer, db.ForeignKey('graph.id'), nullable=False, index=True)
     author = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_on = db.Column(db.DateTime, nullable=False,
                            default=datetime.utcnow)
 
+    # Keyset pagination of a user's diagrams
+    __table_args__ = (db.Index('ix_data_flow_diagram_author_created_on',
+                               author, created_on, id), {})
+
+    creator = db.relationship('User', back_populates='created_diagrams')
+    # Removed with bulk deletes in delete_diagram_by_id, so never loaded on delete
+    invitations = db.relationship('Invitation', back_populates='diagram',
+                                  order_by='Invitation.invited_on', passive_deletes=True)
+    edits = db.relationship('Edit', back_populates='diagram',
+                            order_by='Edit.edited_on.desc()', passive_deletes=True)
+
     def __repr__(self):
         return 'id: {}, title: {}, created_on: {}'.format(self.id, self.title, self.created_on)
 
 
+class XmlBlob(db.Model):
+    hash = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib compressed xml
+
+    @property
+    def xml_model(self):
+        return zlib.decompress(self.data).decode('utf-8')
+
+    @classmethod
+    def from_xml_model(cls, hash, xml_model):
+        return cls(hash=hash, data=zlib.compress(xml_model.encode('utf-8')))
+
+    def __repr__(self):
+        return 'hash: {}, size: {}'.format(self.hash, len(self.data))
+
+
 class Graph(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     level = db.Column(db.Integer, nullable=False)
-    xml_model = db.Column(db.String(), nullable=False)
+    # Inline xml, empty when the xml is kept in the blob store
+    xml_text = db.Column('xml_model', db.String(), nullable=False)
+    xml_hash = db.Column(db.String(64), db.ForeignKey(
+        'xml_blob.hash'), index=True)
+    xml_blob = db.relationship('XmlBlob', lazy='joined')
+    # Incremented on every update, partial saves must name the version they edited
+    version = db.Column(db.Integer, nullable=False,
+                        default=1, server_default='1')
 
     __table_args__ = (CheckConstraint(
         level >= 0, name='check_level_positive'), {})
+    __mapper_args__ = {'version_id_col': version}
+
+    @property
+    def xml_model(self):
+        if self.xml_blob is not None:
+            return self.xml_blob.xml_model
+        return self.xml_text
+
+    @xml_model.setter
+    def xml_model(self, xml_model):
+        self.xml_text = xml_model
+        self.xml_blob = None
 
     def __repr__(self):
         return 'id: {}, title: {}, level: {}'.format(self.id, self.title, self.level)
@@ -46,17 +98,38 @@ class Graph(db.Model):
 
 class GraphChildren(db.Model):
     parent = db.Column(db.Integer, db.ForeignKey('graph.id'), primary_key=True)
-    child = db.Column(db.Integer, db.ForeignKey('graph.id'), primary_key=True)
+    # Primary key index leads with parent, so child lookups need their own
+    child = db.Column(db.Integer, db.ForeignKey(
+        'graph.id'), primary_key=True, index=True)
+    # Order among the parent's children, ties are in id order
+    position = db.Column(db.Integer, nullable=False,
+                         default=0, server_default='0')
+
+
+class SearchTerm(db.Model):
+    # Inverted index of the item and flow labels defined in each graph, a row per word of a label
+    graph = db.Column(db.Integer, db.ForeignKey('graph.id'), primary_key=True)
+    term = db.Column(db.String(), primary_key=True)
+    item_type = db.Column(db.String(20), primary_key=True)
+    label = db.Column(db.String(), primary_key=True)
+
+    # Primary key index leads with graph, so term lookups need their own covering index
+    __table_args__ = (db.Index('ix_search_term_term',
+                               term, item_type, graph, label), {})
 
 
 class Invitation(db.Model):
     invited_user = db.Column(
         db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # Primary key index leads with invited_user, so diagram lookups need their own
     invited_to = db.Column(db.Integer, db.ForeignKey(
-        'data_flow_diagram.id'), primary_key=True)
+        'data_flow_diagram.id'), primary_key=True, index=True)
     invited_on = db.Column(db.DateTime, nullable=False,
                            default=datetime.utcnow)
 
+    user = db.relationship('User', back_populates='invitations')
+    diagram = db.relationship('DataFlowDiagram', back_populates='invitations')
+
 
 class Edit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -66,3 +139,27 @@ class Edit(db.Model):
     message = db.Column(db.String(100))
     edited_on = db.Column(db.DateTime, nullable=False,
                           default=datetime.utcnow)
+    revision = db.Column(db.Integer, db.ForeignKey(
+        'revision.id'), index=True)
+
+    # Keyset pagination of a diagram's edits
+    __table_args__ = (db.Index('ix_edit_edited_diagram_edited_on',
+                               edited_diagram, edited_on, id), {})
+
+    user = db.relationship('User')
+    diagram = db.relationship('DataFlowDiagram', back_populates='edits')
+
+
+class Revision(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    diagram = db.Column(db.Integer, db.ForeignKey(
+        'data_flow_diagram.id'), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    snapshot = db.Column(db.Boolean, nullable=False)
+    # zlib compressed json, the full hierarchy for snapshots else a delta to the previous revision
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('diagram', 'number'), {})
+
+    def __repr__(self):
+        return 'id: {}, diagram: {}, number: {}, snapshot: {}'.format(self.id, self.diagram, self.number, self.snapshot)
@@ -0,0 +1,197 @@
+import json
+import re
+import zlib
+from collections import deque
+from difflib import SequenceMatcher
+from App.models import Revision, Edit, User
+from App import db
+from App.instrumentation import timed
+
+# Every n-th revision stores the full hierarchy, the rest store deltas to the previous revision
+SNAPSHOT_INTERVAL = 20
+
+# Split xml after each tag so deltas work on whole tags
+XML_TOKEN = re.compile(r'(?<=>)')
+
+
+def path_key(path):
+    # Hashable title path from its json list. A sibling sharing the title of earlier siblings is a
+    # [title, n] step, n counting those siblings, so duplicate titles keep separate graphs.
+    return tuple(step if isinstance(step, str) else tuple(step) for step in path)
+
+
+def path_json(path):
+    return [step if isinstance(step, str) else list(step) for step in path]
+
+
+def flatten_hierarchy(hierarchy):
+    # List of (title path, xml model) breadth first, so parents precede children
+    graphs = []
+    pending = deque([(hierarchy, (hierarchy['title'],))])
+    while pending:
+        data, path = pending.popleft()
+        graphs.append((path, data['xml_model']))
+        seen = {}
+        for child in data['children']:
+            n = seen.get(child['title'], 0)
+            seen[child['title']] = n + 1
+            pending.append((child, path + (child['title'] if n == 0 else (child['title'], n),)))
+    return graphs
+
+
+def build_hierarchy(graphs):
+    # Inverse of flatten_hierarchy
+    entries = {}
+    for path, xml_model in graphs:
+        step = path[-1]
+        entries[path] = {'title': step if isinstance(step, str) else step[0],
+                         'xml_model': xml_model, 'children': []}
+        if len(path) > 1:
+            entries[path[:-1]]['children'].append(entries[path])
+    return entries[graphs[0][0]]
+
+
+def xml_delta(old_xml, new_xml):
+    # Edit script of [start, end] ranges copied from old tokens and inserted strings
+    old_tokens = XML_TOKEN.split(old_xml)
+    new_tokens = XML_TOKEN.split(new_xml)
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif tag != 'delete':
+            delta.append(''.join(new_tokens[j1:j2]))
+    return delta
+
+
+def apply_xml_delta(old_xml, delta):
+    old_tokens = XML_TOKEN.split(old_xml)
+    return ''.join(op if isinstance(op, str) else ''.join(old_tokens[op[0]:op[1]])
+                   for op in delta)
+
+
+def encode_revision_data(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_revision_data(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def diff_graphs(old_graphs, new_graphs):
+    # Per graph entries: None when unchanged, a delta when changed or the xml when added
+    old_xml_models = dict(old_graphs)
+    entries = []
+    for path, xml_model in new_graphs:
+        old_xml = old_xml_models.get(path)
+        if old_xml is None:
+            entries.append([path_json(path), xml_model])
+        elif old_xml == xml_model:
+            entries.append([path_json(path), None])
+        else:
+            entries.append([path_json(path), xml_delta(old_xml, xml_model)])
+    return entries
+
+
+def patch_graphs(old_graphs, entries):
+    old_xml_models = dict(old_graphs)
+    graphs = []
+    for path, entry in entries:
+        path = path_key(path)
+        if entry is None:
+            graphs.append((path, old_xml_models[path]))
+        elif isinstance(entry, str):
+            graphs.append((path, entry))
+        else:
+            graphs.append((path, apply_xml_delta(old_xml_models[path], entry)))
+    return graphs
+
+
+def patch_changed_graphs(old_graphs, changed):
+    # Apply deltas of the changed graphs only, the rest are carried over
+    deltas = {path_key(path): delta for path, delta in changed}
+    return [(path, apply_xml_delta(xml_model, deltas[path]) if path in deltas else xml_model)
+            for path, xml_model in old_graphs]
+
+
+def get_latest_revision(diagram_id):
+    return Revision.query.filter_by(diagram=diagram_id).order_by(Revision.number.desc()).first()
+
+
+def get_revision(diagram_id, number):
+    return Revision.query.filter_by(diagram=diagram_id, number=number).first()
+
+
+def get_diagram_revisions(diagram_id):
+    # Revisions newest first with the edit and editor that created them
+    return db.session.query(Revision, Edit, User).join(Edit, Edit.revision == Revision.id).join(
+        User, User.id == Edit.editor).filter(Revision.diagram == diagram_id).order_by(Revision.number.desc())
+
+
+def load_revision_graphs(revision):
+    # Replay deltas forward from the closest snapshot
+    snapshot = Revision.query.filter(Revision.diagram == revision.diagram, Revision.snapshot,
+                                     Revision.number <= revision.number).order_by(Revision.number.desc()).first()
+    revisions = Revision.query.filter(Revision.diagram == revision.diagram, Revision.number >= snapshot.number,
+                                      Revision.number <= revision.number).order_by(Revision.number)
+
+    graphs = []
+    for step in revisions:
+        entries = decode_revision_data(step.data)
+        if step.snapshot:
+            graphs = [(path_key(path), xml_model) for path, xml_model in entries]
+        elif isinstance(entries, dict):
+            # Partial save, same structure with some graphs changed
+            graphs = patch_changed_graphs(graphs, entries['changed'])
+        else:
+            graphs = patch_graphs(graphs, entries)
+    return graphs
+
+
+@timed('load_revision')
+def load_revision(revision):
+    return build_hierarchy(load_revision_graphs(revision))
+
+
+@timed('add_revision')
+def add_revision(diagram_id, hierarchy):
+    graphs = flatten_hierarchy(hierarchy)
+    previous = get_latest_revision(diagram_id)
+    number = previous.number + 1 if previous else 1
+
+    if previous is None or (number - 1) % SNAPSHOT_INTERVAL == 0:
+        revision = Revision(diagram=diagram_id, number=number, snapshot=True,
+                            data=encode_revision_data([[path_json(path), xml_model] for path, xml_model in graphs]))
+    else:
+        entries = diff_graphs(load_revision_graphs(previous), graphs)
+        revision = Revision(diagram=diagram_id, number=number, snapshot=False,
+                            data=encode_revision_data(entries))
+
+    db.session.add(revision)
+    db.session.flush()
+    return revision
+
+
+@timed('add_patch_revision')
+def add_patch_revision(diagram_id, changes):
+    # Revision from (title path, old xml, new xml) of the graphs a partial save changed,
+    # None when there is no previous revision to carry the other graphs over from
+    previous = get_latest_revision(diagram_id)
+    if previous is None:
+        return None
+    number = previous.number + 1
+    changed = [[path_json(path), xml_delta(old_xml, new_xml)]
+               for path, old_xml, new_xml in changes]
+
+    if (number - 1) % SNAPSHOT_INTERVAL == 0:
+        graphs = patch_changed_graphs(load_revision_graphs(previous), changed)
+        revision = Revision(diagram=diagram_id, number=number, snapshot=True,
+                            data=encode_revision_data([[path_json(path), xml_model] for path, xml_model in graphs]))
+    else:
+        revision = Revision(diagram=diagram_id, number=number, snapshot=False,
+                            data=encode_revision_data({'changed': changed}))
+
+    db.session.add(revision)
+    db.session.flush()
+    return revision
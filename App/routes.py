@@ -1,17 +1,30 @@
-from flask import render_template, url_for, flash, redirect, request, abort
+from flask import (render_template, url_for, flash, redirect, request, abort, Response, jsonify,
+                   stream_with_context, get_template_attribute)
 from flask_login import login_user, logout_user, current_user, login_required
+from werkzeug.utils import secure_filename
 from App.forms import RegistrationForm, LoginForm, InviteEditorForm
 from App.models import User, DataFlowDiagram, Invitation
-from App.utils import (get_diagram_editors, get_user_created_diagrams,
-                       get_user_invited_diagrams, get_diagram_edits,
-                       get_user, get_diagram_author, get_diagram,
+from App.utils import (get_diagram_editors, get_diagrams_page, get_diagram_edits_page,
+                       PAGE_SIZE, get_user, get_diagram_author, get_diagram,
                        get_user_by_email, delete_diagram_by_id,
-                       is_editor, is_author, load_hierarchy, save_graph,
-                       add_edit, create_graph_and_children)
-from App.exporter import export_dfd
+                       get_permission, invalidate_permissions, hierarchy_etag, load_hierarchy, save_graph,
+                       add_edit, create_graph_and_children, get_graph_versions,
+                       save_graph_patches, VersionConflict, commit_save, load_hierarchy_skeleton,
+                       is_graph_in_tree, get_graph, graph_etag, load_patched_graphs)
+from App.exporter import export_dfd, stream_dfd, MalformedGraph, EXPORT_MIMETYPES
+from App.validator import validate_dfd, validate_graph_patches
+from App.search import search_diagrams, SEARCH_ITEM_TYPES
+from App.revisions import (add_revision, add_patch_revision, get_revision, get_diagram_revisions,
+                           load_revision)
+from App.instrumentation import span
+from App.compression import matching_etag
 from App import app, bcrypt, db
 
 
+# Largest page a listing endpoint returns
+MAX_PAGE_SIZE = 100
+
+
 @app.route('/')
 def home():
     return render_template('home.html', title='Home')
@@ -25,35 +38,93 @@ def editor(id=None):
         # New diagram
         diagram = None
         title = 'Editor'
-        hierarchy_json = None
 
-    elif not is_author(current_user.id, id) and not is_editor(current_user.id, id):
+    elif not get_permission(current_user.id, id).can_edit:
         # No edit permission
         abort(403)
 
     else:
-        # Load diagram
+        # Load diagram, the page fetches its hierarchy separately
         diagram = get_diagram(id)
         if diagram is not None:
             # Diagram exists
             title = diagram.title
-            hierarchy_json = load_hierarchy(diagram.graph)
 
-    return render_template('editor.html', title=title, diagram=diagram, hierarchy=hierarchy_json)
+    return render_template('editor.html', title=title, diagram=diagram)
+
+
+def revalidated_json(etag, load):
+    # JSON from load(), or 304 when the client has this etag
+    client_etag = matching_etag(etag)
+    if client_etag is not None:
+        response = Response(status=304)
+        response.set_etag(client_etag)
+    else:
+        response = jsonify(load())
+        response.set_etag(etag)
+
+    # Permissions can change, so always revalidate
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/diagram/<id>/hierarchy')
+@login_required
+def diagram_hierarchy(id):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    # Graph ids, titles and versions, only the context diagram's xml is sent up front
+    skeleton = load_hierarchy_skeleton(get_diagram(id).graph)
+    return revalidated_json(hierarchy_etag(skeleton), lambda: skeleton)
+
+
+@app.route('/diagram/<id>/graphs/<int:graph_id>')
+@login_required
+def diagram_graph(id, graph_id):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    diagram = get_diagram(id)
+    if not is_graph_in_tree(diagram.graph, graph_id):
+        abort(404)
+
+    graph = get_graph(graph_id)
+    xml_model = graph.xml_model
+    return revalidated_json(graph_etag(graph, xml_model), lambda: {
+        'id': graph.id, 'title': graph.title, 'version': graph.version, 'xml_model': xml_model})
+
+
+def validate_save(dfd):
+    # Rules the saved hierarchy breaks, None when saves are not validated
+    if app.config['VALIDATE_ON_SAVE'] == 'off':
+        return None
+    return [error._asdict() for error in validate_dfd(dfd)]
+
+
+def save_rejected(errors):
+    return bool(errors) and app.config['VALIDATE_ON_SAVE'] == 'reject'
+
+
+def malformed_graph_response(error):
+    # Reported like the validation error of the graph
+    return {'success': False, 'validation_errors': [
+        {'path': error.path, 'message': 'Graph xml could not be parsed.'}]}, 400
 
 
 @app.route('/editor/<id>', methods=['PUT'])
 @login_required
 def save_diagram(id):
     # Validated user permission
-    if not is_author(current_user.id, id) and not is_editor(current_user.id, id):
+    if not get_permission(current_user.id, id).can_edit:
         abort(403)
 
     diagram = get_diagram(id)
 
     # Validate title edit
     new_title = request.json['title']
-    if not new_title == diagram.title and not is_author(current_user.id, id):
+    if not new_title == diagram.title and not get_permission(current_user.id, id).is_author:
         # User lacks permission to edit title
         abort(403)
     else:
@@ -61,17 +132,74 @@ def save_diagram(id):
             # Empty title
             abort(500)
 
-    # Set new graph
-    save_graph(id, request.json['dfd'])
+    validation_errors = validate_save(request.json['dfd'])
+    if save_rejected(validation_errors):
+        return {'success': False, 'validation_errors': validation_errors}, 400
 
-    # Set new title
-    diagram.title = new_title
-    db.session.commit()
+    def save():
+        # Set new title, graph, revision and edit entry (committed together)
+        diagram = get_diagram(id)
+        diagram.title = new_title
+        save_graph(id, request.json['dfd'], commit=False)
+        revision = add_revision(diagram.id, request.json['dfd'])
+        add_edit(current_user.id, diagram.id,
+                 request.json['edit_message'], revision.id)
+        return diagram
 
-    # Create edit entry
-    add_edit(current_user.id, diagram.id, request.json['edit_message'])
+    diagram = commit_save(save)
 
-    return {'success': True}
+    return {'success': True, 'versions': get_graph_versions(diagram.graph),
+            'validation_errors': validation_errors}
+
+
+@app.route('/editor/<id>', methods=['PATCH'])
+@login_required
+def save_diagram_graphs(id):
+    # Save only the changed graphs of an unchanged hierarchy
+    permission = get_permission(current_user.id, id)
+    if not permission.can_edit:
+        abort(403)
+
+    diagram = get_diagram(id)
+
+    # Validate title edit
+    new_title = request.json['title']
+    if not new_title == diagram.title and not permission.is_author:
+        # User lacks permission to edit title
+        abort(403)
+    elif len(new_title) == 0:
+        # Empty title
+        abort(500)
+
+    # Rules are checked on the patched graphs and their links to their parent and sub processes
+    validation_errors = None
+    if app.config['VALIDATE_ON_SAVE'] != 'off':
+        validation_errors = [error._asdict() for error in validate_graph_patches(
+            *load_patched_graphs(diagram.graph, request.json['graphs']))]
+        if save_rejected(validation_errors):
+            return {'success': False, 'validation_errors': validation_errors}, 400
+
+    def save():
+        # Set new title, graphs, revision and edit entry (committed together)
+        diagram = get_diagram(id)
+        diagram.title = new_title
+        changes, versions = save_graph_patches(id, request.json['graphs'], commit=False)
+        revision = None
+        if changes:
+            revision = add_patch_revision(diagram.id, changes)
+            if revision is None:
+                # Diagram predates revisions, start with a full one
+                revision = add_revision(diagram.id, load_hierarchy(diagram.graph))
+        add_edit(current_user.id, diagram.id, request.json['edit_message'],
+                 revision.id if revision else None)
+        return versions
+
+    try:
+        versions = commit_save(save)
+    except VersionConflict as conflict:
+        return {'success': False, 'conflicts': conflict.paths}, 409
+
+    return {'success': True, 'versions': versions, 'validation_errors': validation_errors}
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -105,7 +233,10 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        with span('check_password'):
+            password_matches = user and bcrypt.check_password_hash(
+                user.password, form.password.data)
+        if password_matches:
             # Login User
             login_user(user, remember=form.remember.data)
 
@@ -131,15 +262,90 @@ def logout():
 @app.route('/account')
 @login_required
 def account():
-    created_diagrams = get_user_created_diagrams(current_user)
-    invited_diagrams = get_user_invited_diagrams(current_user)
+    # First page of each list, the rest is fetched from list_diagrams
+    created_diagrams, created_next = get_diagrams_page(current_user, 'created')
+    invited_diagrams, invited_next = get_diagrams_page(current_user, 'invited')
 
     invite_editor_form = InviteEditorForm()
 
     return render_template('account.html',
-                           created_diagrams=created_diagrams, invited_diagrams=invited_diagrams,
-                           get_diagram_editors=get_diagram_editors, get_diagram_edits=get_diagram_edits,
-                           get_user=get_user, invite_editor_form=invite_editor_form)
+                           created_diagrams=created_diagrams, created_next=created_next,
+                           invited_diagrams=invited_diagrams, invited_next=invited_next,
+                           invite_editor_form=invite_editor_form)
+
+
+def page_limit():
+    return min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+
+@app.route('/diagrams')
+@login_required
+def list_diagrams():
+    kind = request.args.get('kind', 'created')
+    if kind not in ('created', 'invited'):
+        abort(400)
+
+    try:
+        diagrams, next_cursor = get_diagrams_page(
+            current_user, kind, request.args.get('after'), page_limit())
+    except ValueError:
+        # Malformed cursor
+        abort(400)
+
+    data = {'success': True, 'next': next_cursor,
+            'diagrams': [{'id': diagram.id, 'title': diagram.title, 'author': diagram.creator.username,
+                          'editors': [invitation.user.username for invitation in diagram.invitations],
+                          'created_on': diagram.created_on.isoformat(),
+                          'url': url_for('editor', id=diagram.id)} for diagram in diagrams]}
+
+    # Rendered list items for the account page
+    if request.args.get('render'):
+        diagram_items = get_template_attribute(
+            '_diagram_list.html', 'diagram_items')
+        data['html'] = diagram_items(
+            current_user, diagrams, InviteEditorForm())
+
+    return data
+
+
+@app.route('/search')
+@login_required
+def search():
+    item_type = request.args.get('type')
+    if item_type is not None and item_type not in SEARCH_ITEM_TYPES:
+        abort(400)
+
+    # One extra match tells if there are more than the limit
+    limit = page_limit()
+    matches = search_diagrams(current_user.id, request.args.get('q', ''), item_type, limit + 1)
+
+    diagrams = {}
+    for match in matches[:limit]:
+        if match.diagram_id not in diagrams:
+            diagrams[match.diagram_id] = {'id': match.diagram_id, 'title': match.diagram_title,
+                                          'url': url_for('editor', id=match.diagram_id), 'matches': []}
+        diagrams[match.diagram_id]['matches'].append(
+            {'path': match.path, 'item_type': match.item_type, 'label': match.label})
+
+    return {'success': True, 'more': len(matches) > limit, 'diagrams': list(diagrams.values())}
+
+
+@app.route('/diagram/<id>/edits')
+@login_required
+def list_diagram_edits(id):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    try:
+        edits, next_cursor = get_diagram_edits_page(
+            id, request.args.get('before'), page_limit())
+    except ValueError:
+        # Malformed cursor
+        abort(400)
+
+    return {'success': True, 'next': next_cursor,
+            'edits': [{'id': edit.id, 'editor': edit.user.username, 'message': edit.message,
+                       'edited_on': edit.edited_on.strftime('%Y/%m/%d, %H: %M')} for edit in edits]}
 
 
 @app.route('/invite/<user_id>_<diagram_id>', methods=['POST'])
@@ -152,6 +358,7 @@ def delete_invited_editor(user_id, diagram_id):
     invitation = Invitation.query.get_or_404((user_id, diagram_id))
     db.session.delete(invitation)
     db.session.commit()
+    invalidate_permissions(diagram_id)
 
     flash('{} has been removed from {}.'.format(
         get_user(user_id).username, get_diagram(diagram_id).title), 'info')
@@ -180,6 +387,7 @@ def invite_editor(diagram_id):
                                 invited_to=diagram_id)
             db.session.add(invite)
             db.session.commit()
+            invalidate_permissions(diagram_id)
 
             flash('User {} have been invited to {}'.format(
                 invited_user.username, get_diagram(diagram_id).title), 'success')
@@ -210,21 +418,118 @@ def create_diagram():
         # Empty title
         abort(500)
 
-    # Create Diagram
-    root = create_graph_and_children(request.json['dfd'], 0)
-    new_diagram = DataFlowDiagram(
-        title=request.json['title'], author=current_user.id, graph=root)
-    db.session.add(new_diagram)
-    db.session.commit()
+    validation_errors = validate_save(request.json['dfd'])
+    if save_rejected(validation_errors):
+        return {'success': False, 'validation_errors': validation_errors}, 400
+
+    def save():
+        # Create diagram, revision and edit (committed together)
+        root = create_graph_and_children(request.json['dfd'], 0)
+        new_diagram = DataFlowDiagram(
+            title=request.json['title'], author=current_user.id, graph=root)
+        db.session.add(new_diagram)
+        db.session.flush()
+        revision = add_revision(new_diagram.id, request.json['dfd'])
+        add_edit(current_user.id, new_diagram.id,
+                 request.json['edit_message'], revision.id)
+        return new_diagram
+
+    new_diagram = commit_save(save)
+    # Diagram ids can be reused after a delete
+    invalidate_permissions(new_diagram.id)
+
+    return {'success': True, 'diagram_url': url_for('editor', id=new_diagram.id),
+            'validation_errors': validation_errors}
+
+
+@app.route('/diagram/<id>/revisions')
+@login_required
+def list_revisions(id):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    revisions = [{'number': revision.number, 'editor': editor.username, 'message': edit.message,
+                  'edited_on': edit.edited_on.isoformat()}
+                 for revision, edit, editor in get_diagram_revisions(id)]
+    return {'success': True, 'revisions': revisions}
+
+
+@app.route('/diagram/<id>/revisions/<int:number>')
+@login_required
+def get_diagram_revision(id, number):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    revision = get_revision(id, number)
+    if revision is None:
+        abort(404)
+
+    return {'success': True, 'number': revision.number, 'dfd': load_revision(revision)}
+
+
+@app.route('/diagram/<id>/revisions/<int:number>/restore', methods=['POST'])
+@login_required
+def restore_diagram_revision(id, number):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    revision = get_revision(id, number)
+    if revision is None:
+        abort(404)
+
+    # Save restored graph as a new revision
+    dfd = load_revision(revision)
 
-    # Create edit
-    add_edit(current_user.id, new_diagram.id, request.json['edit_message'])
+    def save():
+        save_graph(id, dfd, commit=False)
+        restored = add_revision(id, dfd)
+        add_edit(current_user.id, int(id),
+                 'Restored revision {}'.format(number), restored.id)
+        return restored
 
-    return {'success': True, 'diagram_url': url_for('editor', id=new_diagram.id)}
+    restored = commit_save(save)
+
+    return {'success': True, 'number': restored.number}
 
 
 @app.route('/diagram/export', methods=['POST'])
 @login_required
 def export_diagram():
-    rdf_export = export_dfd(request.json['dfd'])
+    try:
+        rdf_export = export_dfd(request.json['dfd'])
+    except MalformedGraph as error:
+        return malformed_graph_response(error)
     return {'success': True, 'rdf': rdf_export}
+
+
+@app.route('/diagram/<id>/export')
+@login_required
+def export_stored_diagram(id):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    diagram = get_diagram(id)
+    try:
+        rdf_export = export_dfd(load_hierarchy(diagram.graph), parallel=True)
+    except MalformedGraph as error:
+        return malformed_graph_response(error)
+    return {'success': True, 'rdf': rdf_export}
+
+
+@app.route('/diagram/<id>/export.<any(ttl, nt):extension>')
+@login_required
+def download_diagram_export(id, extension):
+    if not get_permission(current_user.id, id).can_edit:
+        abort(403)
+
+    # Stream export as a file download
+    diagram = get_diagram(id)
+    rdf_format = 'nt' if extension == 'nt' else 'turtle'
+    try:
+        chunks = stream_dfd(load_hierarchy(diagram.graph),
+                            rdf_format, parallel=True)
+    except MalformedGraph as error:
+        return malformed_graph_response(error)
+    filename = '{}.{}'.format(secure_filename(diagram.title) or 'DFD', extension)
+    return Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[rdf_format],
+                    headers={'Content-Disposition': 'attachment; filename={}'.format(filename)})
@@ -0,0 +1,126 @@
+import re
+from collections import namedtuple
+from lxml import etree
+from sqlalchemy import and_, case, distinct, exists, func, literal, or_
+from App import db
+from App.models import DataFlowDiagram, Graph, GraphChildren, Invitation, SearchTerm
+from App.instrumentation import timed
+
+# Item types labels are indexed under, flows by their name
+SEARCH_ITEM_TYPES = ('entity', 'process', 'datastore', 'flow')
+
+# Most labels a search returns
+SEARCH_LIMIT = 100
+
+# Highest code point, terms starting with a prefix sort from the prefix up to the prefix followed by it
+TERM_END = '\U0010ffff'
+
+# Process and data store numbers such as 1.2 and D1.2 are single terms, other terms are words
+TERM = re.compile(r'\bd?\d+(?:\.\d+)*\b|\w+')
+NUMBER = re.compile(r'd?\d+(?:\.\d+)*')
+
+# A label matching a search, path holds the graph titles from the diagram's context diagram
+SearchMatch = namedtuple('SearchMatch', ['diagram_id', 'diagram_title', 'path', 'item_type', 'label'])
+
+
+def label_terms(label):
+    return set(TERM.findall(label.lower()))
+
+
+def term_matches(term, other):
+    # Words match words they start, numbers match themselves and the numbers of their sub processes
+    if NUMBER.fullmatch(term):
+        return other == term or other.startswith(term + '.')
+    return other.startswith(term)
+
+
+def graph_labels(xml_model):
+    # (item type, label) of the items defined in a graph and of its flows, copies from the parent are left out
+    labels = set()
+    try:
+        root = etree.fromstring(xml_model.encode('utf-8'), etree.XMLParser(resolve_entities=False))
+    except etree.XMLSyntaxError:
+        return labels
+
+    for element in root.iter('mxCell', 'entity', 'process', 'datastore'):
+        attributes = element.attrib
+        if element.tag == 'mxCell':
+            if attributes.get('item_type') == 'flow' and attributes.get('value'):
+                labels.add(('flow', attributes.get('value')))
+        elif attributes.get('label') and not attributes.get('from_parent'):
+            labels.add((element.tag, attributes.get('label')))
+    return labels
+
+
+def graph_term_rows(graph_id, xml_model):
+    # Search term rows of a graph, for bulk inserts
+    return [{'graph': graph_id, 'term': term, 'item_type': item_type, 'label': label}
+            for item_type, label in sorted(graph_labels(xml_model)) for term in sorted(label_terms(label))]
+
+
+def query_terms(query):
+    # Terms of the query, less those matching another term as that one matching implies they do
+    terms = label_terms(query)
+    return sorted(term for term in terms
+                  if not any(other != term and term_matches(term, other) for other in terms))
+
+
+def term_filter(term):
+    # Range rather than LIKE, which SQLite only runs on an index for case sensitive columns
+    if NUMBER.fullmatch(term):
+        # 1.1 matches 1.1 and 1.1.2, not 1.12
+        return or_(SearchTerm.term == term,
+                   and_(SearchTerm.term >= term + '.', SearchTerm.term < term + '.' + TERM_END))
+    return and_(SearchTerm.term >= term, SearchTerm.term < term + TERM_END)
+
+
+def graph_paths(graph_ids):
+    # Title path of each graph from its root graph, walking up through the parents
+    ancestors = db.session.query(Graph.id.label('graph'), Graph.id.label('id'), literal(0).label('depth')).filter(
+        Graph.id.in_(graph_ids)).cte(name='graph_path', recursive=True)
+    ancestors = ancestors.union_all(db.session.query(
+        ancestors.c.graph, GraphChildren.parent, ancestors.c.depth + 1).join(
+        ancestors, GraphChildren.child == ancestors.c.id))
+
+    titles = {}
+    for graph_id, depth, title in db.session.query(ancestors.c.graph, ancestors.c.depth, Graph.title).join(
+            Graph, Graph.id == ancestors.c.id):
+        titles.setdefault(graph_id, []).append((depth, title))
+    return {graph_id: [title for _, title in sorted(path, reverse=True)] for graph_id, path in titles.items()}
+
+
+@timed('search_diagrams')
+def search_diagrams(user_id, query, item_type=None, limit=SEARCH_LIMIT):
+    # Labels with a word starting with each word of the query, in diagrams the user created or is invited to
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    conditions = [term_filter(term) for term in terms]
+    labels = db.session.query(SearchTerm.graph, SearchTerm.item_type, SearchTerm.label).filter(or_(*conditions))
+    if item_type is not None:
+        labels = labels.filter(SearchTerm.item_type == item_type)
+    labels = labels.group_by(SearchTerm.graph, SearchTerm.item_type, SearchTerm.label)
+    if len(terms) > 1:
+        # Every query word must match one of the label's words
+        matched_term = case([(condition, i) for i, condition in enumerate(conditions)])
+        labels = labels.having(func.count(distinct(matched_term)) == len(terms))
+    labels = labels.cte(name='search_labels')
+
+    # Walk up from the matching graphs to their root graph, only reading the matches' ancestors
+    ancestors = db.session.query(labels.c.graph.label('graph'), labels.c.graph.label('id')).distinct().cte(
+        name='search_ancestors', recursive=True)
+    ancestors = ancestors.union_all(db.session.query(ancestors.c.graph, GraphChildren.parent).join(
+        ancestors, GraphChildren.child == ancestors.c.id))
+
+    invited = exists().where(and_(Invitation.invited_to == DataFlowDiagram.id, Invitation.invited_user == user_id))
+    matches = db.session.query(
+        DataFlowDiagram.id, DataFlowDiagram.title, labels.c.graph, labels.c.item_type, labels.c.label).join(
+        ancestors, DataFlowDiagram.graph == ancestors.c.id).join(
+        labels, labels.c.graph == ancestors.c.graph).filter(
+        or_(DataFlowDiagram.author == user_id, invited)).order_by(
+        DataFlowDiagram.id, labels.c.graph, labels.c.item_type, labels.c.label).limit(limit).all()
+
+    paths = graph_paths({graph_id for _, _, graph_id, _, _ in matches}) if matches else {}
+    return [SearchMatch(diagram_id, diagram_title, paths[graph_id], match_type, label)
+            for diagram_id, diagram_title, graph_id, match_type, label in matches]
@@ -18,3 +18,98 @@ function confirm_delete_diagram(diagram_title) {
 	 */
 	return confirm(`Are you sure you want to delete ${diagram_title}.`);
 }
+
+async function load_more_diagrams(button) {
+	/**
+	 * Fetches the next page of a diagram list and appends it to the list.
+	 * @param  {HTMLElement} button Load more button, holding the list id, url and next page cursor.
+	 */
+	let url = `${button.dataset.url}&render=1&after=${encodeURIComponent(
+		button.dataset.next
+	)}`;
+	await fetch(url, { credentials: "same-origin" })
+		.then(response => {
+			if (response.status != 200) alert("Error: Unable to load diagrams");
+			else return response.json();
+		})
+		.then(json => {
+			if (!json || !json.success) return;
+
+			// Add diagrams to list
+			document
+				.getElementById(button.dataset.list)
+				.insertAdjacentHTML("beforeend", json.html);
+
+			// Update cursor or remove button on last page
+			if (json.next) button.dataset.next = json.next;
+			else button.remove();
+		});
+}
+
+async function load_edits(modal) {
+	/**
+	 * Fetches the next page of a diagram's edit log and appends it to the modal's edit list.
+	 * @param  {HTMLElement} modal Editor manager modal of the diagram.
+	 */
+	let url = modal.dataset.editsUrl;
+	if (modal.dataset.editsNext)
+		url += `?before=${encodeURIComponent(modal.dataset.editsNext)}`;
+
+	await fetch(url, { credentials: "same-origin" })
+		.then(response => {
+			if (response.status != 200) alert("Error: Unable to load edits");
+			else return response.json();
+		})
+		.then(json => {
+			if (!json || !json.success) return;
+
+			// Add edits to list
+			let edit_log = modal.querySelector(".edit_log");
+			json.edits.forEach(edit => edit_log.appendChild(create_edit_item(edit)));
+			if (edit_log.children.length === 0)
+				edit_log.innerHTML = `
+					<div class="row justify-content-center p-4">
+						<h4>
+							<span class="badge badge-info">No edits</span>
+						</h4>
+					</div>
+				`;
+
+			// Show load more button while there are more pages
+			modal.dataset.editsNext = json.next || "";
+			modal.querySelector(".load_more_edits").hidden = !json.next;
+		});
+}
+
+function create_edit_item(edit) {
+	/**
+	 * Creates edit log list item.
+	 * @param  {Object} edit Edit with editor, message and edited_on.
+	 * @returns {HTMLElement} List item of the edit.
+	 */
+	let item = document.createElement("li");
+	item.className = "list-group-item pb-1";
+	item.innerHTML = `
+		<div><b></b> <span></span></div>
+		<div class="float-right pr-2">
+			<span class="badge badge-secondary"></span>
+		</div>
+	`;
+	/* set text content so user input isn't parsed as html */
+	item.querySelector("b").textContent = `${edit.editor}:`;
+	item.querySelector("span").textContent = edit.message;
+	item.querySelector(".badge").textContent = edit.edited_on;
+	return item;
+}
+
+// Load edit log when an editor manager is first opened
+$(document).on("show.bs.modal", ".editor_manager", event => {
+	let modal = event.currentTarget;
+	if (modal.dataset.editsLoaded) return;
+	modal.dataset.editsLoaded = true;
+	load_edits(modal);
+});
+
+$(document).on("click", ".load_more_edits", event =>
+	load_edits(event.currentTarget.closest(".editor_manager"))
+);
@@ -1,20 +1,28 @@
-function create_hierarchy(loaded_hierarchy) {
+/* URL graphs of the loaded diagram are fetched from, by appending their id */
+var graphs_url = null;
+
+function create_hierarchy(loaded_hierarchy, loaded_graphs_url) {
 	/**
 	 * Initializes diagram hierarchy and populates it with entries from the loaded hierarchy.
 	 * @param {Object} loaded_hierarchy Diagram hierarchy loaded from server.
 	 * 		If null will create a new diagram hierarchy.
+	 * @param {String} loaded_graphs_url URL to fetch the graphs of the loaded hierarchy from.
 	 */
 	if (!loaded_hierarchy) {
 		// Add starting diagram
 		let starting_diagram_name = "Context diagram";
 		add_to_hierarchy(starting_diagram_name, null, null);
 	} else {
+		graphs_url = loaded_graphs_url;
 		load_hierarchy(loaded_hierarchy, null);
 		update_editor_graph(
 			get_hierarchy_diagram(loaded_hierarchy.title).graph_model
 		);
 	}
 
+	// Track changes from the loaded graphs
+	mark_hierarchy_saved();
+
 	// Set starting diagram as active
 	document
 		.getElementById("Context_diagram_hierarchy_item")
@@ -23,34 +31,20 @@ function create_hierarchy(loaded_hierarchy) {
 
 function load_hierarchy(current_hierarchy, parent_title) {
 	/**
-	 * Recursively adds a entry for graph and it children and set its model using it decoded xml model.
+	 * Recursively adds a entry for graph and it children.
+	 * Graph models are fetched and decoded when first used, only the starting diagram's xml is loaded.
 	 * @param {Object} current_hierarchy The current sub hierarchy being loaded.
 	 */
 	// Add entry
 	add_to_hierarchy(current_hierarchy.title, parent_title);
+	let entry = get_hierarchy_diagram(current_hierarchy.title);
+	entry.graph_id = current_hierarchy.id;
+	entry.version = current_hierarchy.version;
+	entry.xml_model = current_hierarchy.xml_model || null;
 
-	// Set graph for entry
-	/* Parse xml */
-	let xml_model = mxUtils.parseXml(current_hierarchy.xml_model);
-	let codec = new mxCodec(xml_model);
-	let loaded_graph = codec.decode(xml_model.documentElement);
-	set_hierarchy_diagram(current_hierarchy.title, {
-		new_model: loaded_graph
-	});
-
-	// Set id of process in diagram hierarchy
-	try {
-		let parent_process = get_hierarchy_diagram(parent_title);
-		/* find current process cell in parent diagram */
-		let cell = find_cell_in_graph(
-			parent_process.graph_model,
-			current_hierarchy.title,
-			"process"
-		);
-		/* set id */
-		let new_id = cell.children[0].value;
-		set_hierarchy_diagram(current_hierarchy.title, { new_id });
-	} catch {}
+	// Set graph and id of process in diagram hierarchy when first used
+	lazy_load_graph(entry);
+	if (parent_title) lazy_load_process_id(entry, get_hierarchy_diagram(parent_title));
 
 	// Recursively add children entries
 	current_hierarchy.children.forEach(child =>
@@ -58,6 +52,110 @@ function load_hierarchy(current_hierarchy, parent_title) {
 	);
 }
 
+function lazy_load_graph(entry) {
+	/**
+	 * Makes the entry's graph model decode on first use.
+	 * The graph must be fetched by then, handlers reading other graphs fetch them first
+	 * with fetch_graphs or fetch_sub_hierarchy.
+	 * @param {Object} entry Hierarchy entry with graph_id and xml_model (null until fetched).
+	 */
+	let graph_model = null;
+	entry.graph_decoded = false;
+	Object.defineProperty(entry, "graph_model", {
+		configurable: true,
+		enumerable: true,
+		get() {
+			if (!entry.graph_decoded) {
+				if (entry.xml_model === null)
+					throw `Error: Graph ${entry.name} used before it was fetched.`;
+				/* Parse xml */
+				let xml_model = mxUtils.parseXml(entry.xml_model);
+				let codec = new mxCodec(xml_model);
+				graph_model = codec.decode(xml_model.documentElement);
+				entry.graph_decoded = true;
+				entry.saved_xml = serialize_graph_model(graph_model);
+			}
+			return graph_model;
+		},
+		set(new_model) {
+			graph_model = new_model;
+			entry.graph_decoded = true;
+		}
+	});
+}
+
+function lazy_load_process_id(entry, parent_entry) {
+	/**
+	 * Makes the entry's process id be read from the parent graph on first use.
+	 * @param {Object} entry Hierarchy entry of the sub process.
+	 * @param {Object} parent_entry Hierarchy entry of the graph containing the process.
+	 */
+	let process_id;
+	let resolved = false;
+	Object.defineProperty(entry, "process_id", {
+		configurable: true,
+		enumerable: true,
+		get() {
+			/* Read once the parent graph is fetched */
+			if (!resolved && parent_entry.xml_model !== null) {
+				resolved = true;
+				try {
+					/* find current process cell in parent diagram */
+					let cell = find_cell_in_graph(
+						parent_entry.graph_model,
+						entry.name,
+						"process"
+					);
+					process_id = cell.children[0].value;
+				} catch {}
+			}
+			return process_id;
+		},
+		set(new_id) {
+			process_id = new_id;
+			resolved = true;
+		}
+	});
+}
+
+function receive_graph(entry, graph) {
+	/**
+	 * Stores a graph fetched from the server in its hierarchy entry.
+	 * @param {Object} entry Hierarchy entry of the graph.
+	 * @param {Object} graph Graph id, title, version and xml_model.
+	 */
+	entry.xml_model = graph.xml_model;
+	entry.version = graph.version;
+}
+
+async function fetch_graphs(entries) {
+	/**
+	 * Fetches the graphs of entries that have not been fetched yet, in parallel.
+	 * @param {Array} entries Hierarchy entries to fetch.
+	 */
+	await Promise.all(
+		entries
+			.filter(entry => entry.xml_model === null)
+			.map(entry =>
+				fetch(`${graphs_url}/${entry.graph_id}`, { credentials: "same-origin" })
+					.then(response => {
+						if (response.status != 200) throw new Error(response.status);
+						return response.json();
+					})
+					.then(graph => receive_graph(entry, graph))
+			)
+	);
+}
+
+async function fetch_sub_hierarchy(sub_hierarchy) {
+	/**
+	 * Fetches the graphs of a sub hierarchy that have not been fetched yet,
+	 * the graphs find_all_occurrences searches.
+	 * @param {Object} sub_hierarchy Hierarchy entry fetched with its sub processes.
+	 */
+	await fetch_graphs(hierarchy_entries(sub_hierarchy).map(([path, entry]) => entry));
+}
+
 function add_to_hierarchy(name, parent_name, process_id) {
 	/**
 	 * Adds new diagram to hierarchy data structure and html diagram list.
@@ -238,7 +336,7 @@ function get_process_parent(name, hierarchy) {
 	return found_parent;
 }
 
-function switch_graph(event) {
+async function switch_graph(event) {
 	/**
 	 * Diagram hierarchy list click event handler.
 	 * Switch's the editing diagram with the one selected.
@@ -248,11 +346,6 @@ function switch_graph(event) {
 	// Prevent event bubbling to outer elements
 	event.stopPropagation();
 
-	// Get hierarchy items
-	let [
-		current_hierarchy_item,
-		current_graph_name
-	] = get_active_hierarchy_item_and_name();
 	let target_hierarchy_item = event.target;
 	/* get list item if title clicked */
 	if (target_hierarchy_item.classList.contains("hierarchy_item_title"))
@@ -265,6 +358,27 @@ function switch_graph(event) {
 		"hierarchy_item_title"
 	)[0].innerText;
 
+	// Fetch the target graph and the parents its process id is read from
+	let fetch_entries = [];
+	for (
+		let entry = get_hierarchy_diagram(target_graph_name);
+		entry;
+		entry = get_process_parent(entry.name, hierarchy)
+	)
+		fetch_entries.push(entry);
+	try {
+		await fetch_graphs(fetch_entries);
+	} catch {
+		alert("Error: Unable to load diagram");
+		return;
+	}
+
+	// Get hierarchy items
+	let [
+		current_hierarchy_item,
+		current_graph_name
+	] = get_active_hierarchy_item_and_name();
+
 	// Swap active class
 	current_hierarchy_item.classList.remove("diagram_active");
 	target_hierarchy_item.classList.add("diagram_active");
@@ -232,7 +232,7 @@ function graph_add_or_move(sender, event) {
 							cell[opposite],
 							process_name,
 							new Set()
-						);
+						).catch(() => alert("Error: Unable to load diagram"));
 					} catch {}
 			});
 		}
@@ -242,7 +242,7 @@ function graph_add_or_move(sender, event) {
 	save_current_graph(active_process_name);
 }
 
-function graph_delete(sender, event) {
+async function graph_delete(sender, event) {
 	/**
 	 * Cell deletion event handler.
 	 * @param  {Object} sender Sender of the event
@@ -258,6 +258,13 @@ function graph_delete(sender, event) {
 		let process_id = process.process_id;
 
 		let cells = event.getProperty("cells");
+		/* Removed items and their ids are updated in every graph, fetch them first */
+		try {
+			await fetch_sub_hierarchy(hierarchy);
+		} catch {
+			alert("Error: Unable to load diagram");
+			return;
+		}
 		cells.forEach(cell => {
 			let cell_name = editor.graph.convertValueToString(cell);
 
@@ -304,7 +311,7 @@ function graph_delete(sender, event) {
 	event.consume();
 }
 
-function cell_label_edit(sender, event) {
+async function cell_label_edit(sender, event) {
 	/**
 	 * Cell label edit event handler.
 	 * @param  {Object} sender Sender of the event
@@ -312,8 +319,13 @@ function cell_label_edit(sender, event) {
 	 */
 	let cell = event.getProperty("cell");
 	/* Update name of all occurrences */
-	if (["entity", "process", "datastore", "flow"].includes(cell.item_type))
-		rename_all_occurrences(sender, event);
+	try {
+		if (["entity", "process", "datastore", "flow"].includes(cell.item_type))
+			await rename_all_occurrences(sender, event);
+	} catch {
+		alert("Error: Unable to load diagram");
+		return;
+	}
 
 	/* Update hierarchy list and data structure */
 	if (cell.item_type === "process") update_hierarchy_name(sender, event);
@@ -326,7 +338,9 @@ function cell_label_edit(sender, event) {
 		let old_name = mxUtils.isNode(event.getProperty("old"))
 			? event.getProperty("old").getAttribute("label")
 			: event.getProperty("old");
-		update_flow_requirements(cell, old_name, new_name);
+		update_flow_requirements(cell, old_name, new_name).catch(() =>
+			alert("Error: Unable to load diagram")
+		);
 	}
 }
 
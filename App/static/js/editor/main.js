@@ -36,7 +36,7 @@ const DATASTORE_DIMENSIONS = {
 	height: 60
 };
 
-function main(editor_path, loaded_hierarchy) {
+function main(editor_path, loaded_hierarchy, graphs_url) {
 	/**
 	 * Initializes editor. Creates editor, toolbar and diagram hierarchy.
 	 * Displays error message if browser is not supported.
@@ -44,6 +44,7 @@ function main(editor_path, loaded_hierarchy) {
 	 * @param  {Object} loaded_hierarchy Existing Diagram hierarchy loaded from server.
 	 *		This is loaded into the hierarchy global data structure.
 	 		Null if creating a new DFD. New hierarchy will be created in this case 
+	 * @param  {String} graphs_url URL to fetch the graphs of the loaded hierarchy from.
 	 */
 
 	// Checks if browser is supported
@@ -65,6 +66,6 @@ function main(editor_path, loaded_hierarchy) {
 			`${editor_path}/images`
 		);
 
-		create_hierarchy(loaded_hierarchy);
+		create_hierarchy(loaded_hierarchy, graphs_url);
 	}
 }
@@ -7,6 +7,10 @@ function show_save_modal() {
 	else $("#save_modal").modal("toggle");
 }
 
+/* Title paths of the hierarchy when it was loaded or last saved.
+    Saves send only the changed graphs while the hierarchy keeps this structure. */
+var saved_structure = null;
+
 async function save_diagram_button_handler(save_url, save_method) {
 	/**
 	 * Saves Data Flow Diagram to server
@@ -18,53 +22,154 @@ async function save_diagram_button_handler(save_url, save_method) {
 	let active_graph_name = get_active_hierarchy_item_and_name()[1];
 	save_current_graph(active_graph_name);
 
-	// Serialize Data Flow Diagram
-	let dfd = serialize_dfd(hierarchy);
 	let title = document.getElementById("diagram_title_input").value;
 
 	// Get edit message
 	let edit_message = document.getElementById("edit_message_input").value;
 
+	// Serialize only changed graphs if no sub process was added, removed or renamed
+	let entries = hierarchy_entries(hierarchy);
+	let structure = JSON.stringify(entries.map(([path]) => path));
+	// Xml sent of each graph, edits made while the request is in flight stay unsaved
+	let sent_xml = new Map();
+	let body;
+	if (save_method === "PUT" && structure === saved_structure) {
+		save_method = "PATCH";
+		let graphs = [];
+		entries.forEach(([path, entry]) => {
+			// Graphs never opened are unchanged
+			if (entry.graph_decoded === false) return;
+			let xml = serialize_graph_model(entry.graph_model);
+			if (xml !== entry.saved_xml) {
+				graphs.push({
+					path: path,
+					graph_id: entry.graph_id,
+					version: entry.version,
+					xml_model: xml
+				});
+				sent_xml.set(entry, xml);
+			}
+		});
+		body = { title: title, graphs: graphs, edit_message: edit_message };
+	} else {
+		// Serialize Data Flow Diagram
+		try {
+			await fetch_sub_hierarchy(hierarchy);
+		} catch {
+			alert("Error: Unable to save diagram");
+			return;
+		}
+		let dfd = serialize_dfd(hierarchy, sent_xml);
+		body = { title: title, dfd: dfd, edit_message: edit_message };
+	}
+
 	// Make save request
 	fetch(save_url, {
 		method: save_method,
 		credentials: "same-origin",
 		headers: { "Content-Type": "application/json" },
-		body: JSON.stringify({
-			title: title,
-			dfd: dfd,
-			edit_message: edit_message
-		})
+		body: JSON.stringify(body)
 	})
 		.then(response => {
-			if (response.status != 200) alert("Error: Unable to save diagram");
+			if (response.status == 409)
+				alert(
+					"Error: The diagram was changed by another editor. Reload it to get their changes."
+				);
+			else if (response.status == 400)
+				return response
+					.json()
+					.catch(() => alert("Error: Unable to save diagram"));
+			else if (response.status != 200) alert("Error: Unable to save diagram");
 			else return response.json();
 		})
 		.then(json => {
+			if (json && json.validation_errors && json.validation_errors.length > 0 && !json.success) {
+				// Server rejects invalid diagrams
+				let { path, message } = json.validation_errors[0];
+				alert(`Error: ${path[path.length - 1]} is invalid. ${message}`);
+			}
+			if (!json || !json.success) return;
 			// Redirect if created new diagram
-			if (json.success && json.diagram_url)
-				window.location.href = json.diagram_url;
+			if (json.diagram_url) window.location.href = json.diagram_url;
+			else mark_hierarchy_saved(json.versions, { structure: structure, xml: sent_xml });
 		});
 }
 
-function serialize_dfd(diagram_hierarchy) {
+function serialize_dfd(diagram_hierarchy, sent_xml) {
 	/**
-	 * Recursively serialize diagram hierarchy. Graph models are encoded as xml.
+	 * Recursively serialize diagram hierarchy. Graph models are encoded as xml,
+	 * graphs never opened keep the xml they were fetched with.
 	 * @param  {Object} sub_hierarchy Hierarchy being serialized.
+	 * @param  {Map} sent_xml (Optional) Records the xml of each encoded graph by hierarchy entry.
 	 * @returns Serialized Diagram
 	 */
-	// Serialize diagram to xml
-	let encoder = new mxCodec();
-	let result = encoder.encode(diagram_hierarchy.graph_model);
-	let xml = mxUtils.getXml(result);
-
+	let xml_model = diagram_hierarchy.xml_model;
+	if (diagram_hierarchy.graph_decoded !== false) {
+		xml_model = serialize_graph_model(diagram_hierarchy.graph_model);
+		if (sent_xml) sent_xml.set(diagram_hierarchy, xml_model);
+	}
 	return {
 		title: diagram_hierarchy.name,
-		xml_model: xml,
-		children: diagram_hierarchy.children.map(child => serialize_dfd(child))
+		xml_model: xml_model,
+		children: diagram_hierarchy.children.map(child => serialize_dfd(child, sent_xml))
 	};
 }
 
+function serialize_graph_model(graph_model) {
+	/**
+	 * Encodes graph model as xml.
+	 * @param  {Object} graph_model Graph model to encode.
+	 * @returns Xml string of the graph model
+	 */
+	let encoder = new mxCodec();
+	let result = encoder.encode(graph_model);
+	return mxUtils.getXml(result);
+}
+
+function hierarchy_entries(sub_hierarchy, parent_path = []) {
+	/**
+	 * Flattens hierarchy into title path and entry pairs, parents before their children.
+	 * @param  {Object} sub_hierarchy Hierarchy being flattened.
+	 * @param  {Array} parent_path Titles from the starting diagram to the parent.
+	 * @returns List of [title path, hierarchy entry]
+	 */
+	let path = [...parent_path, sub_hierarchy.name];
+	let entries = [[path, sub_hierarchy]];
+	sub_hierarchy.children.forEach(child =>
+		entries.push(...hierarchy_entries(child, path))
+	);
+	return entries;
+}
+
+function mark_hierarchy_saved(versions, sent) {
+	/**
+	 * Records the saved xml of graphs and their server versions and ids,
+	 * so the next save only sends graphs changed since.
+	 * @param  {Array} versions (Optional) [title path, version, graph id] of saved graphs.
+	 * @param  {Object} sent (Optional) Title paths and xml by entry the save sent,
+	 *      without it the hierarchy as loaded is recorded.
+	 */
+	let saved_versions = new Map(
+		(versions || []).map(([path, version, graph_id]) => [
+			JSON.stringify(path),
+			[version, graph_id]
+		])
+	);
+	let entries = hierarchy_entries(hierarchy);
+	entries.forEach(([path, entry]) => {
+		// Graphs not decoded yet record their saved xml when decoded
+		if (sent) {
+			if (sent.xml.has(entry)) entry.saved_xml = sent.xml.get(entry);
+		} else if (entry.graph_decoded !== false)
+			entry.saved_xml = serialize_graph_model(entry.graph_model);
+		let key = JSON.stringify(path);
+		/* A full save recreates graphs, so ids are updated too */
+		if (saved_versions.has(key))
+			[entry.version, entry.graph_id] = saved_versions.get(key);
+	});
+	saved_structure = sent ? sent.structure : JSON.stringify(entries.map(([path]) => path));
+}
+
 function save_current_graph(active_graph_name) {
 	/**
 	 * Saves currently edited graph to diagram hierarchy.
@@ -88,6 +193,14 @@ async function export_diagram_button_handler() {
 	/**
 	 * Makes export request and download of turtle RDF representation of DFD
 	 */
+	// Fetch graphs not opened yet, validation reads them all
+	try {
+		await fetch_sub_hierarchy(hierarchy);
+	} catch {
+		alert("Error: Unable to export DFD");
+		return;
+	}
+
 	// Confirm DFD is valid
 	let validation_result = is_dfd_valid(hierarchy);
 	if (!validation_result[0]) {
@@ -107,12 +220,21 @@ async function export_diagram_button_handler() {
 		body: JSON.stringify({ dfd })
 	})
 		.then(response => {
-			if (response.status != 200) alert("Error: Unable to export DFD");
+			if (response.status == 400)
+				return response
+					.json()
+					.catch(() => alert("Error: Unable to export DFD"));
+			else if (response.status != 200) alert("Error: Unable to export DFD");
 			else return response.json();
 		})
 		.then(json => {
+			if (json && json.validation_errors && !json.success) {
+				// Graphs the server could not read
+				let { path, message } = json.validation_errors[0];
+				alert(`Error: ${path[path.length - 1]} is invalid. ${message}`);
+			}
 			// Download turtle rdf
-			if (json.success && json.rdf) {
+			if (json && json.success && json.rdf) {
 				let title = document.getElementById("diagram_title_input")
 					.value;
 				title = title.length > 0 ? title : "DFD";
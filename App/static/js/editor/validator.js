@@ -100,7 +100,7 @@ function is_cell_from_parent_process(cell) {
 	return mxUtils.isNode(cell.value) && cell.value.getAttribute("from_parent");
 }
 
-function add_item_to_subprocess(cell, process_name, visited) {
+async function add_item_to_subprocess(cell, process_name, visited) {
 	/**
 	 * Adds a cell to sub process (and parent if entity)
 	 * @param  {Object} cell The cell being added
@@ -110,6 +110,7 @@ function add_item_to_subprocess(cell, process_name, visited) {
 	 */
 	// Add item to current process
 	let process = get_hierarchy_diagram(process_name);
+	await fetch_graphs([process]);
 	let current_graph = process.graph_model;
 	/* Skip if item is already in the graph */
 	if (
@@ -174,6 +175,17 @@ function is_valid_label_change(cell, value, evt) {
 	 */
 	// Remove new lines
 	value = value.replace(/\n/g, "");
+	// Process and data store names are checked against every graph, fetch them first
+	if (["process", "datastore"].includes(cell.item_type)) {
+		let graph = this;
+		let entries = hierarchy_entries(hierarchy).map(([path, entry]) => entry);
+		if (entries.some(entry => entry.xml_model === null)) {
+			fetch_graphs(entries)
+				.then(() => graph.labelChanged(cell, value, evt))
+				.catch(() => alert("Error: Unable to load diagram"));
+			return;
+		}
+	}
 	// Validate process label change
 	[
 		["process", is_valid_process_name],
@@ -306,7 +318,7 @@ function update_hierarchy_name(sender, event) {
 	list_item_title.innerText = new_name;
 }
 
-function rename_all_occurrences(sender, event) {
+async function rename_all_occurrences(sender, event) {
 	/**
 	 * Renames all occurrences of a item in the DFD
 	 * @param {Object} sender Sender of the event
@@ -321,6 +333,7 @@ function rename_all_occurrences(sender, event) {
 	let item_type = event.getProperty("cell").item_type;
 
 	// Find all occurrences of the item
+	await fetch_sub_hierarchy(hierarchy);
 	let occurrences = find_all_occurrences(old_name, item_type, hierarchy);
 
 	// Change name of all occurrences
@@ -333,14 +346,17 @@ function rename_all_occurrences(sender, event) {
 	});
 }
 
-function update_flow_requirements(cell, old_name, new_name) {
+async function update_flow_requirements(cell, old_name, new_name) {
 	/**
 	 * Updates the flow requirements of all occurrences of connected items to the flow
 	 * @param {Object} cell The flow being updated
 	 * @param {String} old_name The old name of the flow
 	 * @param {String} new_name The new name of the flow
 	 */
-	let active_process_name = get_active_hierarchy_item_and_name()[1];
+	let active_process = get_hierarchy_diagram(
+		get_active_hierarchy_item_and_name()[1]
+	);
+	await fetch_sub_hierarchy(active_process);
 	/* Rename required flow in all occurrences */
 	["source", "target"].forEach(direction => {
 		/* Get all occurrences */
@@ -349,7 +365,7 @@ function update_flow_requirements(cell, old_name, new_name) {
 		let occurrences = find_all_occurrences(
 			item_name,
 			item.item_type,
-			get_hierarchy_diagram(active_process_name)
+			active_process
 		);
 		occurrences.forEach(occurrence => {
 			/* Find cell occurrence */
@@ -1,5 +1,98 @@
-from App.models import User, DataFlowDiagram, Invitation, Edit, Graph, GraphChildren
-from App import db
+import hashlib
+import json
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+from threading import Lock
+from flask import g, has_request_context
+from sqlalchemy import and_, bindparam, exists, literal, null, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from App.models import (User, DataFlowDiagram, Invitation, Edit, Graph, GraphChildren, XmlBlob, Revision,
+                        SearchTerm)
+from App.search import graph_term_rows
+from App import app, db
+from App.instrumentation import timed
+
+
+# Max ids or hashes bound in a single statement
+CHUNK_SIZE = 500
+
+# Default page size and cursor timestamp format of paginated listings
+PAGE_SIZE = 20
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# Tries of a save before giving up on concurrent saves taking its revision number
+SAVE_ATTEMPTS = 3
+
+
+def encode_cursor(timestamp, id):
+    return '{}_{}'.format(timestamp.strftime(CURSOR_TIME_FORMAT), id)
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for malformed cursors
+    timestamp, id = cursor.rsplit('_', 1)
+    return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(id)
+
+
+def dashboard_diagrams_query():
+    # Diagrams with their creator and editors loaded in a fixed number of queries
+    return DataFlowDiagram.query.options(
+        joinedload(DataFlowDiagram.creator),
+        selectinload(DataFlowDiagram.invitations).joinedload(Invitation.user))
+
+
+def get_diagrams_page(user, kind='created', after=None, limit=PAGE_SIZE):
+    # Diagrams created by or shared with user, oldest first, after the (created_on, id) cursor
+    query = dashboard_diagrams_query()
+    if kind == 'invited':
+        query = query.join(Invitation, Invitation.invited_to == DataFlowDiagram.id).filter(
+            Invitation.invited_user == user.id)
+    else:
+        query = query.filter(DataFlowDiagram.author == user.id)
+
+    if after is not None:
+        created_on, id = decode_cursor(after)
+        query = query.filter(or_(DataFlowDiagram.created_on > created_on, and_(
+            DataFlowDiagram.created_on == created_on, DataFlowDiagram.id > id)))
+
+    # Fetch one extra row to know if there is a next page
+    diagrams = query.order_by(DataFlowDiagram.created_on,
+                              DataFlowDiagram.id).limit(limit + 1).all()
+    next_cursor = encode_cursor(
+        diagrams[limit - 1].created_on, diagrams[limit - 1].id) if len(diagrams) > limit else None
+    return diagrams[:limit], next_cursor
+
+
+def get_diagram_edits_page(diagram_id, before=None, limit=PAGE_SIZE):
+    # Edits of a diagram, newest first, before the (edited_on, id) cursor
+    query = Edit.query.options(joinedload(Edit.user)).filter(
+        Edit.edited_diagram == diagram_id)
+
+    if before is not None:
+        edited_on, id = decode_cursor(before)
+        query = query.filter(or_(Edit.edited_on < edited_on, and_(
+            Edit.edited_on == edited_on, Edit.id < id)))
+
+    # Fetch one extra row to know if there is a next page
+    edits = query.order_by(Edit.edited_on.desc(),
+                           Edit.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(
+        edits[limit - 1].edited_on, edits[limit - 1].id) if len(edits) > limit else None
+    return edits[:limit], next_cursor
+
+
+def get_latest_edit(diagram_id):
+    return Edit.query.filter_by(edited_diagram=diagram_id).order_by(
+        Edit.edited_on.desc(), Edit.id.desc()).first()
+
+
+def hierarchy_etag(skeleton):
+    # Hash of the skeleton itself, as graphs also change without an edit, e.g. through an import
+    content = json.dumps(skeleton, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]
 
 
 def get_user_created_diagrams(user):
@@ -8,17 +101,13 @@ def get_user_created_diagrams(user):
 
 
 def get_user_invited_diagrams(user):
-    user_invites = Invitation.query.filter_by(invited_user=user.id)
-    invited_diagrams = [DataFlowDiagram.query.get(
-        invite.invited_to) for invite in user_invites]
-    return invited_diagrams
+    return DataFlowDiagram.query.join(Invitation, Invitation.invited_to == DataFlowDiagram.id).filter(
+        Invitation.invited_user == user.id).all()
 
 
 def get_diagram_editors(diagram_id):
-    diagram_invitations = Invitation.query.filter_by(invited_to=diagram_id)
-    editors = [User.query.get(invitation.invited_user)
-               for invitation in diagram_invitations]
-    return editors
+    return User.query.join(Invitation, Invitation.invited_user == User.id).filter(
+        Invitation.invited_to == diagram_id).all()
 
 
 def get_diagram_edits(diagram):
@@ -53,98 +142,617 @@ def get_graph_children(id):
     return GraphChildren.query.filter_by(parent=id)
 
 
-def load_hierarchy(id):
-    graph = get_graph(id)
-    graph_children = get_graph_children(id)
-    data = {
-        'title': graph.title,
-        'xml_model': graph.xml_model,
-        'children': [load_hierarchy(child_association.child) for child_association in graph_children]
-    }
-    return data
+def graph_tree_cte(id, literal_root=False):
+    # Recursive query of the graph and all of its descendants with their parent id and position,
+    # a literal root walks only the association table so it still works while graphs are deleted
+    if literal_root:
+        tree = db.session.query(literal(id).label('id'), null().label('parent'), literal(0).label('position'))
+    else:
+        tree = db.session.query(Graph.id.label('id'), null().label('parent'), literal(0).label('position')).filter(
+            Graph.id == id)
+    tree = tree.cte(name='graph_tree', recursive=True)
+    return tree.union_all(db.session.query(GraphChildren.child, GraphChildren.parent, GraphChildren.position).join(
+        tree, GraphChildren.parent == tree.c.id))
 
 
-def delete_diagram_by_id(id):
-    diagram = get_diagram(id)
+def get_graph_tree(id):
+    # Siblings come in their order
+    tree = graph_tree_cte(id)
+    return db.session.query(Graph, tree.c.parent).join(tree, Graph.id == tree.c.id).order_by(
+        tree.c.position, Graph.id)
+
 
-    # Remove diagram edits
-    Edit.query.filter_by(edited_diagram=id).delete()
+def get_graph_tree_ids(id):
+    tree = graph_tree_cte(id)
+    return {graph_id for graph_id, in db.session.query(tree.c.id)}
 
-    # Remove diagram invitations
-    Invitation.query.filter_by(invited_to=id).delete()
 
-    # Remove graphs
-    delete_graph_and_children(diagram.graph)
+def build_hierarchy(graphs, children, graph_id):
+    # Nested hierarchy from graphs by id and ordered child ids by parent id
+    graph = graphs[graph_id]
+    return {
+        'title': graph.title,
+        'xml_model': graph.xml_model,
+        'children': [build_hierarchy(graphs, children, child_id)
+                     for child_id in children.get(graph_id, ())]
+    }
 
-    # Remove diagram
-    db.session.delete(diagram)
 
-    # commit delete
-    db.session.commit()
+@timed('load_hierarchy')
+def load_hierarchy(id):
+    # Group graphs by their parent graph id
+    graphs = {}
+    children = {}
+    for graph, parent in get_graph_tree(id):
+        graphs[graph.id] = graph
+        children.setdefault(parent, []).append(graph.id)
+
+    return build_hierarchy(graphs, children, int(id))
+
+
+@timed('load_hierarchies')
+def load_hierarchies(ids):
+    # Hierarchies of many root graphs by root id, read with one query
+    forest = db.session.query(Graph.id.label('id'), null().label('parent'), literal(0).label('position')).filter(
+        Graph.id.in_(ids)).cte(name='graph_forest', recursive=True)
+    forest = forest.union_all(db.session.query(GraphChildren.child, GraphChildren.parent, GraphChildren.position).join(
+        forest, GraphChildren.parent == forest.c.id))
+
+    graphs = {}
+    children = {}
+    for graph, parent in db.session.query(Graph, forest.c.parent).join(forest, Graph.id == forest.c.id).order_by(
+            forest.c.position, Graph.id):
+        graphs[graph.id] = graph
+        if parent is not None:
+            children.setdefault(parent, []).append(graph.id)
+
+    return {int(id): build_hierarchy(graphs, children, int(id)) for id in ids}
+
+
+def load_patched_graphs(root_id, patches):
+    # (title path, xml model) of the patched graphs, with their patched xml, and of their parents and children,
+    # with the patched paths. Paths missing, duplicated or now another graph are left to the save to reject.
+    graphs, children = get_graph_tree_outline(root_id)
+    paths = {}
+    ids_by_path = {}
+    parents = {}
+    pending = deque((graph_id, None) for graph_id in children.get(None, ()))
+    while pending:
+        graph_id, parent_id = pending.popleft()
+        paths[graph_id] = (paths[parent_id] if parent_id else ()) + (graphs[graph_id][1],)
+        ids_by_path.setdefault(paths[graph_id], []).append(graph_id)
+        parents[graph_id] = parent_id
+        pending.extend((child_id, graph_id) for child_id in children.get(graph_id, ()))
+
+    xml_models = {}
+    for patch in patches:
+        graph_ids = ids_by_path.get(tuple(patch['path']), ())
+        if len(graph_ids) == 1 and graph_ids[0] == patch.get('graph_id'):
+            xml_models[graph_ids[0]] = patch['xml_model']
+    patched_ids = set(xml_models)
+
+    # Read the stored xml of the neighbours, in chunks
+    neighbour_ids = {parents[graph_id] for graph_id in patched_ids if parents[graph_id] is not None}
+    for graph_id in patched_ids:
+        neighbour_ids.update(children.get(graph_id, ()))
+    neighbour_ids = sorted(neighbour_ids - patched_ids)
+    for i in range(0, len(neighbour_ids), CHUNK_SIZE):
+        for graph in Graph.query.filter(Graph.id.in_(neighbour_ids[i:i + CHUNK_SIZE])):
+            xml_models[graph.id] = graph.xml_model
+
+    return ([(paths[graph_id], xml_model) for graph_id, xml_model in sorted(xml_models.items())],
+            {paths[graph_id] for graph_id in patched_ids})
+
+
+def get_graph_tree_outline(id):
+    # (id, title, version) of each graph and ordered child ids by parent id, without loading any xml
+    tree = graph_tree_cte(id)
+    graphs = {}
+    children = {}
+    for graph_id, title, version, parent in db.session.query(
+            Graph.id, Graph.title, Graph.version, tree.c.parent).join(tree, Graph.id == tree.c.id).order_by(
+            tree.c.position, Graph.id):
+        graphs[graph_id] = (graph_id, title, version)
+        children.setdefault(parent, []).append(graph_id)
+    return graphs, children
+
+
+@timed('load_hierarchy_skeleton')
+def load_hierarchy_skeleton(id):
+    # Hierarchy of graph ids, titles and versions with only the root graph's xml
+    graphs, children = get_graph_tree_outline(id)
+
+    def build(graph_id):
+        graph_id, title, version = graphs[graph_id]
+        return {
+            'id': graph_id,
+            'title': title,
+            'version': version,
+            'children': [build(child_id) for child_id in children.get(graph_id, ())]
+        }
+
+    skeleton = build(int(id))
+    skeleton['xml_model'] = get_graph(id).xml_model
+    return skeleton
+
+
+def get_graph_versions(id):
+    # [title path, version, graph id] of every graph in the tree, breadth first
+    graphs, children = get_graph_tree_outline(id)
+    versions = []
+    pending = deque([(graph_id, ()) for graph_id in children.get(None, ())])
+    while pending:
+        graph_id, parent_path = pending.popleft()
+        _, title, version = graphs[graph_id]
+        path = parent_path + (title,)
+        versions.append([list(path), version, graph_id])
+        pending.extend((child_id, path)
+                       for child_id in children.get(graph_id, ()))
+    return versions
+
+
+def is_graph_in_tree(root_id, graph_id):
+    # Walk up from the graph through its parents, so only its depth is read
+    ancestors = db.session.query(literal(graph_id).label('id')).cte(
+        name='graph_ancestors', recursive=True)
+    ancestors = ancestors.union_all(db.session.query(GraphChildren.parent).join(
+        ancestors, GraphChildren.child == ancestors.c.id))
+    return db.session.query(ancestors.c.id).filter(ancestors.c.id == root_id).first() is not None
+
+
+def graph_etag(graph, xml_model):
+    # Graph ids can be reused after a full save, so the content is hashed as well as the version
+    version = '{}:{}:{}:{}'.format(graph.id, graph.version, graph.title, xml_model)
+    return hashlib.sha256(version.encode('utf-8')).hexdigest()[:32]
+
+
+def get_graph_by_path(root_id, path):
+    # Follow the titles down from the root graph, None if missing or ambiguous
+    graph = get_graph(root_id)
+    if graph is None or not path or graph.title != path[0]:
+        return None
+    for title in path[1:]:
+        graphs = Graph.query.join(GraphChildren, GraphChildren.child == Graph.id).filter(
+            GraphChildren.parent == graph.id, Graph.title == title).limit(2).all()
+        if len(graphs) != 1:
+            return None
+        graph = graphs[0]
+    return graph
+
+
+@timed('delete_diagram_by_id')
+def delete_diagram_by_id(id):
+    graph_id = db.session.query(DataFlowDiagram.graph).filter(
+        DataFlowDiagram.id == id).scalar()
+
+    try:
+        # Remove diagram edits, invitations and revisions
+        Edit.query.filter_by(edited_diagram=id).delete(
+            synchronize_session=False)
+        Invitation.query.filter_by(invited_to=id).delete(
+            synchronize_session=False)
+        Revision.query.filter_by(diagram=id).delete(synchronize_session=False)
+
+        # Remove diagram
+        DataFlowDiagram.query.filter_by(id=id).delete(
+            synchronize_session=False)
+
+        # Remove graphs
+        if graph_id is not None:
+            delete_graph_and_children(graph_id)
+
+        # commit delete
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_permissions(id)
 
 
 def delete_graph_and_children(id):
-    graph = get_graph(id)
-    children = get_graph_children(id)
-
-    # Remove children graphs
-    for child in children:
-        delete_graph_and_children(child.child)
+    # Set based delete of the sub tree, each statement walks the tree with a recursive CTE
+    tree = graph_tree_cte(id, literal_root=True)
+    tree_ids = db.session.query(tree.c.id)
+    xml_hashes = [xml_hash for xml_hash, in db.session.query(Graph.xml_hash).filter(
+        Graph.id.in_(tree_ids), Graph.xml_hash.isnot(None)).distinct()]
+
+    # Graphs and their search terms first, the tree is walked through the association table
+    SearchTerm.query.filter(SearchTerm.graph.in_(tree_ids)).delete(
+        synchronize_session=False)
+    Graph.query.filter(Graph.id.in_(tree_ids)).delete(
+        synchronize_session=False)
+    GraphChildren.query.filter(or_(GraphChildren.parent.in_(tree_ids), GraphChildren.child.in_(
+        tree_ids))).delete(synchronize_session=False)
+
+    delete_unused_xml_blobs(xml_hashes)
+
+
+def delete_graphs(graph_ids):
+    graph_ids = sorted(graph_ids)
+
+    # Remove association table entries and graphs in chunks (SQLite caps bound parameters)
+    for i in range(0, len(graph_ids), CHUNK_SIZE):
+        chunk = graph_ids[i:i + CHUNK_SIZE]
+        xml_hashes = [xml_hash for xml_hash, in db.session.query(Graph.xml_hash).filter(
+            Graph.id.in_(chunk), Graph.xml_hash.isnot(None)).distinct()]
+
+        GraphChildren.query.filter(or_(GraphChildren.parent.in_(chunk), GraphChildren.child.in_(
+            chunk))).delete(synchronize_session=False)
+        SearchTerm.query.filter(SearchTerm.graph.in_(chunk)).delete(
+            synchronize_session=False)
+        Graph.query.filter(Graph.id.in_(chunk)).delete(
+            synchronize_session=False)
+
+        delete_unused_xml_blobs(xml_hashes)
+
+
+def delete_unused_xml_blobs(xml_hashes):
+    # Remove blobs no other graph uses
+    xml_hashes = sorted(xml_hashes)
+    for i in range(0, len(xml_hashes), CHUNK_SIZE):
+        XmlBlob.query.filter(XmlBlob.hash.in_(xml_hashes[i:i + CHUNK_SIZE]), ~exists().where(
+            Graph.xml_hash == XmlBlob.hash)).delete(synchronize_session=False)
+
+
+class Permission(namedtuple('Permission', ['is_author', 'is_editor'])):
+    @property
+    def can_edit(self):
+        return self.is_author or self.is_editor
+
+
+NO_PERMISSION = Permission(False, False)
+
+# Process wide permissions by diagram id, then user id, as (expiry time, permission)
+permission_cache = {}
+permission_cache_lock = Lock()
+
+# Monotonic time of the next sweep of expired permissions from the cache
+permission_sweep_time = 0
+
+
+def query_permission(user_id, diagram_id):
+    # Diagram author and the user's invitation, if any, in one query
+    row = db.session.query(DataFlowDiagram.author, Invitation.invited_user).outerjoin(Invitation, and_(
+        Invitation.invited_to == DataFlowDiagram.id, Invitation.invited_user == user_id)).filter(
+        DataFlowDiagram.id == diagram_id).first()
+    if row is None:
+        return NO_PERMISSION
+    author, invited_user = row
+    return Permission(author == user_id, invited_user is not None)
+
+
+def get_permission(user_id, diagram_id):
+    try:
+        diagram_id = int(diagram_id)
+    except (TypeError, ValueError):
+        return NO_PERMISSION
+
+    # Memoised for the current request
+    request_cache = g.setdefault(
+        'diagram_permissions', {}) if has_request_context() else {}
+    key = (user_id, diagram_id)
+    if key in request_cache:
+        return request_cache[key]
+
+    # Short lived process wide cache, when enabled
+    ttl = app.config['PERMISSION_CACHE_TTL']
+    now = time.monotonic()
+    with permission_cache_lock:
+        expires, permission = permission_cache.get(
+            diagram_id, {}).get(user_id, (0, None))
+    if expires <= now:
+        permission = query_permission(user_id, diagram_id)
+        if ttl > 0:
+            cache_permission(user_id, diagram_id, permission, now, ttl)
+
+    request_cache[key] = permission
+    return permission
+
+
+def cache_permission(user_id, diagram_id, permission, now, ttl):
+    # Expired permissions are swept out once per ttl, so the cache only holds those read recently
+    global permission_sweep_time
+    with permission_cache_lock:
+        if now >= permission_sweep_time:
+            for cached_diagram_id, users in list(permission_cache.items()):
+                for cached_user_id, (expires, _) in list(users.items()):
+                    if expires <= now:
+                        del users[cached_user_id]
+                if not users:
+                    del permission_cache[cached_diagram_id]
+            permission_sweep_time = now + ttl
+        permission_cache.setdefault(diagram_id, {})[user_id] = (now + ttl, permission)
 
-    # Remove association table entries
-    children.delete()
 
-    # Remove graph
-    db.session.delete(graph)
-    db.session.commit()
+def invalidate_permissions(diagram_id):
+    # Call after a diagram's invitations or author change
+    with permission_cache_lock:
+        permission_cache.pop(int(diagram_id), None)
+    if has_request_context():
+        g.pop('diagram_permissions', None)
 
 
 def is_editor(user_id, diagram_id):
-    editors = get_diagram_editors(diagram_id)
-    return any([user_id == editor.id for editor in editors])
+    return get_permission(user_id, diagram_id).is_editor
 
 
 def is_author(user_id, diagram_id):
+    return get_permission(user_id, diagram_id).is_author
+
+
+def commit_save(save):
+    # Commit everything save adds in one transaction. A concurrent save committing the same revision
+    # number first fails it on the unique constraint, it is then rolled back and run again.
+    for attempt in range(SAVE_ATTEMPTS):
+        try:
+            result = save()
+            db.session.commit()
+            return result
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == SAVE_ATTEMPTS - 1:
+                raise
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+@timed('save_graph')
+def save_graph(diagram_id, new_graph_data, commit=True):
     diagram = get_diagram(diagram_id)
-    return user_id == diagram.author
 
-
-def save_graph(diagram_id, new_graph_data):
+    try:
+        # Apply only the changes between the stored and new graph data
+        diagram.graph = update_graph_and_children(
+            diagram.graph, new_graph_data)
+
+        # Commit new, changed and removed graphs together, or leave it to commit_save
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+class VersionConflict(Exception):
+    # Graphs that changed or disappeared since the client loaded them
+    def __init__(self, paths):
+        super().__init__('Graphs changed since loaded: {}'.format(paths))
+        self.paths = paths
+
+
+@timed('save_graph_patches')
+def save_graph_patches(diagram_id, patches, commit=True):
+    # Update only the patched graphs, each must still be the graph and version the client loaded.
+    # A graph recreated by a full save restarts at version 1, so its id is checked too.
+    # Returns (title path, old xml, new xml) and [title path, new version, graph id] of the changed graphs.
     diagram = get_diagram(diagram_id)
-    old_root_graph_id = diagram.graph
-
-    # Replace old graph data
-    new_root_graph_id = create_graph_and_children(new_graph_data, 0)
-    diagram.graph = new_root_graph_id
-    db.session.commit()
-
-    # Delete old graph data
-    delete_graph_and_children(old_root_graph_id)
+    changes = []
+    conflicts = []
+    for patch in patches:
+        path = tuple(patch['path'])
+        graph = get_graph_by_path(diagram.graph, path)
+        if graph is None or graph.id != patch.get('graph_id') or graph.version != patch['version']:
+            conflicts.append(list(path))
+        elif is_xml_model_changed(graph, patch['xml_model']):
+            changes.append((path, graph, patch['xml_model']))
+
+    try:
+        if conflicts:
+            raise VersionConflict(conflicts)
+        old_xml_models = [graph.xml_model for _, graph, _ in changes]
+        replaced_hashes = set_xml_models([(graph, xml_model)
+                                          for _, graph, xml_model in changes])
+        index_graphs([(graph, xml_model)
+                      for _, graph, xml_model in changes])
+
+        # Updates check the version again, in case of a concurrent save, and are flushed
+        # before deleting the blobs no graph references any more
+        db.session.flush()
+        delete_unused_xml_blobs(replaced_hashes)
+        if commit:
+            db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        raise VersionConflict([list(path) for path, _, _ in changes])
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return ([(path, old_xml_model, xml_model) for (path, _, xml_model), old_xml_model in zip(changes, old_xml_models)],
+            [[list(path), graph.version, graph.id] for path, graph, _ in changes])
+
+
+def xml_model_hash(xml_model):
+    return hashlib.sha256(xml_model.encode('utf-8')).hexdigest()
+
+
+def is_xml_model_changed(graph, xml_model):
+    # Blob stored xml is compared by its hash, inline xml directly
+    if graph.xml_hash is not None:
+        return graph.xml_hash != xml_model_hash(xml_model)
+    return graph.xml_text != xml_model
+
+
+def set_xml_models(graph_xml_models):
+    # Returns the hashes of the blobs the graphs used before, to delete once unused after a flush
+    replaced_hashes = {graph.xml_hash for graph, _ in graph_xml_models if graph.xml_hash is not None}
+    if not app.config['XML_BLOB_STORE']:
+        for graph, xml_model in graph_xml_models:
+            graph.xml_model = xml_model
+        return replaced_hashes
+
+    # Find stored blobs for the xml models, in chunks
+    graph_hashes = [(graph, xml_model_hash(xml_model))
+                    for graph, xml_model in graph_xml_models]
+    xml_models = {xml_hash: xml_model for (_, xml_hash), (_, xml_model)
+                  in zip(graph_hashes, graph_xml_models)}
+    hashes = list(xml_models)
+    blobs = {}
+    for i in range(0, len(hashes), CHUNK_SIZE):
+        blobs.update((blob.hash, blob) for blob in XmlBlob.query.filter(
+            XmlBlob.hash.in_(hashes[i:i + CHUNK_SIZE])))
+
+    # Compress xml models not yet stored
+    for xml_hash, xml_model in xml_models.items():
+        if xml_hash not in blobs:
+            blobs[xml_hash] = XmlBlob.from_xml_model(xml_hash, xml_model)
+            db.session.add(blobs[xml_hash])
+
+    for graph, xml_hash in graph_hashes:
+        graph.xml_text = ''
+        graph.xml_blob = blobs[xml_hash]
+    return replaced_hashes - set(xml_models)
+
+
+@timed('index_graphs')
+def index_graphs(graph_xml_models):
+    # Replace the search terms of saved graphs, which must have ids
+    graph_ids = sorted(graph.id for graph, _ in graph_xml_models)
+    for i in range(0, len(graph_ids), CHUNK_SIZE):
+        SearchTerm.query.filter(SearchTerm.graph.in_(graph_ids[i:i + CHUNK_SIZE])).delete(
+            synchronize_session=False)
+
+    rows = [row for graph, xml_model in graph_xml_models
+            for row in graph_term_rows(graph.id, xml_model)]
+    if rows:
+        db.session.execute(SearchTerm.__table__.insert(), rows)
+
+
+def update_graph_and_children(root_id, graph_data):
+    # Child ids of each stored graph by parent id in sibling order, with their stored positions
+    stored_graphs = {}
+    stored_children = {}
+    stored_positions = {}
+    tree = graph_tree_cte(root_id)
+    for graph, parent, position in db.session.query(Graph, tree.c.parent, tree.c.position).join(
+            tree, Graph.id == tree.c.id).order_by(tree.c.position, Graph.id):
+        stored_graphs[graph.id] = graph
+        stored_children.setdefault(parent, []).append(graph.id)
+        stored_positions[graph.id] = position
+
+    def stored_subtree(graph_id):
+        ids = [graph_id]
+        for id in ids:
+            ids.extend(stored_children.get(id, ()))
+        return ids
+
+    # Match new graph data to stored graphs, breadth first so new siblings keep their order in ids.
+    # Children are matched under their matched parent by title and position among same titled siblings,
+    # so duplicate sibling titles are kept apart. A lone unmatched stored child at the position of a lone
+    # unmatched new child was renamed, it keeps its id and sub processes. Other unmatched stored graphs
+    # are removed with their subtree.
+    root_graph = None
+    new_graphs = []
+    changed_xml_models = []
+    associations = []
+    moved = []
+    removed_ids = []
+    stored_root = stored_graphs[stored_children[None][0]]
+    if stored_root.title != graph_data['title']:
+        # Renamed root graph
+        stored_root.title = graph_data['title']
+
+    pending = deque([(graph_data, 0, None, stored_root, 0)])
+    while pending:
+        data, level, parent, graph, position = pending.popleft()
+        stored_by_title = {}
+        if graph is None:
+            # Added graph
+            graph = Graph(title=data['title'], level=level)
+            new_graphs.append(graph)
+            changed_xml_models.append((graph, data['xml_model']))
+            if parent is not None:
+                associations.append((parent, graph, position))
+        else:
+            if is_xml_model_changed(graph, data['xml_model']):
+                # Changed graph
+                changed_xml_models.append((graph, data['xml_model']))
+            if parent is not None and stored_positions[graph.id] != position:
+                # Moved among its siblings
+                moved.append({'parent_id': parent.id, 'child_id': graph.id, 'child_position': position})
+            for child_id in stored_children.get(graph.id, ()):
+                stored_by_title.setdefault(stored_graphs[child_id].title, deque()).append(child_id)
+
+        root_graph = root_graph or graph
+        child_graphs = []
+        for child in data['children']:
+            siblings = stored_by_title.get(child['title'])
+            child_graphs.append(stored_graphs[siblings.popleft()] if siblings else None)
+        unmatched_ids = [child_id for siblings in stored_by_title.values() for child_id in siblings]
+        added = [index for index, child_graph in enumerate(child_graphs) if child_graph is None]
+        if len(unmatched_ids) == 1 and len(added) == 1 and \
+                stored_children[graph.id].index(unmatched_ids[0]) == added[0]:
+            # Renamed child
+            child_graphs[added[0]] = stored_graphs[unmatched_ids.pop()]
+            child_graphs[added[0]].title = data['children'][added[0]]['title']
+
+        for index, (child, child_graph) in enumerate(zip(data['children'], child_graphs)):
+            pending.append((child, level + 1, graph, child_graph, index))
+
+        # Stored children left unmatched are removed with all of their descendants
+        for child_id in unmatched_ids:
+            removed_ids.extend(stored_subtree(child_id))
+
+    # Create added graphs (flushed so ids are assigned)
+    replaced_hashes = set_xml_models(changed_xml_models)
+    db.session.add_all(new_graphs)
+    db.session.flush()
+
+    # Index only the added and changed graphs for search
+    index_graphs(changed_xml_models)
+
+    # Create added child associations and move the reordered ones
+    db.session.add_all([GraphChildren(parent=parent.id, child=child.id, position=position)
+                        for parent, child, position in associations])
+    if moved:
+        children = GraphChildren.__table__
+        db.session.execute(children.update().where(children.c.parent == bindparam('parent_id')).where(
+            children.c.child == bindparam('child_id')).values(position=bindparam('child_position')), moved)
+    db.session.flush()
+
+    # Remove graphs no longer in the hierarchy, and the blobs changed graphs no longer use
+    delete_graphs(removed_ids)
+    delete_unused_xml_blobs(replaced_hashes)
+
+    return root_graph.id
 
 
 def create_graph_and_children(graph_data, level):
-    # Create graph
-    graph = Graph(title=graph_data['title'], level=level,
-                  xml_model=graph_data['xml_model'])
-    db.session.add(graph)
-    db.session.commit()
-
-    # Create children graphs
-    child_graph_ids = [create_graph_and_children(child, level + 1)
-                       for child in graph_data['children']]
+    # Flatten hierarchy breadth first so siblings keep their order in ids
+    graphs = []
+    xml_models = []
+    associations = []
+    pending = deque([(graph_data, level, None, 0)])
+    while pending:
+        data, graph_level, parent, position = pending.popleft()
+        graph = Graph(title=data['title'], level=graph_level)
+        graphs.append(graph)
+        xml_models.append((graph, data['xml_model']))
+        if parent is not None:
+            associations.append((parent, graph, position))
+        pending.extend((child, graph_level + 1, graph, child_position)
+                       for child_position, child in enumerate(data['children']))
+
+    # Create graphs (flushed so ids are assigned)
+    set_xml_models(xml_models)
+    db.session.add_all(graphs)
+    db.session.flush()
+    index_graphs(xml_models)
 
     # Create child associations
-    for child_id in child_graph_ids:
-        parent_child_association = GraphChildren(
-            parent=graph.id, child=child_id)
-        db.session.add(parent_child_association)
-        db.session.commit()
+    db.session.add_all([GraphChildren(parent=parent.id, child=child.id, position=position)
+                        for parent, child, position in associations])
+    db.session.flush()
 
-    return graph.id
+    return graphs[0].id
 
 
-def add_edit(editor_id, diagram_id, message):
+def add_edit(editor_id, diagram_id, message, revision_id=None):
     new_edit = Edit(editor=editor_id,
-                    edited_diagram=diagram_id, message=message)
+                    edited_diagram=diagram_id, message=message, revision=revision_id)
     db.session.add(new_edit)
-    db.session.commit()
+    db.session.flush()
+    return new_edit
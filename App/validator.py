@@ -0,0 +1,198 @@
+import json
+from collections import deque, namedtuple
+from lxml import etree
+from App.exporter import parse_cached_xml_model
+from App.instrumentation import timed
+
+# A rule the graph at path (titles from the starting diagram) breaks
+ValidationError = namedtuple('ValidationError', ['path', 'message'])
+
+Item = namedtuple('Item', ['id', 'item_type', 'label', 'from_parent',
+                           'required_inflows', 'required_outflows'])
+Flow = namedtuple('Flow', ['label', 'source', 'target'])
+
+
+class ParsedGraph:
+    # Items and flows of one graph, indexed by id and by (item type, label)
+    def __init__(self, items, flows):
+        self.items = items
+        self.flows = flows
+        self.by_label = {}
+        for item in items.values():
+            self.by_label.setdefault((item.item_type, item.label), item)
+        self.inflows = {item_id: [] for item_id in items}
+        self.outflows = {item_id: [] for item_id in items}
+        for flow in flows:
+            self.outflows[flow.source].append(flow)
+            self.inflows[flow.target].append(flow)
+
+
+def parse_required_flows(value):
+    # Flow names a copied item needs, None if the attribute is not a list of names
+    try:
+        flows = json.loads(value) if value else []
+        return frozenset(flows) if isinstance(flows, list) else None
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_graph(xml_model):
+    # Items and flows from the exporter's cached parse, flows not connected to items at both ends are left out
+    parsed = parse_cached_xml_model(xml_model)
+    items = {item_id: Item(item_id, item_type, label, from_parent,
+                           parse_required_flows(inflows), parse_required_flows(outflows))
+             for item_id, item_type, label, from_parent, inflows, outflows in parsed.items}
+    return ParsedGraph(items, [Flow(*flow) for flow in parsed.item_flows
+                               if flow[1] in items and flow[2] in items])
+
+
+def graph_errors(graph):
+    # Rules of each graph, the server side of set_validation_rules
+    errors = []
+    for flow in graph.flows:
+        source, target = graph.items[flow.source].item_type, graph.items[flow.target].item_type
+        if source == 'entity' and target == 'entity':
+            errors.append('Data cannot move directly from a source entity to a sink entity.'
+                          ' It must be moved by a process.')
+        elif {source, target} == {'entity', 'datastore'}:
+            errors.append("A data flow can't move directly from a data store to a entity."
+                          ' This data must be moved using a process.')
+
+    for item in graph.items.values():
+        inflows, outflows = graph.inflows[item.id], graph.outflows[item.id]
+        if not inflows and not outflows:
+            errors.append('{} needs to be connected with a flow.'.format(item.label))
+
+        if item.item_type == 'process' and not item.from_parent:
+            if not inflows:
+                errors.append('Process {} must have at least one in flow of data.'.format(item.label))
+            if not outflows:
+                errors.append('Process {} must have at least one out flow of data.'.format(item.label))
+
+        # Items from the parent process must have the flows they have with it there
+        if item.from_parent:
+            for required_flows, flows, title in [(item.required_inflows, inflows, 'in flow'),
+                                                 (item.required_outflows, outflows, 'out flow')]:
+                if required_flows is None:
+                    errors.append('{} has unreadable required {}s.'.format(item.label, title))
+                    continue
+                flow_labels = {flow.label for flow in flows}
+                if len(required_flows) != len(flow_labels):
+                    errors.append('{} needs {} {}s but has {}'.format(
+                        item.label, len(required_flows), title, len(flow_labels)))
+                errors.extend('{} needs {} with name {}'.format(item.label, title, required_flow)
+                              for required_flow in sorted(required_flows - flow_labels))
+    return errors
+
+
+def context_diagram_errors(graph):
+    processes = sum(1 for item in graph.items.values() if item.item_type == 'process')
+    if processes != 1:
+        return ['Context diagram needs 1 process but has {}.'.format(processes)]
+    if not any(graph.items[flow.source].item_type == 'entity' for flow in graph.flows):
+        return ['Context diagram has no source entity']
+    if not any(graph.items[flow.target].item_type == 'entity' for flow in graph.flows):
+        return ['Context diagram has no sink entity']
+    return []
+
+
+def sub_process_errors(parent, process, graph):
+    # Items connected to the process in its parent must be copied in with the same flows
+    required = {}
+    for flows, direction in [(parent.inflows[process.id], 'source'), (parent.outflows[process.id], 'target')]:
+        for flow in flows:
+            neighbour = parent.items[getattr(flow, direction)]
+            if neighbour.id == process.id:
+                continue
+            inflows, outflows = required.setdefault(neighbour.id, (set(), set()))
+            (outflows if direction == 'source' else inflows).add(flow.label)
+
+    errors = []
+    for neighbour_id, (inflows, outflows) in sorted(required.items()):
+        neighbour = parent.items[neighbour_id]
+        item = graph.by_label.get((neighbour.item_type, neighbour.label))
+        if item is None or not item.from_parent:
+            errors.append('{} is connected to process {} but missing from its sub process.'.format(
+                neighbour.label, process.label))
+        elif item.required_inflows != inflows or item.required_outflows != outflows:
+            errors.append('{} flows do not match its flows with process {}.'.format(
+                neighbour.label, process.label))
+    return errors
+
+
+def parent_errors(parent, title, graph):
+    process = parent.by_label.get(('process', title))
+    if process is None or process.from_parent:
+        return ['Sub process {} has no process in its parent.'.format(title)]
+    return sub_process_errors(parent, process, graph)
+
+
+@timed('validate_dfd')
+def validate_dfd(dfd):
+    # Every rule the hierarchy breaks, an empty list when it is valid
+    errors = []
+    defined = {}    # (item type, label) of processes and data stores to the path defining them
+    pending = deque([(dfd, (dfd['title'],), None)])
+    while pending:
+        hierarchy, path, parent = pending.popleft()
+        try:
+            graph = parse_graph(hierarchy['xml_model'])
+        except etree.XMLSyntaxError:
+            errors.append(ValidationError(list(path), 'Graph xml could not be parsed.'))
+            continue
+
+        if parent is None and hierarchy['title'] == 'Context diagram':
+            errors.extend(ValidationError(list(path), message) for message in context_diagram_errors(graph))
+        errors.extend(ValidationError(list(path), message) for message in graph_errors(graph))
+
+        # Process and data store names are unique across the diagram
+        for item in graph.items.values():
+            if item.item_type != 'entity' and not item.from_parent:
+                key = (item.item_type, item.label)
+                if key in defined:
+                    errors.append(ValidationError(list(path), '{} with name {}, already exists in {}'.format(
+                        'Process' if item.item_type == 'process' else 'Data store', item.label, defined[key][-1])))
+                else:
+                    defined[key] = path
+
+        if parent is not None:
+            errors.extend(ValidationError(list(path), message)
+                          for message in parent_errors(parent, hierarchy['title'], graph))
+
+        pending.extend((child, path + (child['title'],), graph) for child in hierarchy['children'])
+    return errors
+
+
+@timed('validate_graph_patches')
+def validate_graph_patches(graphs, patched_paths):
+    # Rules of the patched graphs and of their links to their parent and sub processes. graphs holds
+    # (title path, xml model) of the patched graphs, as patched, with their parents and children.
+    # Names unique across the diagram are only checked when the whole hierarchy is saved.
+    parsed = []
+    for path, xml_model in graphs:
+        try:
+            parsed.append((path, parse_graph(xml_model)))
+        except etree.XMLSyntaxError:
+            parsed.append((path, None))
+    # Parents are patched graphs or their parent, whose paths are their own as patches of duplicate titles conflict
+    by_path = dict(parsed)
+
+    errors = []
+    for path, graph in parsed:
+        patched = path in patched_paths
+        if not patched and path[:-1] not in patched_paths:
+            continue
+        if graph is None:
+            if patched:
+                errors.append(ValidationError(list(path), 'Graph xml could not be parsed.'))
+            continue
+
+        if patched:
+            if len(path) == 1 and path[0] == 'Context diagram':
+                errors.extend(ValidationError(list(path), message) for message in context_diagram_errors(graph))
+            errors.extend(ValidationError(list(path), message) for message in graph_errors(graph))
+        parent = by_path.get(path[:-1])
+        if parent is not None:
+            errors.extend(ValidationError(list(path), message)
+                          for message in parent_errors(parent, path[-1], graph))
+    return errors
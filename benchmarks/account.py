@@ -0,0 +1,56 @@
+#=== Account page query count regression check ===#
+# Usage: python -m benchmarks.account [diagrams] [editors] [edits]
+# Fails if the page makes more than MAX_QUERIES queries, or more as diagrams, editors or edits grow.
+import sys
+from benchmarks.common import app, db, count_queries, timer, reset_db, seed_hierarchy, seed_diagram, report
+from App import bcrypt
+from App.models import User, Invitation, Edit
+
+# Logged in user, then the first page of created and of invited diagrams
+MAX_QUERIES = 3
+
+
+def seed_account(diagrams, editors, edits):
+    # Bench user authors every diagram, other users are invited and edit each one
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    password = bcrypt.generate_password_hash('bench').decode('utf-8')
+    users = [User(username='editor{}'.format(i), email='editor{}@test.com'.format(i), password=password)
+             for i in range(editors)]
+    db.session.add_all(users)
+
+    for i in range(diagrams):
+        diagram = seed_diagram(seed_hierarchy(1), 'Diagram {}'.format(i))
+        db.session.add_all([Invitation(invited_user=user.id, invited_to=diagram.id) for user in users])
+        db.session.add_all([Edit(editor=users[j % editors].id, edited_diagram=diagram.id,
+                                 message='Edit {}'.format(j)) for j in range(edits)])
+    User.query.filter_by(username='bench').first().password = password
+    db.session.commit()
+
+
+def render_account():
+    client = app.test_client()
+    client.post('/login', data={'email': 'bench@test.com', 'password': 'bench'})
+    with count_queries() as queries, timer() as elapsed:
+        response = client.get('/account')
+    assert response.status_code == 200, response.status_code
+    return queries.count, elapsed['seconds']
+
+
+def main(diagrams=100, editors=5, edits=20):
+    app.config['WTF_CSRF_ENABLED'] = False
+    counts = []
+    with app.app_context():
+        for size in [(1, 1, 1), (diagrams, editors, edits)]:
+            reset_db()
+            seed_account(*size)
+            queries, seconds = render_account()
+            report('{} diagrams, {} editors, {} edits'.format(*size), seconds, queries)
+            counts.append(queries)
+
+    assert max(counts) <= MAX_QUERIES, 'Account page makes {} queries, at most {} expected'.format(
+        max(counts), MAX_QUERIES)
+    assert counts[0] == counts[1], 'Account page queries grow with its content'
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,57 @@
+#=== Batch RDF export of every diagram, one by one through export_dfd and with the CLI ===#
+# Usage: python -m benchmarks.batch_rdf [diagrams] [nodes] [workers]
+import os
+import shutil
+import sys
+from benchmarks.common import app, db, reset_db, timer
+from benchmarks.bulk_archive import seed
+from App.cli import export_rdf
+from App.exporter import EXPORT_WORKERS, export_cache, parsed_graph_cache, export_dfd
+from App.models import DataFlowDiagram
+from App.utils import load_hierarchy
+
+
+def export_one_by_one(output):
+    # What a nightly job could do before, a query and an rdflib graph per diagram
+    os.makedirs(output, exist_ok=True)
+    for diagram in DataFlowDiagram.query.order_by(DataFlowDiagram.id).all():
+        with open(os.path.join(output, '{}.ttl'.format(diagram.id)), 'w', encoding='utf-8') as rdf_file:
+            rdf_file.write(export_dfd(load_hierarchy(diagram.graph)))
+        db.session.expunge_all()
+
+
+def main(diagrams=200, nodes=100, workers=EXPORT_WORKERS):
+    output = os.path.join(os.path.dirname(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]), 'rdf')
+    with app.app_context():
+        reset_db()
+        print('Exporting {} diagrams of {} graphs, {} worker processes'.format(diagrams, nodes, workers))
+        seed(diagrams, nodes, 0)
+        graphs = diagrams * nodes
+
+        runs = [('one by one through export_dfd (before)', lambda: export_one_by_one(output)),
+                ('cli, turtle file per diagram, 1 process', lambda: export_rdf(output, [], 'turtle', False, 1)),
+                ('cli, merged trig, 1 process', lambda: export_rdf(output + '.trig', [], 'turtle', True, 1)),
+                ('cli, merged n-quads, 1 process', lambda: export_rdf(output + '.nq', [], 'nt', True, 1))]
+        if workers > 1:
+            runs += [('cli, turtle file per diagram, {} processes'.format(workers),
+                      lambda: export_rdf(output, [], 'turtle', False, workers)),
+                     ('cli, merged n-quads, {} processes'.format(workers),
+                      lambda: export_rdf(output + '.nq', [], 'nt', True, workers))]
+
+        results = []
+        for name, run in runs:
+            # Every run starts from unparsed graphs
+            export_cache.clear()
+            parsed_graph_cache.clear()
+            shutil.rmtree(output, ignore_errors=True)
+            with timer() as elapsed:
+                run()
+            results.append((name, elapsed['seconds']))
+
+    for name, seconds in results:
+        print('{:<45} {:>8.2f} s {:>9.0f} graphs/s {:>7.0f} diagrams/s'.format(
+            name, seconds, graphs / seconds, diagrams / seconds))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,57 @@
+#=== Export a diagram library to an archive and import it into an empty database ===#
+# Usage: python -m benchmarks.bulk_archive [diagrams] [nodes] [edits]
+# Runs each command in its own process, so the peak memory reported is that command's alone.
+import os
+import resource
+import subprocess
+import sys
+import time
+from benchmarks.common import app, db, reset_db, seed_hierarchy, seed_diagram, make_xml_model
+from App.models import User, Edit, Graph
+from App.revisions import add_revision
+from App.utils import load_hierarchy
+
+
+def seed(diagrams, nodes, edits):
+    for i in range(diagrams):
+        diagram = seed_diagram(seed_hierarchy(nodes, xml_model=make_xml_model(12, 16, 'd{} '.format(i))),
+                               'Diagram {}'.format(i + 1))
+        editor = User.query.filter_by(username='bench').first()
+        hierarchy = load_hierarchy(diagram.graph)
+        for j in range(edits):
+            revision = add_revision(diagram.id, hierarchy)
+            db.session.add(Edit(editor=editor.id, edited_diagram=diagram.id,
+                                message='Edit {}'.format(j), revision=revision.id))
+        db.session.commit()
+        db.session.expunge_all()
+
+
+def run_cli(args, database_uri):
+    # Seconds taken and peak resident memory in MB of the command
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'App.cli'] + args, check=True,
+                   env=dict(os.environ, DFD_EDIT_DATABASE_URI=database_uri))
+    elapsed = time.perf_counter() - start
+    return elapsed, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def main(diagrams=200, nodes=100, edits=5):
+    archive = os.path.join(os.path.dirname(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]),
+                           'library.jsonl.gz')
+    import_uri = app.config['SQLALCHEMY_DATABASE_URI'].replace('bench.db', 'import.db')
+    with app.app_context():
+        reset_db()
+        print('Seeding {} diagrams of {} graphs with {} edits each'.format(diagrams, nodes, edits))
+        seed(diagrams, nodes, edits)
+        graphs = Graph.query.count()
+
+    for name, args, database_uri in [('export', ['export', archive], app.config['SQLALCHEMY_DATABASE_URI']),
+                                     ('import', ['import', archive], import_uri)]:
+        elapsed, peak = run_cli(args, database_uri)
+        print('{:<8} {:>8.2f} s  {:>9.0f} graphs/s  peak {:>6.0f} MB (max of commands so far)'.format(
+            name, elapsed, graphs / elapsed, peak))
+    print('archive  {:>8.1f} MB'.format(os.path.getsize(archive) / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
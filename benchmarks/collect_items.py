@@ -0,0 +1,59 @@
+#=== Compare the BeautifulSoup, single pass lxml and process pool graph parsers ===#
+# Usage: python -m benchmarks.collect_items [cells] [flows] [graphs]
+import sys
+from bs4 import BeautifulSoup
+from benchmarks.common import timer, make_xml_model, report
+from App.exporter import collect_items, collect_items_parallel, parsed_graph_cache, start_parse_pool
+
+
+def collect_items_soup(hierarchy):
+    # Previous implementation, a tree search per flow source and target
+    entities, processes, datastores, dataflows = set(), {}, set(), set()
+    parent = None if hierarchy['title'] == 'Context diagram' else hierarchy['title']
+    graph = BeautifulSoup(hierarchy['xml_model'], 'lxml')
+
+    for entity in graph.find_all('entity'):
+        if not entity.get('from_parent'):
+            entities.add(entity.get('label'))
+    for process in graph.find_all('process'):
+        if not process.get('from_parent'):
+            processes[process.get('label')] = parent
+    for datastore in graph.find_all('datastore'):
+        if not datastore.get('from_parent'):
+            datastores.add(datastore.get('label'))
+    for flow in graph.find_all('mxcell', {"item_type": "flow"}):
+        label = flow.get('value')
+        source = graph.find(attrs={'id': flow.get('source')}).get('label')
+        target = graph.find(attrs={'id': flow.get('target')}).get('label')
+        dataflows.add((label, source, target))
+
+    for child in hierarchy['children']:
+        _, sub_processes, sub_datastores, sub_dataflows = collect_items_soup(child)
+        processes.update(sub_processes)
+        datastores.update(sub_datastores)
+        dataflows.update(sub_dataflows)
+
+    return entities, processes, datastores, dataflows
+
+
+def main(cells=1000, flows=1000, graphs=2):
+    hierarchy = {'title': 'Context diagram', 'xml_model': make_xml_model(cells, flows), 'children': [
+        {'title': 'Sub process {}'.format(i), 'xml_model': make_xml_model(cells, flows, prefix='{}.'.format(i)),
+         'children': []} for i in range(1, graphs)]}
+    print('Parsing {} graphs of {} cells and {} flows'.format(graphs, cells, flows))
+    start_parse_pool()
+
+    results = []
+    for name, collect in [('BeautifulSoup (before)', collect_items_soup),
+                          ('lxml single pass (after)', collect_items),
+                          ('lxml process pool (after)', collect_items_parallel)]:
+        parsed_graph_cache.clear()
+        with timer() as elapsed:
+            results.append(collect(hierarchy))
+        report(name, elapsed['seconds'])
+
+    assert all(result == results[0] for result in results), 'Parsers collected different items'
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,120 @@
+#=== Shared set up for the benchmark scripts ===#
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Benchmarks run against a throw away database, never the development site.db
+_db_dir = tempfile.mkdtemp(prefix='dfd_edit_bench_')
+os.environ.setdefault('DFD_EDIT_SECRET_KEY', 'benchmark')
+os.environ['DFD_EDIT_DATABASE_URI'] = 'sqlite:///{}'.format(
+    os.path.join(_db_dir, 'bench.db'))
+
+from sqlalchemy import event
+from App import app, db
+from App.models import User, DataFlowDiagram, Graph, GraphChildren
+
+
+XML_MODEL = '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/></root></mxGraphModel>'
+
+
+ITEM_XML = ('<{type} label="{label}" id="{id}"><mxCell style="fillColor=white;strokeColor=#343a40;fontColor=#343a40;rounded=1;foldable=0;" '
+            'vertex="1" item_type="{type}" parent="1"><mxGeometry x="{x}" y="{y}" width="120" height="120" as="geometry"/></mxCell></{type}>')
+FLOW_XML = ('<mxCell id="{id}" value="{label}" style="edgeStyle=topToBottomEdgeStyle;" edge="1" item_type="flow" source="{source}" target="{target}" '
+            'parent="1"><mxGeometry relative="1" as="geometry"><Array as="points"><mxPoint x="{x}" y="{y}"/></Array><mxPoint as="offset"/></mxGeometry></mxCell>')
+
+
+def make_xml_model(items, flows, prefix=''):
+    # Graph xml with items cycling through process, datastore, entity and flows between them
+    cells = []
+    for i in range(items):
+        item_type = ('process', 'datastore', 'entity')[i % 3]
+        cells.append(ITEM_XML.format(type=item_type, label='{}{} {}'.format(
+            prefix, item_type, i), id=i + 2, x=i * 10, y=i * 5))
+    for i in range(flows):
+        cells.append(FLOW_XML.format(id=items + i + 2, label='{}flow {}'.format(prefix, i), source=i % items + 2,
+                                     target=(i * 7 + 1) % items + 2, x=i, y=i))
+    return '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>{}</root></mxGraphModel>'.format(''.join(cells))
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    event.listen(db.engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', counter)
+
+
+@contextmanager
+def timer():
+    result = {}
+    start = time.perf_counter()
+    yield result
+    result['seconds'] = time.perf_counter() - start
+
+
+def reset_db():
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def seed_hierarchy(nodes, fan_out=4, xml_model=XML_MODEL):
+    # Create a tree of graphs breadth first and return the root graph id
+    graphs = [Graph(title='Context diagram', level=0, xml_model=xml_model)]
+    parents = []
+    for i in range(1, nodes):
+        parent = graphs[(i - 1) // fan_out]
+        graph = Graph(title='Process {}'.format(i),
+                      level=parent.level + 1, xml_model=xml_model)
+        graphs.append(graph)
+        parents.append((parent, graph))
+
+    db.session.add_all(graphs)
+    db.session.flush()
+    db.session.add_all([GraphChildren(parent=parent.id, child=child.id)
+                        for parent, child in parents])
+    db.session.commit()
+    return graphs[0].id
+
+
+def make_hierarchy(nodes, fan_out=4, xml_model=XML_MODEL):
+    # Build the nested dfd dict the editor posts, breadth first
+    hierarchy = [{'title': 'Context diagram',
+                  'xml_model': xml_model, 'children': []}]
+    for i in range(1, nodes):
+        graph = {'title': 'Process {}'.format(i),
+                 'xml_model': xml_model, 'children': []}
+        hierarchy[(i - 1) // fan_out]['children'].append(graph)
+        hierarchy.append(graph)
+    return hierarchy[0]
+
+
+def seed_diagram(root_graph_id, title='Benchmark diagram'):
+    user = User.query.filter_by(username='bench').first()
+    if user is None:
+        user = User(username='bench', email='bench@test.com', password='')
+        db.session.add(user)
+        db.session.flush()
+
+    diagram = DataFlowDiagram(title=title, graph=root_graph_id, author=user.id)
+    db.session.add(diagram)
+    db.session.commit()
+    return diagram
+
+
+def report(name, seconds, queries=None):
+    line = '{:<40} {:>10.2f} ms'.format(name, seconds * 1000)
+    if queries is not None:
+        line += ' {:>8} queries'.format(queries)
+    print(line)
@@ -0,0 +1,100 @@
+#=== Parallel editor loads and saves under different database settings ===#
+# Usage: python -m benchmarks.concurrency [workers] [seconds] [nodes] [save percent]
+# Runs the workload in a fresh process per configuration, since engine options are read at start up.
+import copy
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+# (name, environment) of each configuration, the first matches the previous defaults
+CONFIGS = [
+    ('rollback journal, no pool (before)', {
+        'DFD_EDIT_SQLITE_JOURNAL_MODE': 'DELETE'}),
+    ('WAL, no pool', {}),
+    ('WAL, pool per worker', {'DFD_EDIT_DB_POOL_SIZE': 'workers'}),
+]
+
+
+def percentile(latencies, fraction):
+    return latencies[int(fraction * (len(latencies) - 1))] if latencies else 0.0
+
+
+def run_worker(client, own_diagram_id, diagram_ids, dfd, save_percent, deadline, results):
+    # Each editor saves their own diagram and loads any of them
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if random.randrange(100) < save_percent:
+            diagram_id = own_diagram_id
+            edited_dfd = copy.deepcopy(dfd)
+            edited_dfd['children'][0]['xml_model'] += ' ' * random.randrange(1, 8)
+            response = client.put('/editor/{}'.format(diagram_id), json={
+                'title': 'Diagram {}'.format(diagram_id), 'dfd': edited_dfd, 'edit_message': 'Benchmark'})
+            operation = 'save'
+        else:
+            diagram_id = random.choice(diagram_ids)
+            response = client.get('/editor/{}'.format(diagram_id))
+            operation = 'load'
+        results.append((operation, time.perf_counter() - start, response.status_code == 200))
+
+
+def run_workload(workers, seconds, nodes, save_percent):
+    from benchmarks.common import app, db, reset_db, seed_hierarchy, seed_diagram, make_hierarchy
+    from App import bcrypt
+    from App.models import User
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    with app.app_context():
+        reset_db()
+        diagram_ids = [seed_diagram(seed_hierarchy(nodes), 'Diagram {}'.format(i + 1)).id
+                       for i in range(workers)]
+        User.query.filter_by(username='bench').first().password = bcrypt.generate_password_hash(
+            'bench').decode('utf-8')
+        db.session.commit()
+        db.session.remove()
+
+    dfd = make_hierarchy(nodes)
+    clients = []
+    for _ in range(workers):
+        client = app.test_client()
+        client.post('/login', data={'email': 'bench@test.com', 'password': 'bench'})
+        clients.append(client)
+
+    results = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=run_worker, args=(client, diagram_id, diagram_ids, dfd, save_percent, deadline, results))
+               for client, diagram_id in zip(clients, diagram_ids)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for operation in ['load', 'save']:
+        latencies = sorted(latency for name, latency, ok in results if name == operation)
+        errors = sum(1 for name, latency, ok in results if name == operation and not ok)
+        print('    {:<5} {:>8.1f} ops/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  {:>4} errors'.format(
+            operation, len(latencies) / seconds, percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000, errors))
+    print('    total {:>8.1f} ops/s'.format(len(results) / seconds))
+
+
+def main(workers=8, seconds=5, nodes=50, save_percent=20):
+    print('{} workers for {} s, {} graph diagrams, {}% saves'.format(
+        workers, seconds, nodes, save_percent))
+    for name, config in CONFIGS:
+        print(name)
+        env = dict(os.environ, DFD_EDIT_BENCH_WORKLOAD='1')
+        env.update({variable: str(workers) if value == 'workers' else value
+                    for variable, value in config.items()})
+        subprocess.run([sys.executable, '-m', 'benchmarks.concurrency',
+                        str(workers), str(seconds), str(nodes), str(save_percent)], env=env, check=True)
+
+
+if __name__ == '__main__':
+    if os.environ.get('DFD_EDIT_BENCH_WORKLOAD'):
+        run_workload(*map(int, sys.argv[1:]))
+    else:
+        main(*map(int, sys.argv[1:]))
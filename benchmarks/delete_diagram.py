@@ -0,0 +1,69 @@
+#=== Compare the per node and set based diagram deletes ===#
+# Usage: python -m benchmarks.delete_diagram [nodes] [edits]
+import sys
+from benchmarks.common import (app, db, count_queries, timer, reset_db, seed_hierarchy,
+                               seed_diagram, report)
+from App.models import User, DataFlowDiagram, Invitation, Edit, Graph, GraphChildren
+from App.utils import get_diagram, get_graph, get_graph_children, delete_diagram_by_id
+
+
+def delete_graph_and_children_per_node(id):
+    # Previous implementation, loads and commits every graph
+    graph = get_graph(id)
+    children = get_graph_children(id)
+    for child in children:
+        delete_graph_and_children_per_node(child.child)
+    children.delete()
+    db.session.delete(graph)
+    db.session.commit()
+
+
+def delete_diagram_per_node(id):
+    diagram = get_diagram(id)
+    Edit.query.filter_by(edited_diagram=id).delete()
+    Invitation.query.filter_by(invited_to=id).delete()
+    delete_graph_and_children_per_node(diagram.graph)
+    db.session.delete(diagram)
+    db.session.commit()
+
+
+def seed(nodes, edits):
+    diagram = seed_diagram(seed_hierarchy(nodes))
+    editor = User.query.filter_by(username='editor').first()
+    if editor is None:
+        editor = User(username='editor', email='editor@test.com', password='')
+        db.session.add(editor)
+        db.session.flush()
+
+    db.session.add(Invitation(invited_user=editor.id, invited_to=diagram.id))
+    db.session.add_all([Edit(editor=editor.id, edited_diagram=diagram.id, message='Edit {}'.format(i))
+                        for i in range(edits)])
+    db.session.commit()
+    return diagram.id
+
+
+def main(nodes=5000, edits=100):
+    with app.app_context():
+        reset_db()
+        print('Deleting diagram of {} graphs and {} edits'.format(nodes, edits))
+
+        # A diagram that must survive both deletes
+        kept_id = seed(10, 1)
+
+        for name, delete in [('per node commits (before)', delete_diagram_per_node),
+                             ('set based (after)', delete_diagram_by_id)]:
+            diagram_id = seed(nodes, edits)
+            db.session.expunge_all()
+            with count_queries() as queries, timer() as elapsed:
+                delete(diagram_id)
+            report(name, elapsed['seconds'], queries.count)
+
+            assert DataFlowDiagram.query.get(diagram_id) is None, 'Diagram was not removed'
+            assert Graph.query.count() == 10, 'Graphs were not removed'
+            assert GraphChildren.query.count() == 9, 'Associations were not removed'
+            assert Edit.query.count() == 1, 'Edits were not removed'
+            assert Invitation.query.filter_by(invited_to=kept_id).count() == 1, 'Other diagram changed'
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
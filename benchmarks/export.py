@@ -0,0 +1,28 @@
+#=== Export timings for a cold cache, a repeat export and a single sub process edit ===#
+# Usage: python -m benchmarks.export [graphs] [cells] [flows]
+import copy
+import sys
+from benchmarks.common import timer, make_xml_model, report
+from App.exporter import export_dfd, export_cache, parsed_graph_cache
+
+
+def main(graphs=20, cells=200, flows=200):
+    hierarchy = {'title': 'Context diagram', 'xml_model': make_xml_model(cells, flows), 'children': [
+        {'title': 'Sub process {}'.format(i), 'xml_model': make_xml_model(cells, flows, prefix='{}.'.format(i)),
+         'children': []} for i in range(1, graphs)]}
+    edited = copy.deepcopy(hierarchy)
+    edited['children'][-1]['xml_model'] = make_xml_model(
+        cells, flows, prefix='edited.')
+    print('Exporting {} graphs of {} cells and {} flows'.format(graphs, cells, flows))
+
+    export_cache.clear()
+    parsed_graph_cache.clear()
+    for name, dfd in [('cold cache', hierarchy), ('repeat export', hierarchy),
+                      ('one sub process edited', edited)]:
+        with timer() as elapsed:
+            export_dfd(dfd)
+        report(name, elapsed['seconds'])
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
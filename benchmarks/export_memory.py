@@ -0,0 +1,56 @@
+#=== Peak RSS of the rdflib JSON export and the streamed export ===#
+# Usage: python -m benchmarks.export_memory [graphs] [cells] [flows]
+import json
+import os
+import resource
+import sys
+from multiprocessing import Process, Queue
+from benchmarks.common import timer, make_xml_model
+from App.exporter import collect_items, create_rdf_graph, stream_dfd
+
+
+def export_json(dfd):
+    # Previous path, an rdflib graph serialised into a JSON body
+    rdf_graph = create_rdf_graph(*collect_items(dfd))
+    body = json.dumps({'success': True, 'rdf': rdf_graph.serialize(format='turtle').decode()})
+    with open(os.devnull, 'w') as response:
+        response.write(body)
+
+
+def export_stream(rdf_format):
+    def export(dfd):
+        with open(os.devnull, 'w') as response:
+            for chunk in stream_dfd(dfd, rdf_format):
+                response.write(chunk)
+    return export
+
+
+def measure(export, dfd, results):
+    # Run in a fresh process so its peak RSS only reflects this export
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with timer() as elapsed:
+        export(dfd)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed['seconds'], (peak - baseline) / 1024))
+
+
+def main(graphs=20, cells=500, flows=500):
+    dfd = {'title': 'Context diagram', 'xml_model': make_xml_model(cells, flows), 'children': [
+        {'title': 'Sub process {}'.format(i), 'xml_model': make_xml_model(cells, flows, prefix='{}.'.format(i)),
+         'children': []} for i in range(1, graphs)]}
+    print('Exporting {} graphs of {} cells and {} flows'.format(graphs, cells, flows))
+
+    for name, export in [('rdflib turtle in JSON (before)', export_json),
+                         ('streamed turtle (after)', export_stream('turtle')),
+                         ('streamed n-triples (after)', export_stream('nt'))]:
+        results = Queue()
+        process = Process(target=measure, args=(export, dfd, results))
+        process.start()
+        seconds, peak_mb = results.get()
+        process.join()
+        print('{:<40} {:>10.2f} ms {:>8.1f} MB peak RSS increase'.format(
+            name, seconds * 1000, peak_mb))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
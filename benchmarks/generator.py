@@ -0,0 +1,167 @@
+#=== Synthetic DFD hierarchies shaped like the ones the editor saves ===#
+# Usage: python -m benchmarks.generator [depth] [fan out] [cells] [flows] [seed]
+# Prints the size of the generated hierarchy and checks it passes App.validator.
+# Every process of a graph up to the given depth is refined by a sub process graph, which holds copies of
+# the items it is connected to in its parent with their required flows, like add_item_to_subprocess makes.
+import json
+import random
+import sys
+from collections import namedtuple
+from xml.sax.saxutils import quoteattr
+
+ITEM_STYLE = 'fillColor=white;strokeColor=#343a40;fontColor=#343a40;rounded=1;foldable=0;'
+ID_STYLE = ('fillColor=#343a40;fontColor=white;strokeColor=#343a40;rounded=1;editable=0;movable=0;'
+            'resizable=0;cloneable=0;deletable=0;')
+EDGE_STYLE = 'edgeStyle=topToBottomEdgeStyle;'
+ITEM_SIZES = {'process': (120, 120), 'datastore': (140, 60), 'entity': (100, 80)}
+
+# An item of a graph, number is the process or data store id shown on it (None for entities)
+Item = namedtuple('Item', ['item_type', 'label', 'number', 'from_parent', 'required_inflows', 'required_outflows'])
+Flow = namedtuple('Flow', ['label', 'source', 'target'])    # source and target are item indexes
+
+
+def item_xml(cell_id, item, x, y):
+    width, height = ITEM_SIZES[item.item_type]
+    attributes = ' label={}'.format(quoteattr(item.label))
+    if item.from_parent:
+        attributes += ' required_inflows={} required_outflows={} from_parent="true"'.format(
+            quoteattr(json.dumps(sorted(item.required_inflows))), quoteattr(json.dumps(sorted(item.required_outflows))))
+    elif item.item_type == 'entity':
+        attributes += ' required_inflows="[]" required_outflows="[]"'
+    xml = ('<{type}{attributes} id="{id}"><mxCell style="{style}" vertex="1" item_type="{type}" parent="1">'
+           '<mxGeometry x="{x}" y="{y}" width="{width}" height="{height}" as="geometry"/></mxCell></{type}>').format(
+        type=item.item_type, attributes=attributes, id=cell_id, style=ITEM_STYLE, x=x, y=y, width=width, height=height)
+    if item.number is not None:
+        # Id label the editor nests in processes and data stores
+        xml += ('<mxCell id="{id}" value={number} style="{style}" vertex="1" connectable="0" parent="{parent}">'
+                '<mxGeometry width="{width}" height="24" as="geometry"/></mxCell>').format(
+            id=cell_id + 1, number=quoteattr(item.number), style=ID_STYLE, parent=cell_id, width=width)
+    return xml
+
+
+def flow_xml(cell_id, flow, source_id, target_id):
+    return ('<mxCell id="{id}" value={label} style="{style}" edge="1" item_type="flow" source="{source}" '
+            'target="{target}" parent="1"><mxGeometry relative="1" as="geometry"><mxPoint as="offset"/>'
+            '</mxGeometry></mxCell>').format(id=cell_id, label=quoteattr(flow.label), style=EDGE_STYLE,
+                                             source=source_id, target=target_id)
+
+
+def graph_xml(items, flows):
+    cells = []
+    cell_ids = []
+    cell_id = 2
+    for i, item in enumerate(items):
+        cells.append(item_xml(cell_id, item, 40 + (i % 6) * 200, 40 + (i // 6) * 180))
+        cell_ids.append(cell_id)
+        cell_id += 1 if item.number is None else 2
+    for flow in flows:
+        cells.append(flow_xml(cell_id, flow, cell_ids[flow.source], cell_ids[flow.target]))
+        cell_id += 1
+    return '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>{}</root></mxGraphModel>'.format(
+        ''.join(cells))
+
+
+def neighbours(items, flows, process):
+    # Copies of the items connected to a process, with the flows they need in its sub process
+    required = {}
+    for flow in flows:
+        if flow.source == process and flow.target != process:
+            required.setdefault(flow.target, (set(), set()))[0].add(flow.label)
+        elif flow.target == process and flow.source != process:
+            required.setdefault(flow.source, (set(), set()))[1].add(flow.label)
+    return [items[index]._replace(from_parent=True, required_inflows=inflows, required_outflows=outflows)
+            for index, (inflows, outflows) in sorted(required.items())]
+
+
+def context_graph(cells, flows):
+    # One system process exchanging data with entities, at least one source and one sink
+    items = [Item('process', 'System', '0', False, (), ())]
+    items += [Item('entity', 'Entity {}'.format(i), None, False, (), ()) for i in range(max(2, cells - 1))]
+    graph_flows = []
+    for i in range(max(flows, len(items) - 1)):
+        entity = 1 + i % (len(items) - 1)
+        if i % 2 == 0:
+            graph_flows.append(Flow('Request {}'.format(i), entity, 0))
+        else:
+            graph_flows.append(Flow('Response {}'.format(i), 0, entity))
+    return items, graph_flows
+
+
+def sub_process_graph(number, copies, cells, flows, random_flows):
+    # Processes in a cycle with data stores written and read between them, copies connected round robin
+    prefix = '' if number == '0' else number + '.'
+    processes = max(2, (cells - len(copies)) * 2 // 3)
+    datastores = max(0, cells - len(copies) - processes)
+    items = list(copies)
+    items += [Item('process', 'Process {}{}'.format(prefix, i + 1), '{}{}'.format(prefix, i + 1), False, (), ())
+              for i in range(processes)]
+    items += [Item('datastore', 'Store {}{}'.format(prefix, i + 1), 'D{}{}'.format(prefix, i + 1), False, (), ())
+              for i in range(datastores)]
+    first_process = len(copies)
+    first_datastore = first_process + processes
+
+    graph_flows = []
+    for i, copy in enumerate(copies):
+        process = first_process + i % processes
+        graph_flows.extend(Flow(label, i, process) for label in sorted(copy.required_outflows))
+        graph_flows.extend(Flow(label, process, i) for label in sorted(copy.required_inflows))
+    for i in range(processes):
+        graph_flows.append(Flow('Data {}{}'.format(prefix, i + 1), first_process + i,
+                                first_process + (i + 1) % processes))
+    for i in range(datastores):
+        writer = first_process + i % processes
+        reader = first_process + (i + 1) % processes
+        graph_flows.append(Flow('Write {}{}'.format(prefix, i + 1), writer, first_datastore + i))
+        graph_flows.append(Flow('Read {}{}'.format(prefix, i + 1), first_datastore + i, reader))
+
+    # Extra flows between processes up to the requested count
+    for i in range(flows - len(graph_flows)):
+        source, target = random_flows.sample(range(first_process, first_datastore), 2)
+        graph_flows.append(Flow('Extra {}{}'.format(prefix, i + 1), source, target))
+    return items, graph_flows
+
+
+def generate_dfd(depth=3, fan_out=4, cells=12, flows=16, seed=0):
+    # Hierarchy dict as the editor posts it, the context diagram refined to the given depth
+    random_flows = random.Random(seed)
+    items, flows_ = context_graph(cells, flows)
+    root = {'title': 'Context diagram', 'xml_model': graph_xml(items, flows_), 'children': []}
+
+    # (hierarchy entry, items, flows, level) of graphs whose processes are refined
+    pending = [(root, items, flows_, 0)]
+    while pending:
+        entry, items, graph_flows, level = pending.pop()
+        if level >= depth:
+            continue
+        refined = [index for index, item in enumerate(items)
+                   if item.item_type == 'process' and not item.from_parent][:fan_out]
+        for process in refined:
+            sub_items, sub_flows = sub_process_graph(
+                items[process].number, neighbours(items, graph_flows, process), cells, flows, random_flows)
+            child = {'title': items[process].label, 'xml_model': graph_xml(sub_items, sub_flows), 'children': []}
+            entry['children'].append(child)
+            pending.append((child, sub_items, sub_flows, level + 1))
+    return root
+
+
+def count_graphs(hierarchy):
+    return 1 + sum(count_graphs(child) for child in hierarchy['children'])
+
+
+def main(depth=3, fan_out=4, cells=12, flows=16, seed=0):
+    import os
+    os.environ.setdefault('DFD_EDIT_SECRET_KEY', 'generator')
+    os.environ.setdefault('DFD_EDIT_DATABASE_URI', 'sqlite://')
+    from App.validator import validate_dfd
+
+    dfd = generate_dfd(depth, fan_out, cells, flows, seed)
+    size = len(json.dumps(dfd))
+    print('{} graphs, {:.1f} KB of json'.format(count_graphs(dfd), size / 1024))
+    errors = validate_dfd(dfd)
+    for path, message in errors[:20]:
+        print('    {}: {}'.format(' / '.join(path), message))
+    assert not errors, 'Generated hierarchy is invalid'
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
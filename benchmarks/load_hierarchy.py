@@ -0,0 +1,37 @@
+#=== Compare the per node and single query hierarchy loaders ===#
+# Usage: python -m benchmarks.load_hierarchy [nodes]
+import sys
+from benchmarks.common import app, db, count_queries, timer, reset_db, seed_hierarchy, report
+from App.utils import get_graph, get_graph_children, load_hierarchy
+
+
+def load_hierarchy_per_node(id):
+    # Previous implementation, one graph and one children query per node
+    graph = get_graph(id)
+    graph_children = get_graph_children(id)
+    return {
+        'title': graph.title,
+        'xml_model': graph.xml_model,
+        'children': [load_hierarchy_per_node(child_association.child) for child_association in graph_children]
+    }
+
+
+def main(nodes=1000):
+    with app.app_context():
+        reset_db()
+        root = seed_hierarchy(nodes)
+        print('Loading hierarchy of {} graphs'.format(nodes))
+
+        results = []
+        for name, loader in [('per node (before)', load_hierarchy_per_node),
+                             ('recursive CTE (after)', load_hierarchy)]:
+            db.session.expunge_all()
+            with count_queries() as queries, timer() as elapsed:
+                results.append(loader(root))
+            report(name, elapsed['seconds'], queries.count)
+
+        assert results[0] == results[1], 'Loaders returned different hierarchies'
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
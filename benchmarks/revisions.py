@@ -0,0 +1,50 @@
+#=== Revision storage size and reconstruction time against revision depth ===#
+# Usage: python -m benchmarks.revisions [revisions] [nodes]
+import copy
+import sys
+from benchmarks.common import app, db, timer, reset_db, seed_hierarchy, seed_diagram, make_hierarchy, report
+from App.models import Revision
+from App.revisions import SNAPSHOT_INTERVAL, add_revision, encode_revision_data, flatten_hierarchy, load_revision
+
+XML_MODEL = '<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>{}</root></mxGraphModel>'.format(
+    ''.join('<process label="Process {0}" id="{0}"><mxCell vertex="1" item_type="process" parent="1">'
+            '<mxGeometry x="{0}" y="{0}" width="120" height="120" as="geometry"/></mxCell></process>'.format(i)
+            for i in range(2, 50)))
+
+
+def main(revisions=100, nodes=100):
+    with app.app_context():
+        reset_db()
+        dfd = make_hierarchy(nodes, xml_model=XML_MODEL)
+        diagram_id = seed_diagram(seed_hierarchy(1)).id
+        print('{} revisions of a {} graph hierarchy, snapshot every {}'.format(
+            revisions, nodes, SNAPSHOT_INTERVAL))
+
+        # Each revision moves one cell in one sub process
+        expected = {}
+        graphs = flatten_hierarchy(dfd)
+        for number in range(1, revisions + 1):
+            dfd = copy.deepcopy(dfd)
+            graph = dfd['children'][number % len(dfd['children'])]
+            graph['xml_model'] = graph['xml_model'].replace(
+                'x="{}"'.format(number % 48 + 2), 'x="{}"'.format(number + 1000), 1)
+            add_revision(diagram_id, dfd)
+            expected[number] = dfd
+        db.session.commit()
+
+        stored = sum(len(revision.data) for revision in Revision.query)
+        full = len(encode_revision_data(graphs)) * revisions
+        print('Stored {} KB, {} KB as full snapshots'.format(
+            stored // 1024, full // 1024))
+
+        for number in sorted({1, 2, SNAPSHOT_INTERVAL // 2, SNAPSHOT_INTERVAL, revisions}):
+            revision = Revision.query.filter_by(
+                diagram=diagram_id, number=number).first()
+            with timer() as elapsed:
+                hierarchy = load_revision(revision)
+            report('reconstruct revision {}'.format(number), elapsed['seconds'])
+            assert hierarchy == expected[number], 'Revision {} differs'.format(number)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
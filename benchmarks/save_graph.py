@@ -0,0 +1,69 @@
+#=== Compare the per row commit and diff based diagram save paths ===#
+# Usage: python -m benchmarks.save_graph [nodes]
+import copy
+import sys
+from benchmarks.common import (app, db, count_queries, timer, reset_db, seed_hierarchy,
+                               seed_diagram, make_hierarchy, report)
+from App.models import Graph, GraphChildren
+from App.utils import get_diagram, get_graph, get_graph_children, save_graph
+
+
+def create_graph_and_children_per_row(graph_data, level):
+    # Previous implementation, one commit per graph and association
+    graph = Graph(title=graph_data['title'], level=level,
+                  xml_model=graph_data['xml_model'])
+    db.session.add(graph)
+    db.session.commit()
+
+    child_graph_ids = [create_graph_and_children_per_row(child, level + 1)
+                       for child in graph_data['children']]
+
+    for child_id in child_graph_ids:
+        db.session.add(GraphChildren(parent=graph.id, child=child_id))
+        db.session.commit()
+
+    return graph.id
+
+
+def delete_graph_and_children_per_row(id):
+    graph = get_graph(id)
+    children = get_graph_children(id)
+    for child in children:
+        delete_graph_and_children_per_row(child.child)
+    children.delete()
+    db.session.delete(graph)
+    db.session.commit()
+
+
+def save_graph_per_row(diagram_id, new_graph_data):
+    diagram = get_diagram(diagram_id)
+    old_root_graph_id = diagram.graph
+    diagram.graph = create_graph_and_children_per_row(new_graph_data, 0)
+    db.session.commit()
+    delete_graph_and_children_per_row(old_root_graph_id)
+
+
+def main(nodes=1000):
+    with app.app_context():
+        reset_db()
+        diagram_id = seed_diagram(seed_hierarchy(nodes)).id
+        dfd = make_hierarchy(nodes)
+        print('Saving hierarchy of {} graphs'.format(nodes))
+
+        # Single sub process edit
+        edited_dfd = copy.deepcopy(dfd)
+        edited_dfd['children'][-1]['xml_model'] += ' '
+
+        for name, save, data in [('per row commits (before)', save_graph_per_row, dfd),
+                                 ('diff save, no changes (after)', save_graph, dfd),
+                                 ('diff save, one changed (after)', save_graph, edited_dfd)]:
+            db.session.expunge_all()
+            with count_queries() as queries, timer() as elapsed:
+                save(diagram_id, data)
+            report(name, elapsed['seconds'], queries.count)
+
+        assert Graph.query.count() == nodes, 'Old graphs were not removed'
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,249 @@
+#=== Benchmark suite over a generated diagram, results saved as json to compare runs ===#
+# Usage: python -m benchmarks.suite [--depth 3] [--fan-out 4] [--cells 12] [--flows 16] [--rounds 10]
+#                                   [-k name] [--save results.json] [--compare previous.json] [--max-slowdown 20]
+# Results use the pytest-benchmark json layout. With --compare, fails if a median time grows by more than
+# --max-slowdown percent or a benchmark runs more queries than in the previous results.
+import argparse
+import copy
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from collections import namedtuple
+from benchmarks.common import app, db, count_queries, reset_db, seed_diagram
+from benchmarks.account import seed_account
+from benchmarks.generator import generate_dfd, count_graphs
+from App import exporter
+from App.exporter import collect_items, create_rdf_graph
+from App.models import DataFlowDiagram
+from App.utils import create_graph_and_children, delete_diagram_by_id, load_hierarchy, save_graph
+from App.validator import validate_dfd
+
+SUITE_VERSION = 1
+
+# Rounds run before timing, to fill caches and connection pools the way a running server has them
+WARMUP_ROUNDS = 1
+
+# setup is called untimed before every round and returns the arguments of run
+Benchmark = namedtuple('Benchmark', ['name', 'group', 'setup', 'run'])
+
+
+def seed_generated_diagram(dfd, title):
+    diagram_id = seed_diagram(create_graph_and_children(dfd, 0), title).id
+    db.session.expunge_all()
+    return diagram_id
+
+
+def edited_copies(dfd):
+    # Two versions of the hierarchy differing in one leaf graph, so every save writes a graph
+    edited = copy.deepcopy(dfd)
+    leaf = edited
+    while leaf['children']:
+        leaf = leaf['children'][-1]
+    leaf['xml_model'] = leaf['xml_model'].replace('</root>', '<mxCell id="edited" parent="1"/></root>')
+    return itertools.cycle([edited, dfd])
+
+
+def login_client():
+    client = app.test_client()
+    response = client.post('/login', data={'email': 'bench@test.com', 'password': 'bench'})
+    assert response.status_code == 302, 'Could not log in the bench user'
+    return client
+
+
+def get_account(client):
+    response = client.get('/account')
+    assert response.status_code == 200, response.status_code
+
+
+def make_benchmarks(dfd, diagram_id, root_id, account_client):
+    items = collect_items(dfd)
+    saves = edited_copies(dfd)
+
+    def expunged(*args):
+        db.session.expunge_all()
+        return args
+
+    def new_diagram():
+        return (seed_generated_diagram(dfd, 'Deleted diagram'),)
+
+    def cold_cache(cache, *args):
+        def setup():
+            cache.clear()
+            return args
+        return setup
+
+    return [
+        Benchmark('load_hierarchy', 'load', lambda: expunged(root_id), load_hierarchy),
+        Benchmark('save_graph[unchanged]', 'save', lambda: expunged(diagram_id, dfd), save_graph),
+        Benchmark('save_graph[one graph edited]', 'save', lambda: expunged(diagram_id, next(saves)), save_graph),
+        Benchmark('delete_diagram_by_id', 'delete', new_diagram, delete_diagram_by_id),
+        Benchmark('collect_items[cold]', 'export', cold_cache(exporter.parsed_graph_cache, dfd), collect_items),
+        Benchmark('collect_items[warm]', 'export', lambda: (dfd,), collect_items),
+        Benchmark('create_rdf_graph', 'export', lambda: items, create_rdf_graph),
+        Benchmark('validate_dfd[cold]', 'validate', cold_cache(exporter.parsed_graph_cache, dfd), validate_dfd),
+        Benchmark('account_page', 'pages', lambda: (account_client,), get_account),
+    ]
+
+
+def percentile(ordered, fraction):
+    # Linear interpolation between the closest ranks
+    position = (len(ordered) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def compute_stats(data):
+    # The statistics pytest-benchmark reports for a benchmark run with one iteration per round
+    ordered = sorted(data)
+    mean = statistics.mean(data)
+    stddev = statistics.stdev(data) if len(data) > 1 else 0.0
+    q1, q3 = percentile(ordered, 0.25), percentile(ordered, 0.75)
+    iqr = q3 - q1
+    low_whisker = next(value for value in ordered if value >= q1 - 1.5 * iqr)
+    high_whisker = next(value for value in reversed(ordered) if value <= q3 + 1.5 * iqr)
+    iqr_outliers = sum(1 for value in data if value < q1 - 1.5 * iqr or value > q3 + 1.5 * iqr)
+    stddev_outliers = sum(1 for value in data if abs(value - mean) > stddev)
+    return {
+        'min': ordered[0], 'max': ordered[-1], 'mean': mean, 'stddev': stddev, 'rounds': len(data),
+        'median': statistics.median(data), 'iqr': iqr, 'q1': q1, 'q3': q3,
+        'iqr_outliers': iqr_outliers, 'stddev_outliers': stddev_outliers,
+        'outliers': '{};{}'.format(stddev_outliers, iqr_outliers),
+        'ld15iqr': low_whisker, 'hd15iqr': high_whisker,
+        'ops': 1 / mean if mean else 0.0, 'total': sum(data), 'iterations': 1, 'data': data,
+    }
+
+
+def run_benchmark(benchmark, rounds):
+    # Seconds of each timed round and the queries of the last one
+    data = []
+    for i in range(WARMUP_ROUNDS + rounds):
+        args = benchmark.setup()
+        gc.collect()
+        with count_queries() as queries:
+            start = time.perf_counter()
+            benchmark.run(*args)
+            seconds = time.perf_counter() - start
+        if i >= WARMUP_ROUNDS:
+            data.append(seconds)
+    return data, queries.count
+
+
+def machine_info():
+    uname = platform.uname()
+    return {'node': uname.node, 'processor': uname.processor, 'machine': uname.machine,
+            'python_implementation': platform.python_implementation(),
+            'python_version': platform.python_version(), 'release': uname.release, 'system': uname.system,
+            'cpu': {'count': os.cpu_count()}}
+
+
+def commit_info():
+    # Commit the results were measured on, empty outside a git checkout
+    def git(*args):
+        return subprocess.run(['git'] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    try:
+        return {'id': git('rev-parse', 'HEAD'), 'branch': git('rev-parse', '--abbrev-ref', 'HEAD'),
+                'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except OSError:
+        return {}
+
+
+def compare(results, previous, max_slowdown):
+    # Regressions of results against previous results, matched by benchmark name
+    regressions = []
+    previous_benchmarks = {benchmark['name']: benchmark for benchmark in previous['benchmarks']}
+    print('\n{:<32} {:>12} {:>12} {:>9} {:>14}'.format('compared to previous', 'before ms', 'after ms',
+                                                      'change', 'queries'))
+    for benchmark in results['benchmarks']:
+        before = previous_benchmarks.get(benchmark['name'])
+        if before is None:
+            print('{:<32} {:>12}'.format(benchmark['name'], 'new'))
+            continue
+        if before['params'] != benchmark['params']:
+            print('{:<32} {:>12}'.format(benchmark['name'], 'other sizes'))
+            continue
+
+        old_median, new_median = before['stats']['median'], benchmark['stats']['median']
+        change = (new_median - old_median) / old_median * 100
+        old_queries, new_queries = before['extra_info']['queries'], benchmark['extra_info']['queries']
+        print('{:<32} {:>12.2f} {:>12.2f} {:>+8.1f}% {:>6} -> {:<6}'.format(
+            benchmark['name'], old_median * 1000, new_median * 1000, change, old_queries, new_queries))
+        if change > max_slowdown:
+            regressions.append('{} median is {:.1f}% slower'.format(benchmark['name'], change))
+        if new_queries > old_queries:
+            regressions.append('{} runs {} queries, {} before'.format(benchmark['name'], new_queries, old_queries))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the main helpers on a generated diagram.')
+    parser.add_argument('--depth', type=int, default=3, help='Levels of sub processes')
+    parser.add_argument('--fan-out', type=int, default=4, help='Refined processes per graph')
+    parser.add_argument('--cells', type=int, default=12, help='Items per graph')
+    parser.add_argument('--flows', type=int, default=16, help='Flows per graph')
+    parser.add_argument('--diagrams', type=int, default=100, help='Diagrams listed on the account page')
+    parser.add_argument('--rounds', type=int, default=10, help='Timed rounds per benchmark')
+    parser.add_argument('-k', dest='keyword', default='', help='Only run benchmarks with this in their name')
+    parser.add_argument('--save', help='Write the results to this json file')
+    parser.add_argument('--compare', help='Json results of a previous run to compare with')
+    parser.add_argument('--max-slowdown', type=float, default=20, help='Allowed median slowdown in percent')
+    args = parser.parse_args()
+
+    params = {'depth': args.depth, 'fan_out': args.fan_out, 'cells': args.cells, 'flows': args.flows,
+              'diagrams': args.diagrams}
+    dfd = generate_dfd(args.depth, args.fan_out, args.cells, args.flows)
+    graphs = count_graphs(dfd)
+    print('Generated diagram of {} graphs, {} cells and {} flows each, {} rounds per benchmark'.format(
+        graphs, args.cells, args.flows, args.rounds))
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    results = {'machine_info': machine_info(), 'commit_info': commit_info(), 'benchmarks': [],
+               'datetime': datetime.datetime.utcnow().isoformat(),
+               'version': 'benchmarks.suite {}'.format(SUITE_VERSION)}
+    with app.app_context():
+        reset_db()
+        seed_account(args.diagrams, 5, 20)
+        diagram_id = seed_generated_diagram(dfd, 'Generated diagram')
+        root_id = DataFlowDiagram.query.get(diagram_id).graph
+        benchmarks = make_benchmarks(dfd, diagram_id, root_id, login_client())
+
+        print('{:<32} {:>10} {:>10} {:>10} {:>10} {:>8}'.format('name', 'min ms', 'median ms', 'max ms',
+                                                              'stddev ms', 'queries'))
+        for benchmark in benchmarks:
+            if args.keyword not in benchmark.name:
+                continue
+            data, queries = run_benchmark(benchmark, args.rounds)
+            stats = compute_stats(data)
+            print('{:<32} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}'.format(
+                benchmark.name, stats['min'] * 1000, stats['median'] * 1000, stats['max'] * 1000,
+                stats['stddev'] * 1000, queries))
+            results['benchmarks'].append({
+                'group': benchmark.group, 'name': benchmark.name,
+                'fullname': 'benchmarks/suite.py::{}'.format(benchmark.name), 'params': params,
+                'extra_info': {'queries': queries, 'graphs': graphs},
+                'options': {'timer': 'perf_counter', 'warmup': WARMUP_ROUNDS, 'rounds': args.rounds},
+                'stats': stats})
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=4)
+        print('Saved results to {}'.format(args.save))
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            regressions = compare(results, json.load(previous_file), args.max_slowdown)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        assert not regressions, '{} benchmarks regressed'.format(len(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#=== Run this script to check no query in App.utils does a full table scan ===#
+# Usage: python check_query_plans.py
+# Runs each helper against a scratch DB, explains every query it made and exits with 1 if any scans a table.
+import os
+import re
+import sys
+import tempfile
+
+os.environ.setdefault('DFD_EDIT_SECRET_KEY', 'check_query_plans')
+os.environ['DFD_EDIT_DATABASE_URI'] = 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(prefix='dfd_edit_plans_'), 'plans.db'))
+
+from sqlalchemy import event
+from App import app, db
+from App.models import User, DataFlowDiagram, Invitation, Edit
+from App import utils, revisions, search
+
+# Full table scans, index scans read "SCAN <table> USING [COVERING] INDEX"
+TABLE_SCAN = re.compile(r'^SCAN (TABLE )?(?P<table>\w+)$')
+
+DFD = {'title': 'Context diagram', 'xml_model': '<a><process label="Take order"/></a>', 'children': [
+    {'title': 'Process', 'xml_model': '<b><datastore label="Orders"/></b>', 'children': [
+        {'title': 'Sub process', 'xml_model': '<c/>', 'children': []}]}]}
+
+
+def seed():
+    db.create_all()
+    author = User(username='author', email='author@test.com', password='')
+    editor = User(username='editor', email='editor@test.com', password='')
+    db.session.add_all([author, editor])
+    db.session.flush()
+
+    root = utils.create_graph_and_children(DFD, 0)
+    diagram = DataFlowDiagram(title='Diagram', graph=root, author=author.id)
+    db.session.add(diagram)
+    db.session.flush()
+    db.session.add(Invitation(invited_user=editor.id, invited_to=diagram.id))
+    revision = revisions.add_revision(diagram.id, DFD)
+    db.session.add(Edit(editor=editor.id, edited_diagram=diagram.id, message='Edit', revision=revision.id))
+    db.session.commit()
+    return author, editor, diagram
+
+
+def checks(author, editor, diagram):
+    # (name, call) for each helper, calls consume the returned queries
+    author_id, author_email, editor_id = author.id, author.email, editor.id
+    diagram_id, graph_id = diagram.id, diagram.graph
+    process_id = utils.get_graph_by_path(graph_id, ['Context diagram', 'Process']).id
+    cursor = utils.encode_cursor(diagram.created_on, diagram_id)
+    return [
+        ('get_user_created_diagrams', lambda: utils.get_user_created_diagrams(
+            utils.get_user(author_id)).all()),
+        ('get_user_invited_diagrams', lambda: utils.get_user_invited_diagrams(
+            utils.get_user(editor_id))),
+        ('get_diagram_editors', lambda: utils.get_diagram_editors(diagram_id)),
+        ('get_diagram_edits', lambda: utils.get_diagram_edits(
+            utils.get_diagram(diagram_id)).all()),
+        ('get_latest_edit', lambda: utils.get_latest_edit(diagram_id)),
+        ('get_diagram_author', lambda: utils.get_diagram_author(diagram_id)),
+        ('get_user_by_email', lambda: utils.get_user_by_email(author_email)),
+        ('get_graph_children', lambda: utils.get_graph_children(graph_id).all()),
+        ('load_hierarchy', lambda: utils.load_hierarchy(graph_id)),
+        ('load_hierarchies', lambda: utils.load_hierarchies([graph_id])),
+        ('load_hierarchy_skeleton', lambda: utils.load_hierarchy_skeleton(graph_id)),
+        ('is_graph_in_tree', lambda: utils.is_graph_in_tree(graph_id, graph_id + 2)),
+        ('get_graph_versions', lambda: utils.get_graph_versions(graph_id)),
+        ('get_graph_by_path', lambda: utils.get_graph_by_path(
+            graph_id, ['Context diagram', 'Process', 'Sub process'])),
+        ('search_diagrams', lambda: search.search_diagrams(editor_id, 'take order')),
+        ('search_diagrams[number]', lambda: search.search_diagrams(editor_id, 'process 1.1')),
+        ('get_diagrams_page created', lambda: utils.get_diagrams_page(
+            utils.get_user(author_id), 'created', cursor)),
+        ('get_diagrams_page invited', lambda: utils.get_diagrams_page(
+            utils.get_user(editor_id), 'invited', cursor)),
+        ('get_diagram_edits_page', lambda: utils.get_diagram_edits_page(
+            diagram_id, cursor)),
+        ('is_editor', lambda: utils.is_editor(editor_id, diagram_id)),
+        ('is_author', lambda: utils.is_author(author_id, diagram_id)),
+        ('get_diagram_revisions', lambda: revisions.get_diagram_revisions(
+            diagram_id).all()),
+        ('add_revision', lambda: revisions.add_revision(diagram_id, DFD)),
+        ('save_graph', lambda: utils.save_graph(diagram_id, DFD)),
+        ('save_graph_patches', lambda: utils.save_graph_patches(diagram_id, [
+            {'path': ['Context diagram', 'Process'], 'graph_id': process_id, 'version': 1, 'xml_model': '<d/>'}])),
+        ('add_patch_revision', lambda: revisions.add_patch_revision(
+            diagram_id, [(('Context diagram', 'Process'), '<b/>', '<d/>')])),
+        ('delete_graph_and_children', lambda: utils.delete_graph_and_children(
+            utils.create_graph_and_children(DFD, 0))),
+        ('delete_diagram_by_id', lambda: utils.delete_diagram_by_id(diagram_id)),
+    ]
+
+
+def table_scans(statements, tables):
+    connection = db.engine.raw_connection()
+    scans = set()
+    for statement, parameters in statements:
+        for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters):
+            match = TABLE_SCAN.match(row[-1])
+            if match and match.group('table') in tables:
+                scans.add((match.group('table'), ' '.join(statement.split())))
+    connection.close()
+    return scans
+
+
+def main():
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+            statements.append((statement, parameters))
+
+    tables = set(db.metadata.tables)
+    failed = False
+    with app.app_context():
+        author, editor, diagram = seed()
+        event.listen(db.engine, 'before_cursor_execute', record)
+        for name, call in checks(author, editor, diagram):
+            # Start each check without cached objects so every lookup queries
+            db.session.expunge_all()
+            del statements[:]
+            call()
+            scans = table_scans(statements, tables)
+            print('{:<30} {:>3} queries  {}'.format(name, len(statements), 'FULL SCAN' if scans else 'ok'))
+            for table, statement in sorted(scans):
+                print('    scans {}: {}'.format(table, statement))
+            failed = failed or bool(scans)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,7 @@
 #=== Run this script to create DB for development and fill with demo data ===#
 from App import db, bcrypt
 from App.models import User, DataFlowDiagram, Graph, GraphChildren, Invitation, Edit
+from App.utils import index_graphs
 
 
 # Create tabels
@@ -97,3 +98,7 @@ edit = Edit(editor=user_2.id, edited_diagram=dfd2.id,
 
 db.session.add(edit)
 db.session.commit()
+
+# Index graph labels for search
+index_graphs([(graph, graph.xml_model) for graph in Graph.query])
+db.session.commit()
@@ -0,0 +1,134 @@
+#=== Run this script to bring an existing DB up to date with the models ===#
+# Usage: python migrate_db.py [--compress-xml]
+#   --compress-xml  move inline graph xml into the compressed blob store
+import sys
+from sqlalchemy import bindparam, exists, inspect, text
+from App import app, db
+from App.models import Graph, XmlBlob, SearchTerm
+from App.utils import CHUNK_SIZE, xml_model_hash, index_graphs
+
+
+def column_names(table):
+    return {column['name'] for column in inspect(db.engine).get_columns(table)}
+
+
+def add_xml_blob_store():
+    # Create xml_blob table
+    db.create_all()
+
+    # Reference blobs from graphs
+    if 'xml_hash' not in column_names('graph'):
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE graph ADD COLUMN xml_hash VARCHAR(64) REFERENCES xml_blob (hash)'))
+            connection.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_graph_xml_hash ON graph (xml_hash)'))
+        print('Added graph.xml_hash')
+
+
+def add_revisions():
+    # Create revision table
+    db.create_all()
+
+    # Reference revisions from edits
+    if 'revision' not in column_names('edit'):
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE edit ADD COLUMN revision INTEGER REFERENCES revision (id)'))
+        print('Added edit.revision')
+
+
+def add_graph_versions():
+    if 'version' not in column_names('graph'):
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE graph ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+        print('Added graph.version')
+
+
+def add_child_positions():
+    # Existing children keep their id order at position 0
+    if 'position' not in column_names('graph_children'):
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                'ALTER TABLE graph_children ADD COLUMN position INTEGER NOT NULL DEFAULT 0'))
+        print('Added graph_children.position')
+
+
+def add_missing_indexes():
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                print('Added index {}'.format(index.name))
+
+
+def add_search_index():
+    # Create search_term table and index the stored graphs, saves keep it up to date afterwards.
+    # Chunks are committed as they are indexed and only graphs without terms are read, so an interrupted
+    # run resumes with the graphs left, even if saves indexed newer graphs since.
+    db.create_all()
+
+    indexed = 0
+    last_id = 0
+    unindexed = ~exists().where(SearchTerm.graph == Graph.id)
+    while True:
+        graphs = Graph.query.filter(Graph.id > last_id, unindexed).order_by(Graph.id).limit(CHUNK_SIZE).all()
+        if not graphs:
+            break
+        index_graphs([(graph, graph.xml_model) for graph in graphs])
+        indexed += len(graphs)
+        last_id = graphs[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+
+    if indexed:
+        print('Indexed {} graphs for search'.format(indexed))
+
+
+def compress_xml_models():
+    # Graphs are rewritten with Core updates, which leave their version alone so editors open
+    # during the migration can still save patches. A graph saved meanwhile keeps its inline xml
+    # until the next chunk reads it again.
+    graph = Graph.__table__
+    move = graph.update().where(graph.c.id == bindparam('graph_id')).where(
+        graph.c.version == bindparam('graph_version')).values(xml_model='', xml_hash=bindparam('blob_hash'))
+    moved = 0
+    while True:
+        rows = db.session.query(Graph.id, Graph.version, Graph.xml_text).filter(
+            Graph.xml_hash.is_(None)).limit(CHUNK_SIZE).all()
+        if not rows:
+            break
+        hashes = [xml_model_hash(xml_text) for _, _, xml_text in rows]
+        xml_models = {xml_hash: xml_text for xml_hash, (_, _, xml_text) in zip(hashes, rows)}
+        stored = {xml_hash for xml_hash, in db.session.query(XmlBlob.hash).filter(
+            XmlBlob.hash.in_(list(xml_models)))}
+        db.session.add_all(XmlBlob.from_xml_model(xml_hash, xml_text)
+                           for xml_hash, xml_text in xml_models.items() if xml_hash not in stored)
+        db.session.flush()
+        result = db.session.execute(move, [{'graph_id': graph_id, 'graph_version': version, 'blob_hash': xml_hash}
+                                  for (graph_id, version, _), xml_hash in zip(rows, hashes)])
+        db.session.commit()
+        moved += result.rowcount
+
+    print('Moved {} graphs to {} blobs'.format(moved, XmlBlob.query.count()))
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        add_xml_blob_store()
+        add_revisions()
+        add_graph_versions()
+        add_child_positions()
+        add_missing_indexes()
+        add_search_index()
+        if '--compress-xml' in sys.argv[1:]:
+            compress_xml_models()
+
+            # Reclaim space left by moved xml
+            if db.engine.dialect.name == 'sqlite':
+                connection = db.engine.raw_connection()
+                connection.execute('VACUUM')
+                connection.close()
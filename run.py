@@ -1,5 +1,10 @@
+import os
 from App import app
+from App.exporter import start_parse_pool
 
 
 if __name__ == '__main__':
+    # The reloader's watching process serves no requests
+    if os.environ.get('WERKZEUG_RUN_MAIN'):
+        start_parse_pool()
     app.run(debug=True)
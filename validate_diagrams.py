@@ -0,0 +1,49 @@
+#=== Run this script to check every stored diagram against the DFD rules ===#
+# Usage: python validate_diagrams.py [diagram id ...]
+# Prints the rules each invalid diagram breaks and exits with 1 if any diagram is invalid.
+import sys
+import time
+from App import app, db
+from App.models import DataFlowDiagram
+from App.utils import load_hierarchy
+from App.validator import validate_dfd
+
+# Diagrams read per query, each hierarchy is loaded and released in turn
+BATCH_SIZE = 100
+
+
+def iter_diagrams(ids):
+    # (id, title, root graph) of the diagrams, in id order
+    query = db.session.query(DataFlowDiagram.id, DataFlowDiagram.title, DataFlowDiagram.graph)
+    if ids:
+        query = query.filter(DataFlowDiagram.id.in_(ids))
+    last_id = 0
+    while True:
+        batch = query.filter(DataFlowDiagram.id > last_id).order_by(DataFlowDiagram.id).limit(BATCH_SIZE).all()
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1].id
+
+
+def main(ids):
+    start = time.perf_counter()
+    checked = invalid = 0
+    with app.app_context():
+        for diagram_id, title, graph in iter_diagrams(ids):
+            errors = validate_dfd(load_hierarchy(graph))
+            db.session.expunge_all()
+            checked += 1
+            if errors:
+                invalid += 1
+                print('Diagram {} ({}): {} errors'.format(diagram_id, title, len(errors)))
+                for path, message in errors:
+                    print('    {}: {}'.format(' / '.join(path), message))
+
+    print('{} of {} diagrams invalid, checked in {:.2f} s'.format(
+        invalid, checked, time.perf_counter() - start))
+    return 1 if invalid else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main([int(id) for id in sys.argv[1:]]))